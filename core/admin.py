@@ -4,7 +4,7 @@ from django.contrib.admin import AdminSite
 from django.utils.html import format_html
 from django.urls import reverse
 from django.utils import timezone
-from .models import Company, CustomUser, CTOMapFile, Ticket, TicketMessage, TicketNotification
+from .models import Company, CustomUser, CTOMapFile, Ticket, TicketMessage, TicketNotification, AuditEvent
 
 class RMOnlyAdminSite(AdminSite):
     site_header = "RM Systems Admin"
@@ -39,6 +39,9 @@ class CompanyAdmin(admin.ModelAdmin):
         ('Status', {
             'fields': ('is_active',)
         }),
+        ('Cache de Viabilidade', {
+            'fields': ('viability_cache_ttl_days',)
+        }),
         ('Datas', {
             'fields': ('created_at', 'updated_at'),
             'classes': ('collapse',)
@@ -458,3 +461,20 @@ class TicketNotificationAdmin(admin.ModelAdmin):
         return qs.select_related('ticket', 'recipient', 'created_by')
 
 rm_admin_site.register(TicketNotification, TicketNotificationAdmin)
+
+
+@admin.register(AuditEvent)
+class AuditEventAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'category', 'level', 'action', 'username', 'company_id', 'ip_address')
+    list_filter = ('category', 'level')
+    search_fields = ('action', 'username', 'ip_address')
+    readonly_fields = [f.name for f in AuditEvent._meta.fields]
+
+    # Trilha de auditoria é somente leitura
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+rm_admin_site.register(AuditEvent, AuditEventAdmin)
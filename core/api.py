@@ -6,10 +6,11 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django.contrib.auth import get_user_model
-from django.db.models import Count, Q
+from django.db.models import Count, F, Q
 from django.utils import timezone
 from datetime import timedelta
 
+from .company_stats import companies_with_stats, get_company_stats
 from .models import Company, CTOMapFile
 from .serializers import CompanySerializer, CTOMapFileSerializer, UserSerializer
 from .permissions import IsRMAdmin, IsCompanyAdmin
@@ -26,17 +27,17 @@ class CompanyViewSet(viewsets.ModelViewSet):
     def stats(self, request, pk=None):
         """Estatísticas da empresa"""
         company = self.get_object()
+        company_stats = get_company_stats(company)
         
         stats = {
-            'total_users': User.objects.filter(company=company).count(),
-            'active_users': User.objects.filter(company=company, is_active=True).count(),
-            'total_maps': CTOMapFile.objects.filter(company=company).count(),
+            'total_users': company_stats.total_users,
+            'active_users': company_stats.active_users,
+            'total_maps': company_stats.total_maps,
             'maps_this_month': CTOMapFile.objects.filter(
                 company=company,
                 uploaded_at__gte=timezone.now().replace(day=1)
             ).count(),
-            'last_activity': CTOMapFile.objects.filter(company=company)
-                .order_by('-uploaded_at').first()
+            'last_activity': company_stats.last_upload_at,
         }
         
         return Response(stats)
@@ -70,17 +71,16 @@ class CTOMapFileViewSet(viewsets.ModelViewSet):
         if not request.user.is_rm_admin:
             return Response({'error': 'Acesso negado'}, status=status.HTTP_403_FORBIDDEN)
         
-        companies = Company.objects.annotate(
-            map_count=Count('ctomapfile')
-        ).order_by('-map_count')
+        companies = companies_with_stats().annotate(
+            last_upload=F('stats__last_upload_at')
+        ).order_by('-total_maps')
         
         data = []
         for company in companies:
             data.append({
                 'company': CompanySerializer(company).data,
-                'map_count': company.map_count,
-                'last_upload': CTOMapFile.objects.filter(company=company)
-                    .order_by('-uploaded_at').first()
+                'map_count': company.total_maps,
+                'last_upload': company.last_upload,
             })
         
         return Response(data)
@@ -133,18 +133,14 @@ class UserViewSet(viewsets.ModelViewSet):
         if not request.user.is_rm_admin:
             return Response({'error': 'Acesso negado'}, status=status.HTTP_403_FORBIDDEN)
         
-        companies = Company.objects.annotate(
-            user_count=Count('customuser')
-        ).order_by('-user_count')
+        companies = companies_with_stats().order_by('-total_users')
         
         data = []
         for company in companies:
             data.append({
                 'company': CompanySerializer(company).data,
-                'user_count': company.user_count,
-                'active_users': User.objects.filter(
-                    company=company, is_active=True
-                ).count()
+                'user_count': company.total_users,
+                'active_users': company.active_users,
             })
         
         return Response(data)
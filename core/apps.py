@@ -9,5 +9,11 @@ class CoreConfig(AppConfig):
         # Importar signals para notificações de tickets
         import core.ticket_signals  # noqa: F401
         
+        # Invalidação do cache slug -> Company ao salvar/excluir empresas
+        import core.company_cache  # noqa: F401
+
+        # Totais por empresa (CompanyStats) dos dashboards e relatórios RM
+        import core.company_stats  # noqa: F401
+
         # Ao habilitar o controle de sessão única:
         # import core.signals_single_session  # noqa: F401
@@ -1,30 +1,272 @@
 """
 Sistema de Logs de Auditoria para RM Systems SaaS
+
+A requisição só monta o dicionário do evento e o coloca numa fila (QueueHandler);
+um QueueListener por processo formata o JSON e entrega aos sinks:
+
+- arquivo (AUDIT_LOG_FILE, se o diretório existir) com rotação por tamanho
+  (AUDIT_LOG_MAX_BYTES) e por tempo (AUDIT_LOG_ROTATE_INTERVAL);
+- banco (AUDIT_DB_ENABLED), gravando AuditEvent em lote a cada AUDIT_DB_BATCH
+  eventos ou AUDIT_DB_FLUSH_INTERVAL segundos.
+
+Com AUDIT_LOG_ASYNC=False (testes) os sinks rodam na própria requisição e o banco
+grava evento a evento.
 """
+import atexit
+import ipaddress
 import logging
 import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from django.conf import settings
+from django.db import close_old_connections
 from django.utils import timezone
 from django.contrib.auth import get_user_model
 
+from .models import AuditEvent
+
 User = get_user_model()
+logger = logging.getLogger(__name__)
 
-# Configurar logger de auditoria
+# Configurar logger de auditoria (handlers montados sob demanda por _garantir_pipeline)
 audit_logger = logging.getLogger('audit')
 audit_logger.setLevel(logging.INFO)
 
-# Handler para arquivo de auditoria (opcional)
-import os
-logs_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'logs')
-if os.path.exists(logs_dir):
-    file_handler = logging.FileHandler(os.path.join(logs_dir, 'audit.log'))
-    file_handler.setLevel(logging.INFO)
-    
-    # Formatter para logs estruturados
-    formatter = logging.Formatter(
-        '%(asctime)s - %(levelname)s - %(message)s'
+
+class AuditJsonFormatter(logging.Formatter):
+    """Serializa o evento estruturado (record.audit) no sink, fora da thread da requisição"""
+
+    def format(self, record):
+        audit = getattr(record, 'audit', None)
+        if audit is not None:
+            record.msg = json.dumps(audit, ensure_ascii=False, default=str)
+            record.args = None
+        return super().format(record)
+
+
+class SizeAndTimeRotatingFileHandler(RotatingFileHandler):
+    """RotatingFileHandler que também rotaciona a cada `interval` segundos"""
+
+    def __init__(self, filename, maxBytes=0, backupCount=0, interval=86400, encoding='utf-8'):
+        super().__init__(filename, maxBytes=maxBytes, backupCount=backupCount, encoding=encoding, delay=True)
+        self.interval = interval
+        self.rollover_at = self._proximo_rollover(time.time())
+
+    def _proximo_rollover(self, agora):
+        if not self.interval:
+            return float('inf')
+        return (agora // self.interval + 1) * self.interval
+
+    def shouldRollover(self, record):
+        if time.time() >= self.rollover_at:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self.rollover_at = self._proximo_rollover(time.time())
+
+
+def _ip_valido(ip_address):
+    if not ip_address:
+        return None
+    try:
+        return str(ipaddress.ip_address(ip_address))
+    except ValueError:
+        return None
+
+
+def _evento(record, audit):
+    """AuditEvent (não salvo) a partir do registro de log"""
+    criado_em = datetime.fromtimestamp(record.created, tz=dt_timezone.utc)
+    resource_id = audit.get('resource_id')
+    return AuditEvent(
+        month=criado_em.date().replace(day=1),
+        created_at=criado_em,
+        category=getattr(record, 'audit_category', ''),
+        level=record.levelname.lower(),
+        action=str(audit.get('action') or audit.get('event_type') or '')[:100],
+        user_id=audit.get('user_id'),
+        username=str(audit.get('username') or '')[:150],
+        company_id=audit.get('company_id'),
+        ip_address=_ip_valido(audit.get('ip_address')),
+        resource_type=str(audit.get('resource_type') or '')[:50],
+        resource_id='' if resource_id is None else str(resource_id)[:64],
+        details=audit.get('details') or {},
+    )
+
+
+class AuditDatabaseHandler(logging.Handler):
+    """Acumula eventos e grava AuditEvent em lote com um único bulk_create"""
+
+    def __init__(self, batch_size=100, manage_connections=False):
+        super().__init__(level=logging.INFO)
+        self.batch_size = max(1, batch_size)
+        # Na thread do listener a conexão é dela; na requisição não pode ser fechada
+        self.manage_connections = manage_connections
+        self._pendentes = []
+
+    def emit(self, record):
+        audit = getattr(record, 'audit', None)
+        if audit is None:
+            return
+        self._pendentes.append(_evento(record, audit))
+        if len(self._pendentes) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        self.acquire()
+        try:
+            eventos, self._pendentes = self._pendentes, []
+        finally:
+            self.release()
+        if not eventos:
+            return
+        if self.manage_connections:
+            close_old_connections()
+        try:
+            AuditEvent.objects.bulk_create(eventos)
+        except Exception as e:
+            logger.error(f"Erro ao gravar {len(eventos)} evento(s) de auditoria em lote: {str(e)}")
+        finally:
+            if self.manage_connections:
+                close_old_connections()
+
+
+class AuditQueueListener(QueueListener):
+    """QueueListener que descarrega os sinks a cada `flush_interval` segundos"""
+
+    def __init__(self, fila, *handlers, flush_interval=2.0):
+        super().__init__(fila, *handlers, respect_handler_level=True)
+        self.flush_interval = flush_interval
+        self._ultimo_flush = time.monotonic()
+
+    def dequeue(self, block):
+        while True:
+            try:
+                return self.queue.get(block, self.flush_interval)
+            except queue.Empty:
+                if not block:
+                    raise
+                self.flush()
+
+    def handle(self, record):
+        super().handle(record)
+        if time.monotonic() - self._ultimo_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self._ultimo_flush = time.monotonic()
+        for handler in self.handlers:
+            try:
+                handler.flush()
+            except Exception as e:
+                logger.exception(f"Erro ao descarregar sink de auditoria: {str(e)}")
+
+
+_lock = threading.Lock()
+# (configuração, pid, handlers no logger, listener, sinks)
+_pipeline = None
+
+
+def _configuracao():
+    return (
+        getattr(settings, 'AUDIT_LOG_ASYNC', True),
+        getattr(settings, 'AUDIT_LOG_FILE', os.path.join(settings.BASE_DIR, 'logs', 'audit.log')),
+        getattr(settings, 'AUDIT_LOG_MAX_BYTES', 10 * 1024 * 1024),
+        getattr(settings, 'AUDIT_LOG_BACKUP_COUNT', 10),
+        getattr(settings, 'AUDIT_LOG_ROTATE_INTERVAL', 86400),
+        getattr(settings, 'AUDIT_DB_ENABLED', False),
+        getattr(settings, 'AUDIT_DB_BATCH', 100),
+        getattr(settings, 'AUDIT_DB_FLUSH_INTERVAL', 2),
+    )
+
+
+def _montar(configuracao):
+    assincrono, arquivo, max_bytes, backups, intervalo, banco, lote, flush_intervalo = configuracao
+    sinks = []
+    # Como antes: arquivo só quando o diretório de logs existe
+    if arquivo and os.path.isdir(os.path.dirname(str(arquivo))):
+        file_handler = SizeAndTimeRotatingFileHandler(
+            str(arquivo), maxBytes=max_bytes, backupCount=backups, interval=intervalo
+        )
+        file_handler.setLevel(logging.INFO)
+        file_handler.setFormatter(AuditJsonFormatter('%(asctime)s - %(levelname)s - %(message)s'))
+        sinks.append(file_handler)
+    if banco:
+        sinks.append(AuditDatabaseHandler(
+            batch_size=lote if assincrono else 1,
+            manage_connections=assincrono,
+        ))
+
+    if not sinks:
+        return [], None, []
+    if not assincrono:
+        for sink in sinks:
+            audit_logger.addHandler(sink)
+        return sinks, None, sinks
+
+    fila = queue.Queue(-1)
+    listener = AuditQueueListener(fila, *sinks, flush_interval=flush_intervalo)
+    listener.start()
+    queue_handler = QueueHandler(fila)
+    audit_logger.addHandler(queue_handler)
+    return [queue_handler], listener, sinks
+
+
+def _desmontar(pipeline, descarregar=True):
+    _, _, handlers, listener, sinks = pipeline
+    for handler in handlers:
+        audit_logger.removeHandler(handler)
+    if not descarregar:
+        # Pipeline herdado do processo pai (fork): o buffer é dele, não deste processo
+        return
+    if listener is not None:
+        listener.stop()
+    for sink in sinks:
+        sink.flush()
+        sink.close()
+
+
+def _garantir_pipeline():
+    """Monta o pipeline deste processo (de novo após fork ou mudança de configuração)"""
+    global _pipeline
+    configuracao = _configuracao()
+    pid = os.getpid()
+    atual = _pipeline
+    if atual is not None and atual[0] == configuracao and atual[1] == pid:
+        return
+    with _lock:
+        atual = _pipeline
+        if atual is not None and atual[0] == configuracao and atual[1] == pid:
+            return
+        if atual is not None:
+            _desmontar(atual, descarregar=atual[1] == pid)
+        _pipeline = (configuracao, pid) + tuple(_montar(configuracao))
+
+
+@atexit.register
+def encerrar():
+    """Para o listener e grava os eventos pendentes"""
+    global _pipeline
+    with _lock:
+        atual, _pipeline = _pipeline, None
+        if atual is not None and atual[1] == os.getpid():
+            _desmontar(atual)
+
+
+def _registrar(level, category, log_data):
+    _garantir_pipeline()
+    audit_logger.log(
+        level,
+        log_data.get('action') or log_data.get('event_type') or category,
+        extra={'audit': log_data, 'audit_category': category},
     )
-    file_handler.setFormatter(formatter)
-    audit_logger.addHandler(file_handler)
 
 class AuditLogger:
     """Classe para gerenciar logs de auditoria"""
@@ -43,13 +285,14 @@ class AuditLogger:
         log_data = {
             'user_id': user.id if user else None,
             'username': user.username if user else 'anonymous',
+            'company_id': getattr(user, 'company_id', None),
             'action': action,
             'timestamp': timezone.now().isoformat(),
             'ip_address': ip_address,
             'details': details or {}
         }
         
-        audit_logger.info(json.dumps(log_data, ensure_ascii=False))
+        _registrar(logging.INFO, 'user_action', log_data)
     
     @staticmethod
     def log_security_event(event_type, details=None, ip_address=None):
@@ -68,7 +311,7 @@ class AuditLogger:
             'details': details or {}
         }
         
-        audit_logger.warning(json.dumps(log_data, ensure_ascii=False))
+        _registrar(logging.WARNING, 'security', log_data)
     
     @staticmethod
     def log_data_access(user, resource_type, resource_id, action, details=None):
@@ -85,6 +328,7 @@ class AuditLogger:
         log_data = {
             'user_id': user.id,
             'username': user.username,
+            'company_id': getattr(user, 'company_id', None),
             'resource_type': resource_type,
             'resource_id': resource_id,
             'action': action,
@@ -92,7 +336,7 @@ class AuditLogger:
             'details': details or {}
         }
         
-        audit_logger.info(json.dumps(log_data, ensure_ascii=False))
+        _registrar(logging.INFO, 'data_access', log_data)
 
 # Funções de conveniência
 def log_login(user, ip_address=None):
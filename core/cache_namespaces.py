@@ -0,0 +1,74 @@
+"""
+Namespaces de cache com contador de geração.
+
+Cada escopo (empresa, mapa, painel RM) tem um contador de geração no cache e toda
+chave derivada do escopo embute a geração atual. Invalidar tudo que depende do
+escopo é um único incremento atômico: as chaves antigas deixam de ser lidas e
+expiram sozinhas, sem enumerar usuários ou variações de chave.
+"""
+import time
+
+from django.core.cache import cache
+
+RM_NAMESPACE = 'rm'
+
+
+def company_namespace(company_id):
+    return f'company_{company_id}'
+
+
+def map_namespace(map_id):
+    return f'map_{map_id}'
+
+
+def viability_namespace(company_id):
+    """Resultados de viabilidade da empresa ainda em memória (fila de escrita e LRU dos workers)"""
+    return f'viabilidade_{company_id}'
+
+
+def _generation_key(namespace):
+    return f'ns_gen:{namespace}'
+
+
+def get_generation(namespace):
+    """Geração atual do namespace (criada na primeira leitura)"""
+    gen_key = _generation_key(namespace)
+    generation = cache.get(gen_key)
+    if generation is None:
+        # Semente pelo relógio: se o contador for despejado, a geração recriada
+        # não coincide com a de chaves (ou caches locais) antigas ainda vivas
+        cache.add(gen_key, time.time_ns(), None)
+        generation = cache.get(gen_key)
+    return generation
+
+
+def get_generations(*namespaces):
+    """Gerações de vários namespaces numa única ida ao cache"""
+    keys = {_generation_key(namespace): namespace for namespace in namespaces}
+    found = cache.get_many(list(keys))
+    generations = {}
+    for gen_key, namespace in keys.items():
+        if gen_key in found:
+            generations[namespace] = found[gen_key]
+        else:
+            generations[namespace] = get_generation(namespace)
+    return generations
+
+
+def bump_generation(namespace):
+    """Invalida todas as chaves do namespace; retorna a nova geração"""
+    gen_key = _generation_key(namespace)
+    cache.add(gen_key, time.time_ns(), None)
+    try:
+        return cache.incr(gen_key)
+    except ValueError:
+        generation = time.time_ns()
+        cache.set(gen_key, generation, None)
+        return generation
+
+
+def make_key(namespace, name, generation=None):
+    """Chave `name` dentro do namespace, na geração informada ou na atual"""
+    if generation is None:
+        generation = get_generation(namespace)
+    return f'{name}:{namespace}:g{generation}'
@@ -0,0 +1,95 @@
+"""
+Cache de resolução slug -> Company.
+
+Toda requisição de empresa resolve o slug no middleware, no decorator de permissão
+e de novo na view. A resolução passa por duas camadas: um dicionário local do
+processo e o cache do Django (Redis em produção), ambos chaveados pela geração do
+namespace COMPANIES_NAMESPACE (core.cache_namespaces). Salvar ou excluir uma
+empresa avança a geração, invalidando as entradas de todos os workers; a leitura
+local custa só o GET da geração. Slugs inexistentes também são cacheados (rotas
+como /verificador/ passam pelo middleware a cada requisição).
+
+As instâncias devolvidas são cópias: alterá-las não afeta o cache.
+"""
+import copy
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.http import Http404
+
+from .cache_namespaces import bump_generation, get_generation, make_key
+from .models import Company
+
+COMPANIES_NAMESPACE = 'companies'
+
+# Marcador de slug inexistente no cache (None significa "não cacheado")
+_MISSING = 'missing'
+_LOCAL_MAX_ENTRIES = 1024
+
+_lock = threading.Lock()
+_local = OrderedDict()
+
+
+def _store_local(slug_key, value, generation):
+    with _lock:
+        _local[slug_key] = (value, generation)
+        _local.move_to_end(slug_key)
+        while len(_local) > _LOCAL_MAX_ENTRIES:
+            _local.popitem(last=False)
+
+
+def get_company_by_slug(slug, exact=False):
+    """
+    Empresa do slug (ativa ou não; quem chama verifica is_active) ou None.
+
+    Args:
+        slug: Slug da URL (comparação sem diferenciar maiúsculas, como no middleware)
+        exact: Exigir o slug exatamente igual, como Company.objects.get(slug=...)
+    """
+    if not slug:
+        return None
+    slug_key = slug.lower()
+    generation = get_generation(COMPANIES_NAMESPACE)
+
+    with _lock:
+        item = _local.get(slug_key)
+    if item is not None and item[1] == generation:
+        found = item[0]
+    else:
+        cache_key = make_key(COMPANIES_NAMESPACE, f'company_slug:{slug_key}', generation)
+        found = cache.get(cache_key)
+        if found is None:
+            found = Company.objects.filter(slug__iexact=slug_key).first() or _MISSING
+            cache.set(cache_key, found, getattr(settings, 'COMPANY_CACHE_TIMEOUT', 3600))
+        _store_local(slug_key, found, generation)
+
+    if isinstance(found, str) or (exact and found.slug != slug):
+        return None
+    return copy.copy(found)
+
+
+def get_company_or_404(slug):
+    """Equivalente a get_object_or_404(Company, slug=slug) passando pelo cache"""
+    company = get_company_by_slug(slug, exact=True)
+    if company is None:
+        raise Http404("Empresa não encontrada")
+    return company
+
+
+def invalidate_companies():
+    """Invalida a resolução de todos os slugs em todos os workers"""
+    return bump_generation(COMPANIES_NAMESPACE)
+
+
+@receiver(post_save, sender=Company)
+@receiver(post_delete, sender=Company)
+def _company_changed(sender, instance, **kwargs):
+    # Na hora (a própria transação já enxerga a alteração) e de novo após o commit:
+    # entre os dois, outro worker pode ter recacheado a versão antiga do banco
+    invalidate_companies()
+    transaction.on_commit(invalidate_companies)
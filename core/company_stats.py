@@ -0,0 +1,220 @@
+"""
+Totais por empresa (CompanyStats) para os dashboards e relatórios RM.
+
+As telas RM liam usuários, mapas e tickets de cada empresa com vários count() por
+empresa a cada acesso. Agora cada alteração de CustomUser, CTOMapFile ou Ticket
+agenda, após o commit, a recontagem só da empresa afetada (poucas agregações
+indexadas) e as telas leem a tabela inteira em uma consulta, com qualquer número
+de empresas.
+
+Alterações que não passam por post_save/post_delete (update() em lote, bulk_create,
+SQL direto) só são vistas pelo comando reconcile_company_stats, que recalcula
+tudo com uma consulta agrupada por modelo e corrige as linhas divergentes. A
+ingestão de mapas grava com update() e por isso avisa via map_processed.
+"""
+import logging
+
+from django.db import transaction
+from django.db.models import Count, IntegerField, Max, Q, Sum, Value
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .map_signals import map_processed
+from .models import Company, CompanyStats, CTOMapFile, CustomUser, Ticket
+
+logger = logging.getLogger(__name__)
+
+CLOSED_TICKET_STATUSES = ('resolvido', 'fechado')
+
+# Campos que alteram os totais; save(update_fields=...) sem nenhum deles não reconta
+# (ex.: last_login a cada login)
+_TRACKED_FIELDS = {
+    CustomUser: {'company', 'company_id', 'is_active'},
+    CTOMapFile: {'company', 'company_id', 'is_processed', 'uploaded_at'},
+    Ticket: {'company', 'company_id', 'status'},
+}
+
+# Campos de contagem (os que somam nos totais gerais)
+COUNTERS = (
+    'total_users', 'active_users', 'total_maps', 'processed_maps',
+    'pending_maps', 'total_tickets', 'open_tickets',
+)
+
+
+def _compute(company_ids=None):
+    """{company_id: valores de CompanyStats} recontados do banco (uma consulta por modelo)"""
+    def agrupar(queryset, **agregados):
+        if company_ids is not None:
+            queryset = queryset.filter(company_id__in=company_ids)
+        return queryset.filter(company__isnull=False).values('company_id').annotate(**agregados)
+
+    valores = {}
+
+    def linha(company_id):
+        if company_id not in valores:
+            valores[company_id] = {campo: 0 for campo in COUNTERS}
+            valores[company_id]['last_upload_at'] = None
+        return valores[company_id]
+
+    for row in agrupar(
+        CustomUser.objects.order_by(),
+        total=Count('id'),
+        ativos=Count('id', filter=Q(is_active=True)),
+    ):
+        item = linha(row['company_id'])
+        item['total_users'] = row['total']
+        item['active_users'] = row['ativos']
+
+    for row in agrupar(
+        CTOMapFile.objects.order_by(),
+        total=Count('id'),
+        processados=Count('id', filter=Q(is_processed=True)),
+        ultimo=Max('uploaded_at'),
+    ):
+        item = linha(row['company_id'])
+        item['total_maps'] = row['total']
+        item['processed_maps'] = row['processados']
+        item['pending_maps'] = row['total'] - row['processados']
+        item['last_upload_at'] = row['ultimo']
+
+    for row in agrupar(
+        Ticket.objects.order_by(),
+        total=Count('id'),
+        abertos=Count('id', filter=~Q(status__in=CLOSED_TICKET_STATUSES)),
+    ):
+        item = linha(row['company_id'])
+        item['total_tickets'] = row['total']
+        item['open_tickets'] = row['abertos']
+
+    return valores
+
+
+def _vazio():
+    valores = {campo: 0 for campo in COUNTERS}
+    valores['last_upload_at'] = None
+    return valores
+
+
+def refresh(company_id):
+    """Recalcula e grava o CompanyStats da empresa; None se a empresa não existe mais"""
+    if not Company.objects.filter(id=company_id).exists():
+        return None
+    valores = _compute([company_id]).get(company_id) or _vazio()
+    stats, _ = CompanyStats.objects.update_or_create(company_id=company_id, defaults=valores)
+    return stats
+
+
+def reconcile(company_ids=None):
+    """
+    Recalcula as estatísticas (de todas as empresas ou das informadas) e corrige
+    as linhas ausentes ou divergentes.
+
+    Returns:
+        Quantidade de linhas criadas ou corrigidas
+    """
+    empresas = Company.objects.order_by()
+    if company_ids is not None:
+        empresas = empresas.filter(id__in=company_ids)
+    ids = list(empresas.values_list('id', flat=True))
+    calculados = _compute(ids)
+    atuais = CompanyStats.objects.in_bulk(ids)
+    campos = COUNTERS + ('last_upload_at',)
+
+    novos, alterados = [], []
+    for company_id in ids:
+        valores = calculados.get(company_id) or _vazio()
+        stats = atuais.get(company_id)
+        if stats is None:
+            novos.append(CompanyStats(company_id=company_id, **valores))
+        elif any(getattr(stats, campo) != valores[campo] for campo in campos):
+            for campo in campos:
+                setattr(stats, campo, valores[campo])
+            alterados.append(stats)
+
+    with transaction.atomic():
+        CompanyStats.objects.bulk_create(novos, batch_size=500)
+        # bulk_update não aplica auto_now
+        CompanyStats.objects.bulk_update(alterados, campos, batch_size=500)
+        if alterados:
+            CompanyStats.objects.filter(company_id__in=[s.company_id for s in alterados]).update(
+                updated_at=timezone.now()
+            )
+    if alterados:
+        logger.info(f"CompanyStats divergente corrigido para {len(alterados)} empresa(s)")
+    return len(novos) + len(alterados)
+
+
+def get_company_stats(company):
+    """CompanyStats da empresa, recalculado na hora se ainda não existir"""
+    stats = CompanyStats.objects.filter(company_id=company.id).first()
+    return stats or refresh(company.id) or CompanyStats(company=company)
+
+
+def companies_with_stats(queryset=None):
+    """Empresas anotadas com os contadores do CompanyStats (um único JOIN; 0 se sem linha)"""
+    if queryset is None:
+        queryset = Company.objects.all()
+    return queryset.annotate(**{
+        campo: Coalesce(f'stats__{campo}', Value(0), output_field=IntegerField())
+        for campo in COUNTERS
+    })
+
+
+def totals():
+    """Soma dos contadores de todas as empresas (uma consulta)"""
+    somas = CompanyStats.objects.aggregate(**{campo: Sum(campo) for campo in COUNTERS})
+    return {campo: valor or 0 for campo, valor in somas.items()}
+
+
+def schedule_refresh(company_id):
+    """Recalcula a empresa após o commit (na hora, fora de transação)"""
+    if company_id:
+        transaction.on_commit(lambda: refresh(company_id))
+
+
+def _excluindo_empresa(kwargs):
+    # Exclusão em cascata de uma empresa: o CompanyStats vai junto, não há o que recontar
+    origem = kwargs.get('origin')
+    return isinstance(origem, Company) or getattr(origem, 'model', None) is Company
+
+
+@receiver(post_save, sender=Company)
+def _company_saved(sender, instance, created, **kwargs):
+    if created:
+        CompanyStats.objects.get_or_create(company=instance)
+
+
+@receiver(post_init, sender=CustomUser)
+@receiver(post_init, sender=CTOMapFile)
+@receiver(post_init, sender=Ticket)
+def _tenant_row_loaded(sender, instance, **kwargs):
+    # Empresa carregada do banco, para recontar também a anterior se ela mudar
+    instance._stats_company_id = instance.__dict__.get('company_id')
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_save, sender=CTOMapFile)
+@receiver(post_save, sender=Ticket)
+def _tenant_row_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields and not _TRACKED_FIELDS[sender].intersection(update_fields):
+        return
+    schedule_refresh(instance.company_id)
+    anterior = getattr(instance, '_stats_company_id', None)
+    if anterior and anterior != instance.company_id:
+        schedule_refresh(anterior)
+    instance._stats_company_id = instance.company_id
+
+
+@receiver(post_delete, sender=CustomUser)
+@receiver(post_delete, sender=CTOMapFile)
+@receiver(post_delete, sender=Ticket)
+def _tenant_row_deleted(sender, instance, **kwargs):
+    if not _excluindo_empresa(kwargs):
+        schedule_refresh(instance.company_id)
+
+
+@receiver(map_processed, sender=CTOMapFile)
+def _map_processed(sender, instance, **kwargs):
+    schedule_refresh(instance.company_id)
@@ -0,0 +1,171 @@
+"""
+Fila de ingestão em segundo plano para mapas CTO.
+
+O upload apenas grava o arquivo e cria o CTOMapFile com processing_status='pending';
+a validação completa, a leitura das coordenadas e o cálculo do score são feitos
+por um pool de workers, e a interface acompanha pelo endpoint de status.
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .map_signals import map_processed
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    """Cria o pool de workers sob demanda (um por processo)"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                workers = getattr(settings, 'MAP_INGESTION_WORKERS', 2)
+                _executor = ThreadPoolExecutor(
+                    max_workers=max(1, workers),
+                    thread_name_prefix='map-ingestion'
+                )
+    return _executor
+
+
+def enqueue_map_ingestion(cto_file_id, user_id):
+    """
+    Agenda o processamento de um mapa após o commit da transação atual.
+
+    Com MAP_INGESTION_ASYNC=False o processamento roda na própria thread
+    (útil em testes e em ambientes sem threads).
+    """
+    def _submit():
+        if getattr(settings, 'MAP_INGESTION_ASYNC', True):
+            _get_executor().submit(_run_in_worker, cto_file_id, user_id)
+        else:
+            process_map_file(cto_file_id, user_id)
+
+    transaction.on_commit(_submit)
+
+
+def _run_in_worker(cto_file_id, user_id):
+    """Executa o processamento garantindo conexões de banco limpas na thread"""
+    close_old_connections()
+    try:
+        process_map_file(cto_file_id, user_id)
+    except Exception as e:
+        logger.exception(f"Erro inesperado na ingestão do mapa {cto_file_id}: {str(e)}")
+    finally:
+        close_old_connections()
+
+
+def reclaim_stale_maps(stale_after=None, company_slug=None):
+    """
+    Devolve à fila ('pending') os mapas presos em 'processing' há mais de `stale_after`
+    segundos (padrão MAP_INGESTION_STALE_S): o pool é do processo, então um worker
+    reciclado (max_requests) ou morto no meio da análise perde os jobs em andamento.
+
+    Returns:
+        Quantidade de mapas devolvidos à fila
+    """
+    from .models import CTOMapFile
+
+    if stale_after is None:
+        stale_after = getattr(settings, 'MAP_INGESTION_STALE_S', 1800)
+    agora = timezone.now()
+    maps = CTOMapFile.objects.filter(
+        processing_status='processing',
+        updated_at__lt=agora - timedelta(seconds=stale_after)
+    )
+    if company_slug:
+        maps = maps.filter(company__slug=company_slug)
+    reclaimed = maps.update(processing_status='pending', updated_at=agora)
+    if reclaimed:
+        logger.warning(f"{reclaimed} mapa(s) presos em processamento devolvidos à fila")
+    return reclaimed
+
+
+def process_map_file(cto_file_id, user_id=None):
+    """
+    Valida, lê e pontua um CTOMapFile já armazenado, atualizando seu status.
+
+    Returns:
+        True se o mapa foi processado com sucesso, False caso contrário
+    """
+    from .models import CTOMapFile, CustomUser
+    from .verificador_service import VerificadorService
+
+    # Marcar como "processando" apenas se ainda estiver pendente (evita trabalho duplicado).
+    # Mapas recusados ('failed') não voltam à fila: o arquivo já foi descartado
+    claimed = CTOMapFile.objects.filter(
+        id=cto_file_id,
+        processing_status='pending'
+    ).update(processing_status='processing', updated_at=timezone.now())
+    if not claimed:
+        logger.info(f"Mapa {cto_file_id} não está pendente; ingestão ignorada")
+        return False
+
+    cto_file = CTOMapFile.objects.select_related('company', 'uploaded_by').get(id=cto_file_id)
+    user = CustomUser.objects.filter(id=user_id).first() if user_id else None
+    user = user or cto_file.uploaded_by
+
+    try:
+        file_path = cto_file.file.path
+        with open(file_path, 'rb') as fh:
+            # Nome sem diretório para passar nas validações de nome do SecureFileValidator
+            stored_file = File(fh, name=os.path.basename(cto_file.file.name))
+            result = VerificadorService.verificar_arquivo(stored_file, cto_file.company, user)
+    except Exception as e:
+        logger.error(f"Erro ao abrir mapa {cto_file_id} para ingestão: {str(e)}")
+        result = {'success': False, 'error': f'Erro no processamento: {str(e)}'}
+
+    if result.get('success'):
+        results = result.get('results', {})
+        fields = {
+            'processing_status': 'completed',
+            'is_processed': True,
+            'processed_at': timezone.now(),
+            'analysis_id': result.get('analysis_id', ''),
+            'viability_score': results.get('viability_score'),
+            'analysis_results': results,
+            'issues_found': results.get('issues', []),
+            'recommendations': results.get('recommendations', []),
+            'coordinates_count': results.get('coordinates_count', 0),
+            'processing_time': results.get('processing_time'),
+            'description': f"Análise concluída - {results.get('viability_score', 'N/A')} pontos",
+        }
+        if results.get('file_info'):
+            fields['file_size'] = results['file_info'].get('size')
+            if results['file_info'].get('sha256'):
+                fields['content_hash'] = results['file_info']['sha256']
+    else:
+        fields = {
+            'processing_status': 'failed',
+            'is_processed': False,
+            'issues_found': [result.get('error', 'Erro desconhecido na análise')],
+            'description': "Análise falhou",
+            'file': '',
+        }
+        # Arquivo recusado não fica no storage (nem ao alcance de leitores ou do reprocessamento)
+        try:
+            cto_file.file.delete(save=False)
+        except Exception as e:
+            logger.error(f"Erro ao remover arquivo do mapa {cto_file_id} recusado: {str(e)}")
+
+    # update() evita reexecutar CTOMapFile.clean() (permissões do usuário) fora do request
+    CTOMapFile.objects.filter(id=cto_file.id).update(updated_at=timezone.now(), **fields)
+
+    if fields['processing_status'] == 'completed':
+        # update() não dispara post_save: avisa o registro de invalidação de caches
+        map_processed.send(sender=CTOMapFile, instance=cto_file)
+        logger.info(f"Mapa {cto_file_id} processado com sucesso")
+        return True
+
+    logger.warning(f"Falha na ingestão do mapa {cto_file_id}: {fields['issues_found']}")
+    return False
@@ -0,0 +1,47 @@
+"""
+Comando Django para incorporar aos arquivos dos mapas as edições de CTOs
+pendentes no journal (ftth_viewer.CTOEdit). Pode ser agendado via cron.
+"""
+from django.core.management.base import BaseCommand
+from ftth_viewer.journal import compactar_mapa
+from ftth_viewer.models import CTOEdit
+
+
+class Command(BaseCommand):
+    help = 'Compacta o journal de edições de CTOs nos arquivos dos mapas'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--company',
+            type=str,
+            help='Slug da empresa (padrão: todas)',
+        )
+        parser.add_argument(
+            '--map-id',
+            type=int,
+            help='Compactar apenas este mapa',
+        )
+
+    def handle(self, *args, **options):
+        edicoes = CTOEdit.objects.filter(compactado=False)
+        if options.get('company'):
+            edicoes = edicoes.filter(mapa__company__slug=options['company'])
+        if options.get('map_id'):
+            edicoes = edicoes.filter(mapa_id=options['map_id'])
+
+        map_ids = sorted(set(edicoes.values_list('mapa_id', flat=True)))
+        if not map_ids:
+            self.stdout.write(self.style.SUCCESS('✓ Nenhuma edição pendente.'))
+            return
+
+        total = 0
+        for map_id in map_ids:
+            aplicadas = compactar_mapa(map_id, aguardar=True)
+            if aplicadas is None:
+                self.stdout.write(self.style.WARNING(f'⚠️  Mapa {map_id} não foi compactado'))
+                continue
+            total += aplicadas
+
+        self.stdout.write(
+            self.style.SUCCESS(f'✓ {total} edição(ões) incorporada(s) em {len(map_ids)} mapa(s).')
+        )
@@ -0,0 +1,53 @@
+"""
+Comando Django para processar mapas CTO que ficaram pendentes na fila de ingestão
+(ex.: servidor reiniciado antes de o worker concluir a análise). Mapas presos em
+'processing' além do tempo limite (worker reciclado ou morto) voltam para a fila
+e são processados também. Pode ser agendado via cron.
+"""
+from django.core.management.base import BaseCommand
+from core.ingestion import process_map_file, reclaim_stale_maps
+from core.models import CTOMapFile
+
+
+class Command(BaseCommand):
+    help = 'Processa mapas CTO com análise pendente'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--company',
+            type=str,
+            help='Slug da empresa (padrão: todas)',
+        )
+        parser.add_argument(
+            '--stale-after',
+            type=int,
+            help='Segundos em processamento para considerar o mapa abandonado (padrão: MAP_INGESTION_STALE_S)',
+        )
+
+    def handle(self, *args, **options):
+        reclaimed = reclaim_stale_maps(options.get('stale_after'), options.get('company'))
+        if reclaimed:
+            self.stdout.write(self.style.WARNING(
+                f'⚠️  {reclaimed} mapa(s) presos em processamento devolvidos à fila'
+            ))
+
+        # Mapas recusados ('failed') têm o arquivo descartado: só um novo upload os substitui
+        maps = CTOMapFile.objects.filter(processing_status='pending')
+        if options.get('company'):
+            maps = maps.filter(company__slug=options['company'])
+
+        map_ids = list(maps.values_list('id', 'uploaded_by_id'))
+        if not map_ids:
+            self.stdout.write(self.style.SUCCESS('✓ Nenhum mapa pendente.'))
+            return
+
+        ok = 0
+        for map_id, user_id in map_ids:
+            if process_map_file(map_id, user_id):
+                ok += 1
+            else:
+                self.stdout.write(self.style.WARNING(f'⚠️  Mapa {map_id} não foi processado'))
+
+        self.stdout.write(
+            self.style.SUCCESS(f'✓ {ok}/{len(map_ids)} mapa(s) processado(s).')
+        )
@@ -0,0 +1,49 @@
+"""
+Comando Django para aplicar a política de retenção do cache de viabilidade
+(validade por empresa, tamanho máximo e descarte da geometria das rotas).
+Apaga em lotes curtos para não travar a tabela; pode ser agendado via cron.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from core.models import Company
+from ftth_viewer.retention import purgar_viabilidade
+
+
+class Command(BaseCommand):
+    help = 'Purga o cache de viabilidade conforme a política de retenção'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--company',
+            type=str,
+            help='Slug da empresa (padrão: todas)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Linhas por lote/transação (padrão: 1000)',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=0,
+            help='Segundos de pausa entre lotes (padrão: 0)',
+        )
+
+    def handle(self, *args, **options):
+        company = None
+        if options.get('company'):
+            company = Company.objects.filter(slug=options['company']).first()
+            if company is None:
+                raise CommandError(f"Empresa '{options['company']}' não encontrada")
+
+        totais = purgar_viabilidade(
+            company=company,
+            lote=max(1, options['batch_size']),
+            pausa=max(0, options['sleep']),
+        )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✓ {totais['expiradas']} expirada(s), {totais['excedentes']} acima do limite, "
+            f"{totais['sem_geometria']} geometria(s) descartada(s)."
+        ))
@@ -0,0 +1,33 @@
+"""
+Comando Django para recalcular os totais por empresa (CompanyStats) e corrigir
+divergências deixadas por alterações que não disparam signals (update() em lote,
+bulk_create, SQL direto). Pode ser agendado via cron.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from core.company_stats import reconcile
+from core.models import Company
+
+
+class Command(BaseCommand):
+    help = 'Recalcula as estatísticas por empresa (CompanyStats) e corrige divergências'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--company',
+            type=str,
+            help='Slug da empresa (padrão: todas)',
+        )
+
+    def handle(self, *args, **options):
+        company_ids = None
+        if options.get('company'):
+            company = Company.objects.filter(slug=options['company']).first()
+            if company is None:
+                raise CommandError(f"Empresa '{options['company']}' não encontrada")
+            company_ids = [company.id]
+
+        corrigidas = reconcile(company_ids)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✓ {corrigidas} empresa(s) com estatísticas criadas ou corrigidas."
+        ))
@@ -0,0 +1,77 @@
+"""
+Comando Django para pré-aquecer os caches dos mapas (índice de CTOs, coordenadas e
+listagem de arquivos) das empresas ativas, da atividade mais recente para a mais
+antiga. Pensado para rodar após o deploy ou um restart do Redis.
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from core.models import Company
+from ftth_viewer.aquecimento import aquecer_empresas, empresas_por_atividade
+
+
+class Command(BaseCommand):
+    help = 'Pré-aquece os caches de mapas das empresas ativas'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--company',
+            type=str,
+            help='Slug da empresa (padrão: todas as ativas)',
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            help='Aquecer apenas as N empresas com atividade mais recente',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            help='Empresas aquecidas ao mesmo tempo (padrão: FTTH_AQUECIMENTO_CONCORRENCIA)',
+        )
+        parser.add_argument(
+            '--parse-workers',
+            type=int,
+            help='Processos para ler os mapas em paralelo neste comando (padrão: FTTH_PARSE_WORKERS)',
+        )
+        parser.add_argument(
+            '--skip-coordinates',
+            action='store_true',
+            help='Não montar os payloads de coordenadas de cada mapa',
+        )
+
+    def handle(self, *args, **options):
+        if options.get('company'):
+            empresas = list(Company.objects.filter(slug=options['company']))
+            if not empresas:
+                raise CommandError(f"Empresa '{options['company']}' não encontrada")
+        else:
+            empresas = empresas_por_atividade(limite=options.get('limit'))
+
+        if not empresas:
+            self.stdout.write(self.style.SUCCESS('✓ Nenhuma empresa com mapas para aquecer.'))
+            return
+
+        if options.get('parse_workers'):
+            # Só neste processo: o servidor web mantém o próprio FTTH_PARSE_WORKERS
+            settings.FTTH_PARSE_WORKERS = max(1, options['parse_workers'])
+
+        concorrencia = options.get('concurrency')
+        if concorrencia is not None:
+            concorrencia = max(1, concorrencia)
+
+        falhas = 0
+        for company, resultado, erro in aquecer_empresas(
+            empresas, concorrencia=concorrencia, coordenadas=not options['skip_coordinates']
+        ):
+            if erro:
+                falhas += 1
+                self.stdout.write(self.style.WARNING(f'⚠️  {company.slug}: {erro}'))
+                continue
+            self.stdout.write(
+                f"  {company.slug}: {resultado['ctos']} CTO(s), {resultado['mapas']} mapa(s), "
+                f"{resultado['coordenadas']} payload(s) de coordenadas montado(s) em {resultado['segundos']}s"
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ Caches aquecidos para {len(empresas) - falhas} de {len(empresas)} empresa(s).'
+        ))
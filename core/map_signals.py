@@ -0,0 +1,17 @@
+"""
+Signals de alteração de mapas CTO que não passam por post_save/post_delete.
+
+A ingestão e a compactação gravam o CTOMapFile com update() e as edições de CTO
+vão para o journal (ftth_viewer.CTOEdit); estes sinais avisam os consumidores
+(ex.: ftth_viewer.invalidation) depois do commit. Todos usam sender=CTOMapFile.
+"""
+from django.dispatch import Signal
+
+# Ingestão concluída com sucesso. kwargs: instance
+map_processed = Signal()
+
+# Edições gravadas no journal do mapa. kwargs: instance, edits (CTOEdit), version (nova versão)
+cto_edits_applied = Signal()
+
+# Journal incorporado ao arquivo do mapa. kwargs: instance, version (versão antes da compactação)
+map_compacted = Signal()
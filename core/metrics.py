@@ -0,0 +1,234 @@
+"""
+Métricas de latência e dos caminhos quentes no formato texto do Prometheus.
+
+Cada worker acumula contadores e histogramas em memória (sem I/O no caminho da
+requisição) e, no fim de uma requisição, a cada METRICS_FLUSH_INTERVAL segundos,
+soma os deltas num hash do Redis (HINCRBYFLOAT). O endpoint lê o hash e mostra o
+agregado de todos os workers; sem Redis (desenvolvimento, testes) mostra apenas
+o worker que atendeu.
+
+- increment(metric, value, **labels): contador
+- observe(metric, seconds, **labels): histograma
+- timer(metric, **labels): context manager / decorator que observa a duração
+- hot_path(name): timer nomeado em hot_path_duration_seconds{name=...}
+"""
+import bisect
+import logging
+import threading
+import time
+from contextlib import ContextDecorator
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Limites dos buckets (segundos), iguais em todos os workers
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+HOT_PATH = 'hot_path_duration_seconds'
+
+_lock = threading.Lock()
+# (nome, labels) -> valor; histogramas: (nome, labels) -> [contagem por bucket..., +Inf, soma]
+_counters = {}
+_histograms = {}
+# Deltas ainda não somados no Redis
+_pending_counters = {}
+_pending_histograms = {}
+_next_flush = 0.0
+_client = None
+_client_checked = False
+
+
+def enabled():
+    return getattr(settings, 'METRICS_ENABLED', True)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    """Labels no formato do Prometheus, em ordem fixa (mesma série em todos os workers)"""
+    return ','.join(f'{k}="{_escape(v)}"' for k, v in sorted(labels.items()))
+
+
+def _le(indice):
+    return '+Inf' if indice == len(BUCKETS) else f'{BUCKETS[indice]:g}'
+
+
+_LE_INDICE = {_le(i): i for i in range(len(BUCKETS) + 1)}
+
+
+def increment(metric, value=1, **labels):
+    """Soma `value` ao contador `metric`"""
+    if not enabled():
+        return
+    chave = (metric, _labels(labels))
+    with _lock:
+        _counters[chave] = _counters.get(chave, 0) + value
+        _pending_counters[chave] = _pending_counters.get(chave, 0) + value
+
+
+def observe(metric, value, **labels):
+    """Registra `value` (segundos) no histograma `metric`"""
+    if not enabled():
+        return
+    chave = (metric, _labels(labels))
+    indice = bisect.bisect_left(BUCKETS, value)
+    with _lock:
+        for destino in (_histograms, _pending_histograms):
+            histograma = destino.get(chave)
+            if histograma is None:
+                histograma = destino[chave] = [0] * (len(BUCKETS) + 2)
+            histograma[indice] += 1
+            histograma[-1] += value
+
+
+class timer(ContextDecorator):
+    """Mede a duração do bloco (ou de cada chamada da função decorada) no histograma `metric`"""
+
+    def __init__(self, metric, **labels):
+        self.metric = metric
+        self.labels = labels
+
+    def _recreate_cm(self):
+        # Decorator compartilhado entre threads: cada chamada mede com a sua instância
+        return timer(self.metric, **self.labels)
+
+    def __enter__(self):
+        self._inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.metric, time.perf_counter() - self._inicio, **self.labels)
+        return False
+
+
+def hot_path(name):
+    """Timer nomeado de um caminho quente (parse, índice, roteamento...)"""
+    return timer(HOT_PATH, name=name)
+
+
+def _redis():
+    """Cliente Redis do cache padrão (um por processo), se houver"""
+    global _client, _client_checked
+    if not _client_checked:
+        from .rate_limiting import _redis_client
+        _client = _redis_client()
+        _client_checked = True
+    return _client
+
+
+def _chave_redis():
+    return cache.make_key('metrics')
+
+
+def _campo(name, labels, parte):
+    # '\n' nunca aparece em labels escapados: separador seguro
+    return f'{name}\n{labels}\n{parte}'
+
+
+def _mesclar(counters, histograms):
+    """Devolve deltas não enviados (falha no Redis) aos pendentes"""
+    with _lock:
+        for chave, valor in counters.items():
+            _pending_counters[chave] = _pending_counters.get(chave, 0) + valor
+        for chave, valores in histograms.items():
+            atual = _pending_histograms.setdefault(chave, [0] * (len(BUCKETS) + 2))
+            for i, valor in enumerate(valores):
+                atual[i] += valor
+
+
+def flush(force=False):
+    """Soma no Redis os deltas deste worker (no máximo a cada METRICS_FLUSH_INTERVAL segundos)"""
+    global _next_flush
+    agora = time.monotonic()
+    if not force and agora < _next_flush:
+        return
+    client = _redis()
+    with _lock:
+        _next_flush = agora + getattr(settings, 'METRICS_FLUSH_INTERVAL', 10)
+        counters, histograms = dict(_pending_counters), dict(_pending_histograms)
+        _pending_counters.clear()
+        _pending_histograms.clear()
+    if client is None or not (counters or histograms):
+        return
+
+    chave = _chave_redis()
+    try:
+        pipe = client.pipeline(transaction=False)
+        for (name, labels), valor in counters.items():
+            pipe.hincrbyfloat(chave, _campo(name, labels, ''), valor)
+        for (name, labels), valores in histograms.items():
+            for i, contagem in enumerate(valores[:-1]):
+                if contagem:
+                    pipe.hincrbyfloat(chave, _campo(name, labels, _le(i)), contagem)
+            pipe.hincrbyfloat(chave, _campo(name, labels, 'sum'), valores[-1])
+        pipe.execute()
+    except Exception as e:
+        logger.error(f"Erro ao enviar métricas ao Redis: {e}")
+        _mesclar(counters, histograms)
+
+
+def _ler_redis(client):
+    counters, histograms = {}, {}
+    for campo, valor in client.hgetall(_chave_redis()).items():
+        if isinstance(campo, bytes):
+            campo = campo.decode()
+        name, labels, parte = campo.split('\n')
+        valor = float(valor)
+        if not parte:
+            counters[(name, labels)] = valor
+            continue
+        histograma = histograms.setdefault((name, labels), [0] * (len(BUCKETS) + 2))
+        if parte == 'sum':
+            histograma[-1] = valor
+        elif parte in _LE_INDICE:
+            histograma[_LE_INDICE[parte]] = valor
+    return counters, histograms
+
+
+def _numero(valor):
+    return str(int(valor)) if float(valor).is_integer() else repr(float(valor))
+
+
+def _serie(name, labels, extra=''):
+    labels = ','.join(p for p in (labels, extra) if p)
+    return f'{name}{{{labels}}}' if labels else name
+
+
+def render():
+    """Todas as séries no formato de exposição texto do Prometheus (0.0.4)"""
+    client = _redis()
+    dados = None
+    if client is not None:
+        flush(force=True)
+        try:
+            dados = _ler_redis(client)
+        except Exception as e:
+            logger.error(f"Erro ao ler métricas do Redis, exibindo apenas este worker: {e}")
+    if dados is None:
+        with _lock:
+            dados = dict(_counters), {k: list(v) for k, v in _histograms.items()}
+    counters, histograms = dados
+
+    linhas = []
+    anterior = None
+    for (name, labels), valor in sorted(counters.items()):
+        if name != anterior:
+            linhas.append(f'# TYPE {name} counter')
+            anterior = name
+        linhas.append(f'{_serie(name, labels)} {_numero(valor)}')
+    anterior = None
+    for (name, labels), valores in sorted(histograms.items()):
+        if name != anterior:
+            linhas.append(f'# TYPE {name} histogram')
+            anterior = name
+        acumulado = 0
+        for i in range(len(BUCKETS) + 1):
+            acumulado += valores[i]
+            le = 'le="%s"' % _le(i)
+            linhas.append(f'{_serie(name + "_bucket", labels, le)} {_numero(acumulado)}')
+        linhas.append(f'{_serie(name + "_sum", labels)} {_numero(valores[-1])}')
+        linhas.append(f'{_serie(name + "_count", labels)} {_numero(acumulado)}')
+    return '\n'.join(linhas) + '\n'
@@ -0,0 +1,63 @@
+"""
+Middleware de instrumentação: latência por view e consultas ao banco por requisição
+"""
+import time
+from contextlib import ExitStack
+
+from django.db import connections
+
+from . import metrics
+
+# Métodos fora desta lista viram 'other' (cardinalidade limitada)
+METODOS = {'GET', 'POST', 'PUT', 'PATCH', 'DELETE', 'HEAD', 'OPTIONS'}
+
+
+class _ContadorConsultas:
+    """execute_wrapper que conta as consultas da requisição e o tempo gasto nelas"""
+
+    def __init__(self):
+        self.total = 0
+        self.segundos = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.total += 1
+            self.segundos += time.perf_counter() - inicio
+
+
+class MetricsMiddleware:
+    """
+    Registra http_request_duration_seconds e http_requests_total por view (nome da URL)
+    e db_queries_total / db_query_duration_seconds_total. Deve ser o primeiro middleware
+    para medir também os demais.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not metrics.enabled():
+            return self.get_response(request)
+
+        consultas = _ContadorConsultas()
+        inicio = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(consultas))
+            response = self.get_response(request)
+        duracao = time.perf_counter() - inicio
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unmatched'
+        method = request.method if request.method in METODOS else 'other'
+        metrics.observe('http_request_duration_seconds', duracao, view=view, method=method)
+        metrics.increment('http_requests_total', view=view, method=method,
+                          status=f'{response.status_code // 100}xx')
+        if consultas.total:
+            metrics.increment('db_queries_total', consultas.total, view=view)
+            metrics.increment('db_query_duration_seconds_total', consultas.segundos, view=view)
+        metrics.flush()
+        return response
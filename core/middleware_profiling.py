@@ -0,0 +1,31 @@
+"""
+Middleware de perfil sob demanda (core.profiling)
+"""
+from . import profiling
+
+
+class ProfilingMiddleware:
+    """
+    Perfila a requisição quando pedido por um RM (X-Profile / ?_profile=) ou sorteado
+    por PROFILING_SAMPLE_RATE. Deve ficar no fim da lista: depende de request.user e
+    mede a resolução da URL, a view e a renderização.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        pedido = profiling.requested_profile(request)
+        if pedido is None:
+            return self.get_response(request)
+
+        kind, trigger = pedido
+        with profiling.Profiler(kind) as profiler:
+            response = self.get_response(request)
+            # TemplateResponse ainda não renderizada: incluir a renderização no perfil
+            if hasattr(response, 'render') and callable(response.render):
+                response = response.render()
+        profile = profiling.save_profile(request, response, profiler, trigger)
+        if profile is not None and trigger == 'manual':
+            response['X-Profile-Id'] = str(profile.id)
+        return response
@@ -5,7 +5,9 @@ from django.contrib.auth import logout
 from django.urls import reverse
 from django.utils import timezone
 import logging
-from .models import Company
+import random
+from django.conf import settings
+from .company_cache import get_company_by_slug
 
 logger = logging.getLogger('security')
 
@@ -45,11 +47,8 @@ class SecureCompanyMiddleware(MiddlewareMixin):
             # Permitir acesso à página de login (GET e POST) sem autenticação
             # A view company_login_view valida se o usuário pertence à empresa antes de fazer login
             try:
-                company = Company.objects.filter(
-                    slug__iexact=first_segment,
-                    is_active=True
-                ).first()
-                if company:
+                company = get_company_by_slug(first_segment)
+                if company and company.is_active:
                     request.company = company
                     request.company_slug = company.slug
                     # Permitir acesso - a view fará a validação de autenticação e pertencimento à empresa
@@ -77,15 +76,14 @@ class SecureCompanyMiddleware(MiddlewareMixin):
             
         # Verificar se é acesso de empresa via slug
         try:
-            company = Company.objects.filter(
-                slug__iexact=first_segment,
-                is_active=True
-            ).first()
+            company = get_company_by_slug(first_segment)
+            if company and not company.is_active:
+                company = None
             
             if company:
                 # VALIDAÇÃO CRÍTICA: Verificar se usuário pertence à empresa
                 if not request.user.is_rm_admin and not request.user.is_superuser:
-                    if not request.user.company or request.user.company != company:
+                    if request.user.company_id != company.id:
                         # Log tentativa de acesso não autorizado
                         logger.error(
                             f"Tentativa de acesso não autorizado: usuário {request.user.username} "
@@ -110,16 +108,18 @@ class SecureCompanyMiddleware(MiddlewareMixin):
                 request.company = company
                 request.company_slug = company.slug
                 
-                # Log acesso autorizado
-                logger.info(
-                    f"Acesso autorizado: {request.user.username} acessou {company.slug}",
-                    extra={
-                        'user_id': request.user.id,
-                        'company_slug': company.slug,
-                        'ip': request.META.get('REMOTE_ADDR'),
-                        'timestamp': timezone.now().isoformat()
-                    }
-                )
+                # Log acesso autorizado (amostrado: ocorre em toda requisição de empresa)
+                sample_rate = getattr(settings, 'SECURITY_ACCESS_LOG_SAMPLE_RATE', 0.01)
+                if logger.isEnabledFor(logging.INFO) and random.random() < sample_rate:
+                    logger.info(
+                        f"Acesso autorizado: {request.user.username} acessou {company.slug}",
+                        extra={
+                            'user_id': request.user.id,
+                            'company_slug': company.slug,
+                            'ip': request.META.get('REMOTE_ADDR'),
+                            'timestamp': timezone.now().isoformat()
+                        }
+                    )
                 return None
             else:
                 # Empresa não encontrada
@@ -0,0 +1,40 @@
+# Generated manually
+# Adiciona o hash SHA256 do conteúdo em CTOMapFile para deduplicar re-uploads
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def preencher_hashes(apps, schema_editor):
+    """Calcula o hash dos mapas já existentes (ignora arquivos ausentes)"""
+    CTOMapFile = apps.get_model('core', 'CTOMapFile')
+    for map_file in CTOMapFile.objects.filter(content_hash='').exclude(file='').iterator():
+        try:
+            file_hash = hashlib.sha256()
+            with map_file.file.open('rb') as fh:
+                for chunk in iter(lambda: fh.read(64 * 1024), b''):
+                    file_hash.update(chunk)
+        except (OSError, ValueError):
+            continue
+        CTOMapFile.objects.filter(pk=map_file.pk).update(content_hash=file_hash.hexdigest())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_add_db_index_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ctomapfile',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64, verbose_name='Hash do Conteúdo (SHA256)'),
+        ),
+        migrations.AddIndex(
+            model_name='ctomapfile',
+            index=models.Index(fields=['company', 'content_hash'], name='core_ctomap_company_hash_idx'),
+        ),
+        migrations.RunPython(preencher_hashes, migrations.RunPython.noop),
+    ]
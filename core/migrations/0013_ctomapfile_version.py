@@ -0,0 +1,19 @@
+# Generated manually
+# Contador de versão do conteúdo do mapa (invalidação precisa dos caches de leitura)
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_ctomapfile_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ctomapfile',
+            name='version',
+            field=models.PositiveIntegerField(default=1, verbose_name='Versão do Conteúdo'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated manually
+# Retenção (TTL) do cache de viabilidade configurável por empresa
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_ctomapfile_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='viability_cache_ttl_days',
+            field=models.PositiveIntegerField(blank=True, help_text='Vazio = padrão do sistema (FTTH_VIABILIDADE_CACHE_TTL_DIAS)', null=True, verbose_name='Retenção do Cache de Viabilidade (dias)'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated manually
+# Eventos de auditoria consultáveis (sink de banco do core.audit_logger)
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_company_viability_cache_ttl_days'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuditEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='Primeiro dia do mês do evento (chave de partição)', verbose_name='Mês')),
+                ('created_at', models.DateTimeField(db_index=True, verbose_name='Registrado em')),
+                ('category', models.CharField(choices=[('user_action', 'Ação de usuário'), ('security', 'Evento de segurança'), ('data_access', 'Acesso a dados')], max_length=20, verbose_name='Categoria')),
+                ('level', models.CharField(max_length=10, verbose_name='Nível')),
+                ('action', models.CharField(max_length=100, verbose_name='Ação')),
+                ('user_id', models.PositiveIntegerField(blank=True, null=True, verbose_name='ID do usuário')),
+                ('username', models.CharField(blank=True, max_length=150, verbose_name='Usuário')),
+                ('company_id', models.PositiveIntegerField(blank=True, null=True, verbose_name='ID da empresa')),
+                ('ip_address', models.GenericIPAddressField(blank=True, null=True, verbose_name='IP')),
+                ('resource_type', models.CharField(blank=True, max_length=50, verbose_name='Tipo do recurso')),
+                ('resource_id', models.CharField(blank=True, max_length=64, verbose_name='ID do recurso')),
+                ('details', models.JSONField(blank=True, default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder, verbose_name='Detalhes')),
+            ],
+            options={
+                'verbose_name': 'Evento de Auditoria',
+                'verbose_name_plural': 'Eventos de Auditoria',
+                'ordering': ['-created_at'],
+                'indexes': [
+                    models.Index(fields=['month', 'category'], name='core_audite_month_48968c_idx'),
+                    models.Index(fields=['action', 'created_at'], name='core_audite_action_3957f4_idx'),
+                    models.Index(fields=['user_id', 'created_at'], name='core_audite_user_id_69cb1f_idx'),
+                    models.Index(fields=['company_id', 'created_at'], name='core_audite_company_a5db18_idx'),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated manually
+# Perfis de requisições sob demanda/amostrados (core.profiling)
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_auditevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Registrado em')),
+                ('kind', models.CharField(choices=[('cprofile', 'cProfile'), ('sampler', 'Amostragem de pilhas')], max_length=10, verbose_name='Tipo')),
+                ('trigger', models.CharField(choices=[('manual', 'Sob demanda (RM)'), ('sample', 'Amostragem aleatória')], max_length=10, verbose_name='Origem')),
+                ('method', models.CharField(max_length=10, verbose_name='Método')),
+                ('path', models.CharField(max_length=500, verbose_name='Caminho')),
+                ('view_name', models.CharField(blank=True, max_length=200, verbose_name='View')),
+                ('status_code', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Status')),
+                ('duration_ms', models.FloatField(verbose_name='Duração (ms)')),
+                ('user_id', models.PositiveIntegerField(blank=True, null=True, verbose_name='ID do usuário')),
+                ('username', models.CharField(blank=True, max_length=150, verbose_name='Usuário')),
+                ('company_id', models.PositiveIntegerField(blank=True, null=True, verbose_name='ID da empresa')),
+                ('sample_count', models.PositiveIntegerField(default=0, verbose_name='Amostras/chamadas')),
+                ('top_entries', models.JSONField(blank=True, default=list, verbose_name='Principais pilhas/funções')),
+                ('data', models.BinaryField(verbose_name='Dados do perfil')),
+            ],
+            options={
+                'verbose_name': 'Perfil de Requisição',
+                'verbose_name_plural': 'Perfis de Requisições',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['view_name', 'created_at'], name='core_reques_view_na_b057ac_idx')],
+            },
+        ),
+    ]
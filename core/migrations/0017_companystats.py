@@ -0,0 +1,69 @@
+# Generated manually
+# Totais por empresa para dashboards e relatórios RM (core.company_stats)
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max, Q
+
+
+def popular_estatisticas(apps, schema_editor):
+    """Preenche CompanyStats com a contagem atual (equivale a reconcile_company_stats)"""
+    Company = apps.get_model('core', 'Company')
+    CompanyStats = apps.get_model('core', 'CompanyStats')
+    CustomUser = apps.get_model('core', 'CustomUser')
+    CTOMapFile = apps.get_model('core', 'CTOMapFile')
+    Ticket = apps.get_model('core', 'Ticket')
+
+    valores = {company_id: {} for company_id in Company.objects.values_list('id', flat=True)}
+    for row in CustomUser.objects.filter(company__isnull=False).order_by().values('company_id').annotate(
+        total=Count('id'), ativos=Count('id', filter=Q(is_active=True))
+    ):
+        valores[row['company_id']].update(total_users=row['total'], active_users=row['ativos'])
+    for row in CTOMapFile.objects.order_by().values('company_id').annotate(
+        total=Count('id'), processados=Count('id', filter=Q(is_processed=True)), ultimo=Max('uploaded_at')
+    ):
+        valores[row['company_id']].update(
+            total_maps=row['total'],
+            processed_maps=row['processados'],
+            pending_maps=row['total'] - row['processados'],
+            last_upload_at=row['ultimo'],
+        )
+    for row in Ticket.objects.order_by().values('company_id').annotate(
+        total=Count('id'), abertos=Count('id', filter=~Q(status__in=['resolvido', 'fechado']))
+    ):
+        valores[row['company_id']].update(total_tickets=row['total'], open_tickets=row['abertos'])
+
+    CompanyStats.objects.bulk_create(
+        [CompanyStats(company_id=company_id, **campos) for company_id, campos in valores.items()],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_requestprofile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompanyStats',
+            fields=[
+                ('company', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='core.company', verbose_name='Empresa')),
+                ('total_users', models.PositiveIntegerField(default=0, verbose_name='Usuários')),
+                ('active_users', models.PositiveIntegerField(default=0, verbose_name='Usuários Ativos')),
+                ('total_maps', models.PositiveIntegerField(default=0, verbose_name='Mapas')),
+                ('processed_maps', models.PositiveIntegerField(default=0, verbose_name='Mapas Processados')),
+                ('pending_maps', models.PositiveIntegerField(default=0, verbose_name='Mapas Pendentes')),
+                ('last_upload_at', models.DateTimeField(blank=True, null=True, verbose_name='Último Upload')),
+                ('total_tickets', models.PositiveIntegerField(default=0, verbose_name='Tickets')),
+                ('open_tickets', models.PositiveIntegerField(default=0, verbose_name='Tickets em Aberto')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Atualizado em')),
+            ],
+            options={
+                'verbose_name': 'Estatísticas da Empresa',
+                'verbose_name_plural': 'Estatísticas das Empresas',
+            },
+        ),
+        migrations.RunPython(popular_estatisticas, migrations.RunPython.noop),
+    ]
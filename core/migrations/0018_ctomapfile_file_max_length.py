@@ -0,0 +1,20 @@
+# Generated manually
+# Caminho do arquivo do mapa até 255 caracteres: a compactação do journal de edições
+# grava em cto_maps/compactados/<id>/v<versão>/<nome original>
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_companystats'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ctomapfile',
+            name='file',
+            field=models.FileField(max_length=255, upload_to='cto_maps/', verbose_name='Arquivo'),
+        ),
+    ]
@@ -1,6 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
 from django.utils.text import slugify
 import os
 
@@ -13,6 +14,12 @@ class Company(models.Model):
     phone = models.CharField(max_length=20, blank=True, verbose_name="Telefone")
     address = models.TextField(blank=True, verbose_name="Endereço")
     is_active = models.BooleanField(default=True, verbose_name="Ativa")
+    viability_cache_ttl_days = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        verbose_name="Retenção do Cache de Viabilidade (dias)",
+        help_text="Vazio = padrão do sistema (FTTH_VIABILIDADE_CACHE_TTL_DIAS)"
+    )
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Criada em")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="Atualizada em")
 
@@ -175,7 +182,8 @@ class CTOMapFile(models.Model):
         ('failed', 'Falhou'),
     ]
     
-    file = models.FileField(upload_to="cto_maps/", verbose_name="Arquivo")
+    # 255: a compactação do journal grava em cto_maps/compactados/<id>/v<versão>/<nome original>
+    file = models.FileField(upload_to="cto_maps/", max_length=255, verbose_name="Arquivo")
     description = models.CharField(max_length=255, blank=True, verbose_name="Descrição")
     file_type = models.CharField(max_length=10, choices=FILE_TYPES, default='csv', verbose_name="Tipo de Arquivo")
     company = models.ForeignKey(
@@ -217,6 +225,10 @@ class CTOMapFile(models.Model):
     # Metadados do arquivo
     file_size = models.BigIntegerField(null=True, blank=True, verbose_name="Tamanho do Arquivo (bytes)")
     coordinates_count = models.IntegerField(null=True, blank=True, verbose_name="Número de Coordenadas")
+    content_hash = models.CharField(max_length=64, blank=True, default='', verbose_name="Hash do Conteúdo (SHA256)")
+    # Incrementada a cada alteração de conteúdo (edição de CTO ou compactação do journal);
+    # compõe as chaves de cache de leitura do mapa
+    version = models.PositiveIntegerField(default=1, verbose_name="Versão do Conteúdo")
     
     # Campos de auditoria
     updated_at = models.DateTimeField(auto_now=True, verbose_name="Atualizado em")
@@ -229,6 +241,7 @@ class CTOMapFile(models.Model):
             models.Index(fields=['company', 'processing_status']),
             models.Index(fields=['uploaded_by', 'uploaded_at']),
             models.Index(fields=['file_type', 'is_processed']),
+            models.Index(fields=['company', 'content_hash'], name='core_ctomap_company_hash_idx'),
         ]
 
     def clean(self):
@@ -604,6 +617,113 @@ class TicketNotification(models.Model):
     def __str__(self):
         return f"Notificação {self.id} - {self.get_notification_type_display()} - Ticket {self.ticket.ticket_number}"
 
+class AuditEvent(models.Model):
+    """Evento de auditoria gravado em lote pelo sink de banco de core.audit_logger"""
+
+    CATEGORY_CHOICES = [
+        ('user_action', 'Ação de usuário'),
+        ('security', 'Evento de segurança'),
+        ('data_access', 'Acesso a dados'),
+    ]
+
+    # Sem chaves estrangeiras: eventos sobrevivem à remoção de usuários/empresas e a
+    # tabela pode ser particionada por faixa de `month` (PostgreSQL) sem restrições cruzadas
+    month = models.DateField(verbose_name="Mês", help_text="Primeiro dia do mês do evento (chave de partição)")
+    created_at = models.DateTimeField(verbose_name="Registrado em", db_index=True)
+    category = models.CharField(max_length=20, choices=CATEGORY_CHOICES, verbose_name="Categoria")
+    level = models.CharField(max_length=10, verbose_name="Nível")
+    action = models.CharField(max_length=100, verbose_name="Ação")
+    user_id = models.PositiveIntegerField(null=True, blank=True, verbose_name="ID do usuário")
+    username = models.CharField(max_length=150, blank=True, verbose_name="Usuário")
+    company_id = models.PositiveIntegerField(null=True, blank=True, verbose_name="ID da empresa")
+    ip_address = models.GenericIPAddressField(null=True, blank=True, verbose_name="IP")
+    resource_type = models.CharField(max_length=50, blank=True, verbose_name="Tipo do recurso")
+    resource_id = models.CharField(max_length=64, blank=True, verbose_name="ID do recurso")
+    details = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder, verbose_name="Detalhes")
+
+    class Meta:
+        verbose_name = "Evento de Auditoria"
+        verbose_name_plural = "Eventos de Auditoria"
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['month', 'category']),
+            models.Index(fields=['action', 'created_at']),
+            models.Index(fields=['user_id', 'created_at']),
+            models.Index(fields=['company_id', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.created_at:%Y-%m-%d %H:%M:%S} {self.action} ({self.username or 'anonymous'})"
+
+
+class RequestProfile(models.Model):
+    """Perfil de uma requisição (cProfile ou amostragem de pilhas) gravado por core.profiling"""
+
+    KIND_CHOICES = [
+        ('cprofile', 'cProfile'),
+        ('sampler', 'Amostragem de pilhas'),
+    ]
+    TRIGGER_CHOICES = [
+        ('manual', 'Sob demanda (RM)'),
+        ('sample', 'Amostragem aleatória'),
+    ]
+
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Registrado em", db_index=True)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, verbose_name="Tipo")
+    trigger = models.CharField(max_length=10, choices=TRIGGER_CHOICES, verbose_name="Origem")
+    method = models.CharField(max_length=10, verbose_name="Método")
+    path = models.CharField(max_length=500, verbose_name="Caminho")
+    view_name = models.CharField(max_length=200, blank=True, verbose_name="View")
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name="Status")
+    duration_ms = models.FloatField(verbose_name="Duração (ms)")
+    user_id = models.PositiveIntegerField(null=True, blank=True, verbose_name="ID do usuário")
+    username = models.CharField(max_length=150, blank=True, verbose_name="Usuário")
+    company_id = models.PositiveIntegerField(null=True, blank=True, verbose_name="ID da empresa")
+    sample_count = models.PositiveIntegerField(default=0, verbose_name="Amostras/chamadas")
+    top_entries = models.JSONField(default=list, blank=True, verbose_name="Principais pilhas/funções")
+    # pstats (marshal) ou speedscope (JSON), comprimido com zlib
+    data = models.BinaryField(verbose_name="Dados do perfil")
+
+    class Meta:
+        verbose_name = "Perfil de Requisição"
+        verbose_name_plural = "Perfis de Requisições"
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['view_name', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.duration_ms:.0f} ms)"
+
+
+class CompanyStats(models.Model):
+    """Totais por empresa mantidos por signals (core.company_stats) para dashboards e relatórios RM"""
+
+    company = models.OneToOneField(
+        Company,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats',
+        verbose_name="Empresa"
+    )
+    total_users = models.PositiveIntegerField(default=0, verbose_name="Usuários")
+    active_users = models.PositiveIntegerField(default=0, verbose_name="Usuários Ativos")
+    total_maps = models.PositiveIntegerField(default=0, verbose_name="Mapas")
+    processed_maps = models.PositiveIntegerField(default=0, verbose_name="Mapas Processados")
+    pending_maps = models.PositiveIntegerField(default=0, verbose_name="Mapas Pendentes")
+    last_upload_at = models.DateTimeField(null=True, blank=True, verbose_name="Último Upload")
+    total_tickets = models.PositiveIntegerField(default=0, verbose_name="Tickets")
+    open_tickets = models.PositiveIntegerField(default=0, verbose_name="Tickets em Aberto")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Atualizado em")
+
+    class Meta:
+        verbose_name = "Estatísticas da Empresa"
+        verbose_name_plural = "Estatísticas das Empresas"
+
+    def __str__(self):
+        return f"Estatísticas de {self.company_id}"
+
+
 # -----------------------------------------------------------------------------
 # Controle opcional de sessão única por usuário
 # -----------------------------------------------------------------------------
@@ -17,7 +17,8 @@ from django.views.decorators.cache import never_cache
 from django.utils.decorators import method_decorator
 from django.http import Http404
 from django.db.models import Q
-from core.models import CustomUser, Company
+from core.models import CustomUser
+from core.company_cache import get_company_by_slug
 import logging
 
 logger = logging.getLogger(__name__)
@@ -34,11 +35,10 @@ class CompanyPasswordResetView(auth_views.PasswordResetView):
         # Verificar se a empresa existe
         company_slug = kwargs.get('company_slug')
         if company_slug:
-            try:
-                company = Company.objects.get(slug=company_slug, is_active=True)
-                self.company = company
-            except Company.DoesNotExist:
+            company = get_company_by_slug(company_slug, exact=True)
+            if company is None or not company.is_active:
                 raise Http404("Empresa não encontrada")
+            self.company = company
         else:
             raise Http404("Slug da empresa é obrigatório")
         return super().dispatch(request, *args, **kwargs)
@@ -139,9 +139,8 @@ class CompanyPasswordResetDoneView(auth_views.PasswordResetDoneView):
     def dispatch(self, request, *args, **kwargs):
         company_slug = kwargs.get('company_slug')
         if company_slug:
-            try:
-                self.company = Company.objects.get(slug=company_slug, is_active=True)
-            except Company.DoesNotExist:
+            self.company = get_company_by_slug(company_slug, exact=True)
+            if self.company is None or not self.company.is_active:
                 raise Http404("Empresa não encontrada")
         else:
             raise Http404("Slug da empresa é obrigatório")
@@ -163,9 +162,8 @@ class CompanyPasswordResetConfirmView(auth_views.PasswordResetConfirmView):
     def dispatch(self, request, *args, **kwargs):
         company_slug = kwargs.get('company_slug')
         if company_slug:
-            try:
-                self.company = Company.objects.get(slug=company_slug, is_active=True)
-            except Company.DoesNotExist:
+            self.company = get_company_by_slug(company_slug, exact=True)
+            if self.company is None or not self.company.is_active:
                 raise Http404("Empresa não encontrada")
         else:
             raise Http404("Slug da empresa é obrigatório")
@@ -202,9 +200,8 @@ class CompanyPasswordResetCompleteView(auth_views.PasswordResetCompleteView):
     def dispatch(self, request, *args, **kwargs):
         company_slug = kwargs.get('company_slug')
         if company_slug:
-            try:
-                self.company = Company.objects.get(slug=company_slug, is_active=True)
-            except Company.DoesNotExist:
+            self.company = get_company_by_slug(company_slug, exact=True)
+            if self.company is None or not self.company.is_active:
                 raise Http404("Empresa não encontrada")
         else:
             raise Http404("Slug da empresa é obrigatório")
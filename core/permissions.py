@@ -119,22 +119,21 @@ def company_access_required(require_admin=False, allow_user_role=True):
                 raise PermissionDenied("Slug de empresa não fornecido.")
             
             # Import lazy para evitar ciclos
-            from .models import Company
-            try:
-                company = Company.objects.get(slug=company_slug)
-            except Company.DoesNotExist:
+            from .company_cache import get_company_by_slug
+            company = get_company_by_slug(company_slug, exact=True)
+            if company is None:
                 logger.error(f"company_access_required: Empresa com slug '{company_slug}' não encontrada")
                 raise PermissionDenied(f"Empresa '{company_slug}' não encontrada.")
             
             # Verificação de pertencimento
-            if not user.company:
+            if not user.company_id:
                 logger.warning(
                     f"company_access_required: Usuário {user.username} não tem empresa associada "
                     f"(tentando acessar {company_slug})"
                 )
                 raise PermissionDenied("Você não tem autorização para acessar esta página. Usuário sem empresa associada.")
             
-            if user.company != company:
+            if user.company_id != company.id:
                 logger.warning(
                     f"company_access_required: Usuário {user.username} pertence à empresa {user.company.slug} "
                     f"mas tentou acessar {company_slug}"
@@ -188,12 +187,9 @@ def company_access_required_json(require_admin=False):
             company_slug = kwargs.get('company_slug')
             if not user.is_authenticated or not company_slug:
                 return JsonResponse({'error': 'Sem permissão'}, status=403)
-            from .models import Company
-            try:
-                company = Company.objects.get(slug=company_slug)
-            except Company.DoesNotExist:
-                return JsonResponse({'error': 'Sem permissão'}, status=403)
-            if not user.company or user.company != company:
+            from .company_cache import get_company_by_slug
+            company = get_company_by_slug(company_slug, exact=True)
+            if company is None or user.company_id != company.id:
                 return JsonResponse({'error': 'Sem permissão'}, status=403)
             if require_admin and not getattr(user, 'is_company_admin', False):
                 return JsonResponse({'error': 'Sem permissão'}, status=403)
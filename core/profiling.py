@@ -0,0 +1,238 @@
+"""
+Perfil de requisições sob demanda, para investigar lentidão em produção.
+
+Uma requisição é perfilada quando:
+- um RM pede, com o cabeçalho "X-Profile" ou o parâmetro "?_profile=" (valor
+  "sample" usa a amostragem de pilhas; qualquer outro, cProfile);
+- ou é sorteada com probabilidade PROFILING_SAMPLE_RATE (sempre por amostragem,
+  que tem custo baixo o bastante para tráfego real).
+
+A amostragem lê a pilha da thread da requisição a cada PROFILING_INTERVAL_MS
+(sys._current_frames). O resultado vira um RequestProfile com as PROFILING_TOP_N
+principais pilhas/funções e os dados completos para download (pstats ou speedscope).
+"""
+import cProfile
+import json
+import logging
+import marshal
+import os
+import random
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+
+from django.conf import settings
+
+from .models import RequestProfile
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_PARAM = '_profile'
+
+
+def enabled():
+    return getattr(settings, 'PROFILING_ENABLED', True)
+
+
+def requested_profile(request):
+    """(kind, trigger) se a requisição deve ser perfilada, senão None"""
+    if not enabled():
+        return None
+    flag = request.headers.get(PROFILE_HEADER) or request.GET.get(PROFILE_PARAM)
+    if flag:
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated and user.is_rm_admin:
+            return ('sampler' if flag == 'sample' else 'cprofile'), 'manual'
+        return None
+    taxa = getattr(settings, 'PROFILING_SAMPLE_RATE', 0.0)
+    if taxa > 0 and random.random() < taxa:
+        return 'sampler', 'sample'
+    return None
+
+
+def _nome_arquivo(caminho):
+    """Caminho relativo ao projeto ou ao site-packages (só para exibição)"""
+    base = str(settings.BASE_DIR)
+    if caminho.startswith(base):
+        return os.path.relpath(caminho, base)
+    marcador = 'site-packages' + os.sep
+    if marcador in caminho:
+        return caminho.split(marcador, 1)[1]
+    return caminho
+
+
+def _descrever(arquivo, linha, funcao):
+    return f'{funcao} ({_nome_arquivo(arquivo)}:{linha})'
+
+
+class _Amostrador(threading.Thread):
+    """Lê a pilha da thread alvo a intervalos fixos até ser parado"""
+
+    def __init__(self, thread_id, raiz, intervalo):
+        super().__init__(name='request-profiler', daemon=True)
+        self.thread_id = thread_id
+        # Quadro do middleware: quadros acima dele (servidor WSGI) são ignorados
+        self.raiz = raiz
+        self.intervalo = intervalo
+        self.amostras = []
+        self._parar = threading.Event()
+
+    def run(self):
+        while not self._parar.wait(self.intervalo):
+            frame = sys._current_frames().get(self.thread_id)
+            pilha = []
+            while frame is not None and frame is not self.raiz:
+                codigo = frame.f_code
+                pilha.append((codigo.co_filename, codigo.co_firstlineno, codigo.co_name))
+                frame = frame.f_back
+            if pilha:
+                pilha.reverse()
+                self.amostras.append(tuple(pilha))
+
+    def parar(self):
+        self._parar.set()
+        self.join()
+
+
+class Profiler:
+    """Context manager que perfila o bloco com cProfile ou com amostragem de pilhas"""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.duracao = 0.0
+        self._profile = None
+        self._stats = None
+        self._amostrador = None
+
+    def __enter__(self):
+        if self.kind == 'cprofile':
+            self._profile = cProfile.Profile()
+        else:
+            intervalo = getattr(settings, 'PROFILING_INTERVAL_MS', 5) / 1000.0
+            self._amostrador = _Amostrador(threading.get_ident(), sys._getframe(1), intervalo)
+        self._inicio = time.perf_counter()
+        if self._profile is not None:
+            self._profile.enable()
+        else:
+            self._amostrador.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self._profile is not None:
+            self._profile.disable()
+        else:
+            self._amostrador.parar()
+        self.duracao = time.perf_counter() - self._inicio
+        if self._profile is not None:
+            # {(arquivo, linha, função): (cc, nc, tt, ct, callers)}, como em pstats
+            self._profile.create_stats()
+            self._stats = self._profile.stats
+        return False
+
+    def top_entries(self, limite):
+        """Principais funções (cProfile, por tempo acumulado) ou pilhas (amostragem)"""
+        if self._stats is not None:
+            ordenadas = sorted(self._stats.items(), key=lambda item: item[1][3], reverse=True)
+            return [
+                {
+                    'function': _descrever(*chave),
+                    'ncalls': nc,
+                    'primitive_calls': cc,
+                    'tottime_ms': round(tt * 1000, 3),
+                    'cumtime_ms': round(ct * 1000, 3),
+                }
+                for chave, (cc, nc, tt, ct, _callers) in ordenadas[:limite]
+            ]
+        intervalo_ms = getattr(settings, 'PROFILING_INTERVAL_MS', 5)
+        return [
+            {
+                'stack': [_descrever(*quadro) for quadro in pilha],
+                'samples': quantidade,
+                'ms': quantidade * intervalo_ms,
+            }
+            for pilha, quantidade in Counter(self._amostrador.amostras).most_common(limite)
+        ]
+
+    def sample_count(self):
+        if self._stats is not None:
+            return sum(nc for _cc, nc, _tt, _ct, _callers in self._stats.values())
+        return len(self._amostrador.amostras)
+
+    def export(self, nome):
+        """Dados completos: pstats (marshal, como Stats.dump_stats) ou documento speedscope"""
+        if self._stats is not None:
+            return marshal.dumps(self._stats)
+        return json.dumps(_speedscope(nome, self._amostrador.amostras, self._amostrador.intervalo * 1000)).encode()
+
+
+def _speedscope(nome, amostras, intervalo_ms):
+    """Perfil 'sampled' no formato de arquivo do speedscope"""
+    frames, indices = [], {}
+    pilhas = []
+    for pilha in amostras:
+        ids = []
+        for quadro in pilha:
+            if quadro not in indices:
+                indices[quadro] = len(frames)
+                arquivo, linha, funcao = quadro
+                frames.append({'name': funcao, 'file': _nome_arquivo(arquivo), 'line': linha})
+            ids.append(indices[quadro])
+        pilhas.append(ids)
+    return {
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'name': nome,
+        'exporter': 'rm-systems-profiler',
+        'shared': {'frames': frames},
+        'profiles': [{
+            'type': 'sampled',
+            'name': nome,
+            'unit': 'milliseconds',
+            'startValue': 0,
+            'endValue': len(pilhas) * intervalo_ms,
+            'samples': pilhas,
+            'weights': [intervalo_ms] * len(pilhas),
+        }],
+    }
+
+
+def save_profile(request, response, profiler, trigger):
+    """Grava o RequestProfile da requisição e descarta os mais antigos além de PROFILING_MAX_PROFILES"""
+    user = getattr(request, 'user', None)
+    autenticado = user is not None and user.is_authenticated
+    match = getattr(request, 'resolver_match', None)
+    nome = f'{request.method} {request.path}'
+    try:
+        profile = RequestProfile.objects.create(
+            kind=profiler.kind,
+            trigger=trigger,
+            method=request.method[:10],
+            path=request.get_full_path()[:500],
+            view_name=(match.view_name if match else '')[:200],
+            status_code=response.status_code,
+            duration_ms=round(profiler.duracao * 1000, 3),
+            user_id=user.id if autenticado else None,
+            username=user.username if autenticado else '',
+            company_id=getattr(getattr(request, 'company', None), 'id', None) or (user.company_id if autenticado else None),
+            sample_count=profiler.sample_count(),
+            top_entries=profiler.top_entries(getattr(settings, 'PROFILING_TOP_N', 30)),
+            data=zlib.compress(profiler.export(nome)),
+        )
+        limite = getattr(settings, 'PROFILING_MAX_PROFILES', 200)
+        antigos = RequestProfile.objects.order_by('-created_at', '-id').values_list('id', flat=True)[limite:limite + 100]
+        if antigos:
+            RequestProfile.objects.filter(id__in=list(antigos)).delete()
+        return profile
+    except Exception as e:
+        logger.error(f"Erro ao gravar perfil da requisição {nome}: {e}")
+        return None
+
+
+def download(profile):
+    """(conteúdo, content_type, nome do arquivo) do perfil no formato nativo do tipo"""
+    conteudo = zlib.decompress(bytes(profile.data))
+    if profile.kind == 'cprofile':
+        return conteudo, 'application/octet-stream', f'profile-{profile.id}.pstats'
+    return conteudo, 'application/json', f'profile-{profile.id}.speedscope.json'
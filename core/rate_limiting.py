@@ -1,18 +1,162 @@
 from django.core.cache import cache
 from django.http import HttpResponse, JsonResponse
 from django.utils import timezone
+from collections import namedtuple
 from functools import wraps
 import logging
+import math
 import threading
+import time
 
 logger = logging.getLogger('security')
 
-# Lock para sincronização de operações de cache
-_cache_lock = threading.Lock()
+# Resultado de uma verificação: tempos em segundos
+RateLimitResult = namedtuple('RateLimitResult', 'allowed limit remaining retry_after reset_after')
+
+# GCRA (generic cell rate algorithm): cada chave guarda um único número, o "theoretical
+# arrival time" (TAT). Cada requisição avança o TAT em window/requests; ela é negada se o
+# TAT estiver mais de window - window/requests no futuro. Equivale a um balde de `requests`
+# fichas reposto continuamente, com custo O(1) por requisição.
+# Tempos em milissegundos. Retorna {permitida, restantes, retry_after_ms, reset_ms}.
+# O "agora" vem do relógio do Redis (TIME), não do servidor da aplicação: workers em
+# máquinas com relógios defasados compartilham o mesmo TAT. Replicação por efeitos
+# (padrão a partir do Redis 5) é necessária para gravar depois de um comando não determinístico.
+GCRA_LUA = """
+if redis.replicate_commands then
+    redis.replicate_commands()
+end
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local interval = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local tat = tonumber(redis.call('GET', KEYS[1]))
+if not tat or tat < now then
+    tat = now
+end
+local tolerance = window - interval
+if tat - now > tolerance then
+    return {0, 0, math.ceil(tat - tolerance - now), math.ceil(tat - now)}
+end
+local new_tat = tat + interval
+redis.call('SET', KEYS[1], new_tat, 'PX', math.ceil(new_tat - now))
+return {1, math.floor((window - (new_tat - now)) / interval), 0, math.ceil(new_tat - now)}
+"""
+
+
+def _gcra(tat, now, interval, window):
+    """Mesma conta do script Lua; retorna (novo_tat ou None se negada, resultado)"""
+    if tat is None or tat < now:
+        tat = now
+    tolerance = window - interval
+    if tat - now > tolerance:
+        return None, (False, 0, math.ceil(tat - tolerance - now), math.ceil(tat - now))
+    new_tat = tat + interval
+    return new_tat, (True, math.floor((window - (new_tat - now)) / interval), 0, math.ceil(new_tat - now))
+
+
+class _LocalGCRA:
+    """
+    GCRA em memória do processo (desenvolvimento/testes com LocMemCache, ou Redis
+    indisponível). Não é compartilhado entre workers.
+    """
+
+    SWEEP_EVERY = 1000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tats = {}
+        self._calls = 0
+
+    def hit(self, key, now, interval, window):
+        with self._lock:
+            self._calls += 1
+            if self._calls % self.SWEEP_EVERY == 0:
+                # TAT no passado equivale a chave ausente
+                for stale in [k for k, tat in self._tats.items() if tat <= now]:
+                    del self._tats[stale]
+            new_tat, result = _gcra(self._tats.get(key), now, interval, window)
+            if new_tat is not None:
+                self._tats[key] = new_tat
+            return result
+
+    def peek(self, key):
+        """(TAT da chave ou None, agora em ms)"""
+        with self._lock:
+            return self._tats.get(key), time.time() * 1000
+
+    def delete(self, key):
+        with self._lock:
+            self._tats.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._tats.clear()
+
+
+class _RedisGCRA:
+    """GCRA atômico no Redis: um EVALSHA por requisição, compartilhado entre workers"""
+
+    def __init__(self, client):
+        self._client = client
+        self._script = client.register_script(GCRA_LUA)
+
+    def hit(self, key, now, interval, window):
+        # `now` só serve ao fallback local: o script lê o relógio do Redis
+        allowed, remaining, retry_ms, reset_ms = self._script(
+            keys=[cache.make_key(key)], args=[interval, window]
+        )
+        return bool(allowed), int(remaining), int(retry_ms), int(reset_ms)
+
+    def peek(self, key):
+        """(TAT da chave ou None, agora em ms pelo relógio do Redis), numa única ida"""
+        pipe = self._client.pipeline(transaction=False)
+        pipe.get(cache.make_key(key))
+        pipe.time()
+        tat, (segundos, micros) = pipe.execute()
+        now = segundos * 1000 + micros // 1000
+        try:
+            return (float(tat) if tat is not None else None), now
+        except (TypeError, ValueError):
+            return None, now
+
+
+def _redis_client():
+    """Cliente redis-py do cache padrão (RedisCache do Django ou django-redis), se houver"""
+    client_factory = getattr(getattr(cache, 'client', None), 'get_client', None)  # django-redis
+    if client_factory is None:
+        client_factory = getattr(getattr(cache, '_cache', None), 'get_client', None)  # RedisCache
+    if client_factory is None:
+        return None
+    try:
+        return client_factory(write=True)
+    except Exception as e:
+        logger.error(f"Cliente Redis indisponível para rate limiting: {e}")
+        return None
+
+
+_local_backend = _LocalGCRA()
+_redis_backend = None
+_backend_lock = threading.Lock()
+_backend_checked = False
+
+
+def _get_backend():
+    """Motor do rate limiting (um por processo): Redis quando o cache padrão é Redis"""
+    global _redis_backend, _backend_checked
+    if not _backend_checked:
+        with _backend_lock:
+            if not _backend_checked:
+                client = _redis_client()
+                if client is not None:
+                    _redis_backend = _RedisGCRA(client)
+                _backend_checked = True
+    return _redis_backend or _local_backend
+
 
 class RateLimiter:
     """
-    Sistema de rate limiting para proteção contra ataques
+    Sistema de rate limiting para proteção contra ataques (GCRA, até `requests`
+    requisições em `window` segundos, repostas continuamente)
     """
     
     def __init__(self, requests=100, window=3600, key_prefix='rate_limit'):
@@ -20,6 +164,10 @@ class RateLimiter:
         self.window = window
         self.key_prefix = key_prefix
     
+    @property
+    def interval_ms(self):
+        return self.window * 1000 / self.requests
+    
     def get_client_ip(self, request):
         """Obter IP real do cliente"""
         x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
@@ -37,64 +185,62 @@ class RateLimiter:
         company_slug = getattr(request, 'company_slug', 'global')
         return f"{self.key_prefix}:{company_slug}:{ip}:{user_id}:{action}"
     
-    def is_allowed(self, request, action=''):
-        """Verificar se a requisição é permitida (thread-safe)"""
-        cache_key = self.get_cache_key(request, action)
-        current_time = timezone.now().timestamp()
+    def check(self, request, action=''):
+        """
+        Consome uma requisição da cota e informa o resultado numa única operação
+        atômica (uma ida ao Redis).
         
-        # Usar lock para evitar race conditions
-        with _cache_lock:
-            # Obter requisições atuais
-            requests_data = cache.get(cache_key, [])
-            
-            # Remover requisições antigas (fora da janela)
-            cutoff_time = current_time - self.window
-            requests_data = [req_time for req_time in requests_data if req_time > cutoff_time]
-            
-            # Verificar limite ANTES de adicionar nova requisição
-            if len(requests_data) >= self.requests:
-                # Salvar estado limpo no cache para próxima verificação
-                cache.set(cache_key, requests_data, self.window)
-                logger.warning(
-                    f"Rate limit excedido para {self.get_client_ip(request)}",
-                    extra={
-                        'ip': self.get_client_ip(request),
-                        'user_id': request.user.id if request.user.is_authenticated else None,
-                        'action': action,
-                        'requests_count': len(requests_data),
-                        'limit': self.requests,
-                        'timestamp': timezone.now().isoformat()
-                    }
-                )
-                return False
-            
-            # Adicionar requisição atual
-            requests_data.append(current_time)
-            # Cache com timeout = window + margem de segurança (10%)
-            cache.set(cache_key, requests_data, int(self.window * 1.1))
+        Returns:
+            RateLimitResult
+        """
+        cache_key = self.get_cache_key(request, action)
+        now = time.time() * 1000
+        backend = _get_backend()
+        try:
+            allowed, remaining, retry_ms, reset_ms = backend.hit(cache_key, now, self.interval_ms, self.window * 1000)
+        except Exception as e:
+            if backend is _local_backend:
+                raise
+            # Redis fora do ar não derruba o site: limite por processo até ele voltar
+            logger.error(f"Erro no rate limiting via Redis, usando limite local: {e}")
+            allowed, remaining, retry_ms, reset_ms = _local_backend.hit(cache_key, now, self.interval_ms, self.window * 1000)
         
-        return True
+        if not allowed:
+            logger.warning(
+                f"Rate limit excedido para {self.get_client_ip(request)}",
+                extra={
+                    'ip': self.get_client_ip(request),
+                    'user_id': request.user.id if request.user.is_authenticated else None,
+                    'action': action,
+                    'limit': self.requests,
+                    'retry_after': retry_ms / 1000,
+                    'timestamp': timezone.now().isoformat()
+                }
+            )
+        return RateLimitResult(allowed, self.requests, remaining, retry_ms / 1000, reset_ms / 1000)
+    
+    def is_allowed(self, request, action=''):
+        """Verificar se a requisição é permitida (consome uma requisição da cota)"""
+        return self.check(request, action).allowed
     
     def get_remaining_requests(self, request, action=''):
-        """Obter número de requisições restantes (com limpeza do cache)"""
+        """Obter número de requisições restantes sem consumir a cota"""
         cache_key = self.get_cache_key(request, action)
-        current_time = timezone.now().timestamp()
-        cutoff_time = current_time - self.window
-        
-        with _cache_lock:
-            # Obter requisições atuais
-            requests_data = cache.get(cache_key, [])
-            
-            # Remover requisições antigas (fora da janela)
-            valid_requests = [req_time for req_time in requests_data if req_time > cutoff_time]
-            
-            # Salvar estado limpo no cache
-            if len(valid_requests) != len(requests_data):
-                cache.set(cache_key, valid_requests, int(self.window * 1.1))
-            
-            remaining = max(0, self.requests - len(valid_requests))
-        
-        return remaining
+        try:
+            tat, now = _get_backend().peek(cache_key)
+        except Exception as e:
+            logger.error(f"Erro ao consultar rate limiting via Redis: {e}")
+            tat, now = _local_backend.peek(cache_key)
+        if tat is None:
+            return self.requests
+        elapsed = max(0, tat - now)
+        return max(0, min(self.requests, math.floor((self.window * 1000 - elapsed) / self.interval_ms)))
+    
+    def reset(self, request, action=''):
+        """Zerar a cota de um IP/usuário"""
+        cache_key = self.get_cache_key(request, action)
+        _local_backend.delete(cache_key)
+        cache.delete(cache_key)
 
 # Instâncias de rate limiter para diferentes ações
 login_limiter = RateLimiter(requests=20, window=900)  # 20 tentativas em 15 minutos (mais permissivo)
@@ -114,35 +260,37 @@ def rate_limit(limiter, action=''):
             if settings.DEBUG:
                 return view_func(request, *args, **kwargs)
             
-            if not limiter.is_allowed(request, action):
+            result = limiter.check(request, action)
+            if not result.allowed:
+                retry_after = max(1, math.ceil(result.retry_after))
                 if request.headers.get('Accept') == 'application/json':
-                    return JsonResponse({
+                    response = JsonResponse({
                         'error': 'Rate limit excedido',
-                        'retry_after': limiter.window
+                        'retry_after': retry_after
                     }, status=429)
                 else:
-                    return HttpResponse(
-                        f"Rate limit excedido. Tente novamente em {limiter.window} segundos.",
+                    response = HttpResponse(
+                        f"Rate limit excedido. Tente novamente em {retry_after} segundos.",
                         status=429
                     )
-            
-            # Calcular requisições restantes ANTES de processar a view
-            remaining = limiter.get_remaining_requests(request, action)
+                response['Retry-After'] = str(retry_after)
+                return response
             
             # Processar a view
             response = view_func(request, *args, **kwargs)
             
-            # Adicionar headers informativos na resposta
+            # Adicionar headers informativos na resposta (resultado da própria verificação)
+            reset = str(int(timezone.now().timestamp() + result.reset_after))
             if hasattr(response, '__setitem__'):
                 # Para HttpResponse/JsonResponse (dict-like)
                 response['X-RateLimit-Limit'] = str(limiter.requests)
-                response['X-RateLimit-Remaining'] = str(remaining)
-                response['X-RateLimit-Reset'] = str(int(timezone.now().timestamp() + limiter.window))
+                response['X-RateLimit-Remaining'] = str(result.remaining)
+                response['X-RateLimit-Reset'] = reset
             elif hasattr(response, 'headers'):
                 # Para outras respostas com headers (Django HttpResponse)
                 response.headers['X-RateLimit-Limit'] = str(limiter.requests)
-                response.headers['X-RateLimit-Remaining'] = str(remaining)
-                response.headers['X-RateLimit-Reset'] = str(int(timezone.now().timestamp() + limiter.window))
+                response.headers['X-RateLimit-Remaining'] = str(result.remaining)
+                response.headers['X-RateLimit-Reset'] = reset
             
             return response
         return _wrapped
@@ -167,13 +315,12 @@ def general_rate_limit(view_func):
 
 def clear_rate_limit(request, action=''):
     """Limpar rate limit para um IP/usuário específico"""
-    limiter = RateLimiter()
-    cache_key = limiter.get_cache_key(request, action)
-    cache.delete(cache_key)
+    RateLimiter().reset(request, action)
     return True
 
 def clear_all_rate_limits():
     """Limpar todos os rate limits (usar com cuidado)"""
     cache.clear()
+    _local_backend.clear()
     return True
 
@@ -1,13 +1,14 @@
 """
 Sistema de Relatórios Avançados para RM Systems SaaS
 """
-from django.db.models import Count, Q, Avg, Sum
+from django.db.models import Count, F, Q, Avg, Sum
 from django.utils import timezone
 from datetime import timedelta, datetime
 from django.http import HttpResponse
 import csv
 import json
 
+from .company_stats import companies_with_stats, get_company_stats, totals
 from .models import Company, CustomUser, CTOMapFile
 
 class ReportGenerator:
@@ -39,17 +40,18 @@ class ReportGenerator:
         """Métricas específicas da empresa"""
         users = CustomUser.objects.filter(company=company)
         maps = CTOMapFile.objects.filter(company=company)
+        stats = get_company_stats(company)
         
         return {
             'company_info': {
                 'name': company.name,
                 'created_at': company.created_at,
-                'total_users': users.count(),
-                'active_users': users.filter(is_active=True).count(),
-                'inactive_users': users.filter(is_active=False).count()
+                'total_users': stats.total_users,
+                'active_users': stats.active_users,
+                'inactive_users': stats.total_users - stats.active_users
             },
             'map_statistics': {
-                'total_maps': maps.count(),
+                'total_maps': stats.total_maps,
                 'by_file_type': ReportGenerator._get_file_type_distribution(maps),
                 'by_status': ReportGenerator._get_status_distribution(maps),
                 'upload_frequency': ReportGenerator._get_upload_frequency(maps),
@@ -70,18 +72,17 @@ class ReportGenerator:
     @staticmethod
     def get_system_wide_metrics():
         """Métricas do sistema completo"""
-        companies = Company.objects.all()
+        companies = companies_with_stats()
         users = CustomUser.objects.all()
         maps = CTOMapFile.objects.all()
+        somas = totals()
         
         return {
             'system_overview': {
                 'total_companies': companies.count(),
-                'total_users': users.count(),
-                'total_maps': maps.count(),
-                'active_companies': companies.filter(
-                    customuser__is_active=True
-                ).distinct().count()
+                'total_users': somas['total_users'],
+                'total_maps': somas['total_maps'],
+                'active_companies': companies.filter(active_users__gt=0).count()
             },
             'company_rankings': ReportGenerator._get_company_rankings(companies),
             'usage_statistics': {
@@ -237,22 +238,22 @@ class ReportGenerator:
     def _get_company_rankings(companies):
         """Ranking de empresas"""
         return list(companies.annotate(
-            user_count=Count('customuser'),
-            map_count=Count('ctomapfile')
+            user_count=F('total_users'),
+            map_count=F('total_maps')
         ).order_by('-map_count')[:10])
     
     @staticmethod
     def _get_maps_by_company(companies):
         """Mapas por empresa"""
         return list(companies.annotate(
-            map_count=Count('ctomapfile')
+            map_count=F('total_maps')
         ).order_by('-map_count'))
     
     @staticmethod
     def _get_users_by_company(companies):
         """Usuários por empresa"""
         return list(companies.annotate(
-            user_count=Count('customuser')
+            user_count=F('total_users')
         ).order_by('-user_count'))
     
     @staticmethod
@@ -0,0 +1,56 @@
+"""
+Backends de sessão com escrita limitada.
+
+Com SESSION_SAVE_EVERY_REQUEST=True o Django regrava a sessão em toda requisição só
+para empurrar a expiração, inclusive nas chamadas AJAX do mapa (viabilidade,
+geocodificação, polling de notificações). Estes backends só regravam uma sessão não
+alterada quando já passou SESSION_REFRESH_FRACTION de SESSION_COOKIE_AGE desde a
+última gravação; a sessão ociosa expira no máximo essa fração mais cedo.
+
+- core.session_backends.db: banco (cache local por processo não é compartilhado)
+- core.session_backends.cached_db: cache (Redis) com o banco como fallback
+"""
+import threading
+import time
+
+from django.conf import settings
+
+# Momento da última gravação, guardado nos próprios dados da sessão
+REFRESHED_AT_KEY = '_refreshed_at'
+
+_lock = threading.Lock()
+_stats = {
+    'gravacoes': 0,
+    'gravacoes_evitadas': 0,
+}
+
+
+def _contar(nome):
+    with _lock:
+        _stats[nome] += 1
+
+
+def estatisticas():
+    """Gravações de sessão feitas e evitadas por este worker"""
+    with _lock:
+        return dict(_stats)
+
+
+class ThrottledSaveMixin:
+    """Pula save() de sessões não alteradas enquanto a expiração não precisa ser renovada"""
+
+    def _refresh_due(self):
+        refreshed_at = self._get_session().get(REFRESHED_AT_KEY)
+        if refreshed_at is None:
+            return True
+        fraction = getattr(settings, 'SESSION_REFRESH_FRACTION', 0.1)
+        return time.time() - refreshed_at >= fraction * self.get_expiry_age()
+
+    def save(self, must_create=False):
+        if not must_create and self.session_key is not None and not self.modified and not self._refresh_due():
+            _contar('gravacoes_evitadas')
+            return
+        # Direto no dicionário: não marca a sessão como modificada
+        self._get_session(no_load=must_create)[REFRESHED_AT_KEY] = time.time()
+        super().save(must_create)
+        _contar('gravacoes')
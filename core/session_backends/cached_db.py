@@ -0,0 +1,7 @@
+from django.contrib.sessions.backends import cached_db
+
+from . import ThrottledSaveMixin
+
+
+class SessionStore(ThrottledSaveMixin, cached_db.SessionStore):
+    """Sessões no cache (Redis) com fallback no banco e renovação de expiração limitada"""
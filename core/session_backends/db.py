@@ -0,0 +1,7 @@
+from django.contrib.sessions.backends import db
+
+from . import ThrottledSaveMixin
+
+
+class SessionStore(ThrottledSaveMixin, db.SessionStore):
+    """Sessões no banco com renovação de expiração limitada"""
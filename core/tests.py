@@ -8,6 +8,7 @@ from django.core.files.uploadedfile import SimpleUploadedFile
 from django.utils import timezone
 from datetime import timedelta
 import json
+import os
 
 from .models import Company, CTOMapFile
 from .forms import CustomUserForm, CustomUserChangeForm
@@ -34,6 +35,22 @@ class CompanyModelTest(TestCase):
         """Teste do método __str__"""
         self.assertEqual(str(self.company), "Test Company")
 
+    def test_slug_resolution_cached_until_company_saved(self):
+        """Resolução slug -> empresa vem do cache e é invalidada ao salvar a empresa"""
+        from .company_cache import get_company_by_slug
+        self.assertEqual(get_company_by_slug('Test-Company').id, self.company.id)
+        self.assertIsNone(get_company_by_slug('Test-Company', exact=True))
+        self.assertIsNone(get_company_by_slug('nao-existe'))
+
+        with self.assertNumQueries(0):
+            company = get_company_by_slug('test-company', exact=True)
+            company.name = "Alterada sem salvar"
+            self.assertEqual(get_company_by_slug('test-company').name, "Test Company")
+
+        self.company.is_active = False
+        self.company.save()
+        self.assertFalse(get_company_by_slug('test-company').is_active)
+
 class UserModelTest(TestCase):
     """Testes para o modelo User"""
     
@@ -101,6 +118,40 @@ class LoginViewTest(TestCase):
         })
         self.assertEqual(response.status_code, 302)
 
+    def test_unmodified_session_not_rewritten_until_refresh_due(self):
+        """Requisições seguidas não regravam a sessão; passada a fração da validade, regravam"""
+        from unittest import mock
+        from django.contrib.sessions.models import Session
+        from . import session_backends
+        self.user.must_change_password = False
+        self.user.save()
+        self.client.login(username="testuser", password="testpass123")
+        url = reverse('verificador:api_cache_geocoding_stats')
+        session_key = self.client.session.session_key
+        expira = Session.objects.get(session_key=session_key).expire_date
+        evitadas = session_backends.estatisticas()['gravacoes_evitadas']
+
+        for _ in range(3):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(session_backends.estatisticas()['gravacoes_evitadas'], evitadas + 3)
+        self.assertEqual(Session.objects.get(session_key=session_key).expire_date, expira)
+
+        with mock.patch('core.session_backends.time.time', return_value=session_backends.time.time() + 400):
+            self.client.get(url)
+        self.assertGreater(Session.objects.get(session_key=session_key).expire_date, expira)
+
+    def test_cache_stats_restricted_to_rm_admin(self):
+        """Estatísticas de cache da plataforma não ficam visíveis para usuários de empresa"""
+        self.user.must_change_password = False
+        self.user.save()
+        self.client.login(username="testuser", password="testpass123")
+        url = reverse('verificador:api_cache_stats')
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.user.role = 'RM'
+        self.user.save()
+        self.assertEqual(self.client.get(url).status_code, 200)
+
 class DashboardViewTest(TestCase):
     """Testes para views de dashboard"""
     
@@ -303,6 +354,150 @@ class SecurityTest(TestCase):
         response = self.client.get(f'/company/{other_company.slug}/dashboard/')
         self.assertEqual(response.status_code, 403)  # Acesso negado
 
+    def test_rate_limiter_reports_remaining_and_retry_after(self):
+        """Rate limiter: cota consumida por requisição, negação com retry_after e reset"""
+        from django.contrib.auth.models import AnonymousUser
+        from django.test import RequestFactory
+        from .rate_limiting import RateLimiter
+        limiter = RateLimiter(requests=3, window=60, key_prefix='rate_limit_test')
+        request = RequestFactory().get('/', REMOTE_ADDR='10.0.0.1')
+        request.user = AnonymousUser()
+
+        self.assertEqual([limiter.check(request, 'x').remaining for _ in range(3)], [2, 1, 0])
+        negado = limiter.check(request, 'x')
+        self.assertFalse(negado.allowed)
+        self.assertTrue(0 < negado.retry_after <= 20)
+        self.assertEqual(limiter.get_remaining_requests(request, 'x'), 0)
+
+        limiter.reset(request, 'x')
+        self.assertEqual(limiter.get_remaining_requests(request, 'x'), 3)
+        self.assertTrue(limiter.is_allowed(request, 'x'))
+
+    def test_audit_events_queued_and_queryable_by_rm(self):
+        """Auditoria: fila grava o arquivo fora da requisição; eventos no banco filtráveis pelo RM"""
+        import tempfile
+        from django.test import override_settings
+        from . import audit_logger
+        from .models import AuditEvent
+
+        with tempfile.TemporaryDirectory() as logs_dir:
+            arquivo = os.path.join(logs_dir, 'audit.log')
+            with override_settings(AUDIT_LOG_ASYNC=True, AUDIT_LOG_FILE=arquivo, AUDIT_DB_ENABLED=False):
+                audit_logger.log_login(self.user, '10.0.0.1')
+                audit_logger.encerrar()
+            with open(arquivo, encoding='utf-8') as f:
+                linha = f.read()
+        self.assertIn('INFO - {', linha)
+        self.assertEqual(json.loads(linha.split(' - ', 2)[2])['action'], 'login_success')
+
+        with override_settings(AUDIT_LOG_ASYNC=False, AUDIT_LOG_FILE='', AUDIT_DB_ENABLED=True):
+            audit_logger.log_login(self.user, '10.0.0.1')
+            audit_logger.log_failed_login('intruso', 'desconhecido')
+        login, falha = AuditEvent.objects.order_by('created_at', 'id')
+        self.assertEqual((login.category, login.action, login.company_id, login.ip_address),
+                         ('user_action', 'login_success', self.company.id, '10.0.0.1'))
+        self.assertEqual((falha.category, falha.level, falha.ip_address), ('security', 'warning', None))
+        self.assertEqual(login.month, login.created_at.date().replace(day=1))
+
+        rm = User.objects.create_user(username='rmaudit', password='testpass123', role='RM',
+                                      must_change_password=False)
+        self.client.force_login(rm)
+        response = self.client.get(reverse('rm:audit_events'), {'category': 'security'})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'failed_login')
+        self.assertNotContains(response, '10.0.0.1')
+
+    def test_metrics_endpoint_restricted_and_reports_view_latency(self):
+        """Métricas: latência por view e consultas no texto do Prometheus, só para RM ou token"""
+        from django.test import override_settings
+        url = reverse('rm:metrics')
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        rm = User.objects.create_user(username='rmmetrics', password='testpass123', role='RM',
+                                      must_change_password=False)
+        self.client.force_login(rm)
+        self.client.get(reverse('rm:audit_events'))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        texto = response.content.decode()
+        self.assertIn('# TYPE http_request_duration_seconds histogram', texto)
+        self.assertIn('http_request_duration_seconds_bucket{method="GET",view="rm:audit_events",le="+Inf"}', texto)
+        self.assertIn('db_queries_total{view="rm:audit_events"}', texto)
+
+        self.client.logout()
+        with override_settings(METRICS_TOKEN='segredo'):
+            self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer errado').status_code, 302)
+            self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer segredo').status_code, 200)
+
+    def test_profiling_on_demand_for_rm_with_pstats_and_speedscope_download(self):
+        """Perfil sob demanda: só para RM, listado e baixado em pstats ou speedscope"""
+        import pstats
+        import tempfile
+        from .models import RequestProfile
+        url = reverse('rm:audit_events')
+
+        self.client.login(username="testuser", password="testpass123")
+        self.client.get(url, {'_profile': '1'})
+        self.assertFalse(RequestProfile.objects.exists())
+
+        rm = User.objects.create_user(username='rmprofile', password='testpass123', role='RM',
+                                      must_change_password=False)
+        self.client.force_login(rm)
+        response = self.client.get(url, {'_profile': '1'})
+        self.assertEqual(response.status_code, 200)
+        profile = RequestProfile.objects.get(id=response['X-Profile-Id'])
+        self.assertEqual((profile.kind, profile.trigger, profile.view_name), ('cprofile', 'manual', 'rm:audit_events'))
+        self.assertTrue(profile.top_entries)
+
+        download = self.client.get(reverse('rm:profile_download', args=[profile.id]))
+        with tempfile.NamedTemporaryFile(suffix='.pstats') as f:
+            f.write(download.content)
+            f.flush()
+            self.assertTrue(pstats.Stats(f.name).total_calls > 0)
+
+        response = self.client.get(url, HTTP_X_PROFILE='sample')
+        speedscope = json.loads(self.client.get(
+            reverse('rm:profile_download', args=[response['X-Profile-Id']])
+        ).content)
+        self.assertEqual(speedscope['profiles'][0]['type'], 'sampled')
+
+        listagem = self.client.get(reverse('rm:profile_list'))
+        self.assertContains(listagem, 'speedscope')
+        self.assertEqual(self.client.get(reverse('rm:profile_detail', args=[profile.id])).status_code, 200)
+
+    def test_company_stats_rollup_follows_signals_and_reconciles(self):
+        """CompanyStats acompanha usuários/mapas via signals e o comando corrige divergências"""
+        from django.core.management import call_command
+        from .models import CompanyStats
+        rm = User.objects.create_user(username='rmstats', password='testpass123', role='RM',
+                                      must_change_password=False)
+        other = Company.objects.create(name="Other Company", email="other@company.com", cnpj="22.222.222/0001-22")
+        with self.captureOnCommitCallbacks(execute=True):
+            CTOMapFile.objects.create(file='cto_maps/a.csv', company=self.company, uploaded_by=rm)
+            CTOMapFile.objects.create(file='cto_maps/b.csv', company=self.company, uploaded_by=rm,
+                                      is_processed=True)
+            User.objects.create_user(username='inativo', password='testpass123', company=other, is_active=False)
+
+        stats = CompanyStats.objects.get(company=self.company)
+        self.assertEqual((stats.total_users, stats.total_maps, stats.processed_maps, stats.pending_maps), (1, 2, 1, 1))
+        other_stats = CompanyStats.objects.get(company=other)
+        self.assertEqual((other_stats.total_users, other_stats.active_users), (1, 0))
+
+        # update() não dispara signals: só a reconciliação enxerga
+        CTOMapFile.objects.filter(company=self.company).update(is_processed=True)
+        call_command('reconcile_company_stats', stdout=open(os.devnull, 'w'))
+        stats.refresh_from_db()
+        self.assertEqual((stats.processed_maps, stats.pending_maps), (2, 0))
+
+        self.client.force_login(rm)
+        with self.assertNumQueries(4):  # sessão, usuário, empresas + CompanyStats, mapas
+            response = self.client.get(reverse('rm:map_by_company'))
+        totais = dict(zip(response.context['chart_labels'], response.context['chart_totals']))
+        self.assertEqual((totais["Test Company"], totais["Other Company"]), (2, 0))
+        response = self.client.get(reverse('rm:reports'))
+        self.assertEqual((response.context['total_maps'], response.context['overall_processed']), (2, 2))
+
 class PerformanceTest(TestCase):
     """Testes de performance"""
     
@@ -353,4 +548,650 @@ class PerformanceTest(TestCase):
         
         # Verificar se a resposta foi rápida mesmo com muitos dados
         self.assertLess(end_time - start_time, 2.0)
-        self.assertEqual(response.status_code, 200)
\ No newline at end of file
+        self.assertEqual(response.status_code, 200)
+
+class MapIngestionTest(TestCase):
+    """Testes da fila de ingestão de mapas"""
+    
+    KML_CONTENT = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<kml xmlns="http://www.opengis.net/kml/2.2"><Document>'
+        '<Placemark><name>CTO-01</name><Point><coordinates>-46.63,-23.55,0</coordinates></Point></Placemark>'
+        '<Placemark><name>CTO-02</name><Point><coordinates>-46.64,-23.56,0</coordinates></Point></Placemark>'
+        '</Document></kml>'
+    )
+    
+    def setUp(self):
+        import tempfile
+        from django.test import override_settings
+        self.media_dir = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_dir, MAP_INGESTION_ASYNC=False)
+        self.settings_override.enable()
+        
+        self.client = Client()
+        self.company = Company.objects.create(name="Ingest Company", email="ingest@company.com")
+        self.user = User.objects.create_user(
+            username="ingestadmin",
+            email="ingest@user.com",
+            password="testpass123",
+            company=self.company,
+            role="COMPANY_ADMIN",
+            must_change_password=False
+        )
+        self.client.login(username="ingestadmin", password="testpass123")
+    
+    def tearDown(self):
+        import shutil
+        self.settings_override.disable()
+        shutil.rmtree(self.media_dir, ignore_errors=True)
+    
+    def test_upload_returns_pending_and_worker_completes(self):
+        """Upload responde imediatamente com status pendente e o worker conclui a análise"""
+        kml_file = SimpleUploadedFile(
+            "rede.kml",
+            self.KML_CONTENT.encode(),
+            content_type="application/vnd.google-earth.kml+xml"
+        )
+        url = reverse('company:map_upload', kwargs={'company_slug': self.company.slug})
+        
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            response = self.client.post(url, {'file': kml_file}, HTTP_ACCEPT='application/json')
+        
+        self.assertEqual(response.status_code, 202)
+        data = json.loads(response.content)
+        self.assertTrue(data['analysis_pending'])
+        map_file = CTOMapFile.objects.get(id=data['file_id'])
+        self.assertEqual(map_file.processing_status, 'pending')
+        
+        # Executar o worker (agendado para depois do commit)
+        for callback in callbacks:
+            callback()
+        
+        response = self.client.get(data['status_url'])
+        status_data = json.loads(response.content)
+        self.assertEqual(status_data['processing_status'], 'completed')
+        self.assertEqual(status_data['analysis']['coordinates_count'], 2)
+
+    def test_pending_and_rejected_maps_hidden_and_rejected_file_discarded(self):
+        """Mapas pendentes/recusados não são listados; o arquivo recusado é apagado e não volta à fila"""
+        from unittest import mock
+        from .ingestion import process_map_file
+        from django.core.cache import cache
+        from ftth_viewer.utils import get_all_ctos, listar_arquivos
+        cache.clear()  # ids de empresa se repetem entre testes
+        url = reverse('company:map_upload', kwargs={'company_slug': self.company.slug})
+
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            response = self.client.post(url, {'file': SimpleUploadedFile("rede.kml", self.KML_CONTENT.encode())})
+        map_file = CTOMapFile.objects.get(id=json.loads(response.content)['file_id'])
+        caminho = map_file.file.path
+        self.assertEqual(listar_arquivos(self.company, refresh=True), [])
+        self.assertEqual(get_all_ctos(self.company), [])
+
+        recusa = {'success': False, 'error': 'Conteúdo suspeito'}
+        with mock.patch('core.verificador_service.VerificadorService.verificar_arquivo', return_value=recusa):
+            for callback in callbacks:
+                callback()
+        map_file.refresh_from_db()
+        self.assertEqual(map_file.processing_status, 'failed')
+        self.assertFalse(map_file.file)
+        self.assertFalse(os.path.exists(caminho))
+        self.assertFalse(process_map_file(map_file.id))
+        self.assertEqual(listar_arquivos(self.company, refresh=True), [])
+
+    def test_stuck_processing_map_is_reclaimed_by_command(self):
+        """Mapa preso em 'processing' (worker perdido) volta à fila e é processado; em andamento, não"""
+        from datetime import timedelta
+        from django.core.management import call_command
+        from io import StringIO
+        url = reverse('company:map_upload', kwargs={'company_slug': self.company.slug})
+        with self.captureOnCommitCallbacks(execute=False):
+            preso = self.client.post(url, {'file': SimpleUploadedFile("rede.kml", self.KML_CONTENT.encode())})
+            recente = self.client.post(url, {'file': SimpleUploadedFile(
+                "outra.kml", self.KML_CONTENT.replace('CTO-02', 'CTO-03').encode()
+            )})
+        preso_id = json.loads(preso.content)['file_id']
+        recente_id = json.loads(recente.content)['file_id']
+        CTOMapFile.objects.filter(id=preso_id).update(
+            processing_status='processing', updated_at=timezone.now() - timedelta(hours=2)
+        )
+        CTOMapFile.objects.filter(id=recente_id).update(processing_status='processing', updated_at=timezone.now())
+
+        call_command('process_pending_maps', stdout=StringIO())
+
+        self.assertEqual(CTOMapFile.objects.get(id=preso_id).processing_status, 'completed')
+        self.assertEqual(CTOMapFile.objects.get(id=recente_id).processing_status, 'processing')
+
+    def test_identical_reupload_reuses_existing_map(self):
+        """Re-upload do mesmo conteúdo com outro nome reaproveita o mapa existente"""
+        url = reverse('company:map_upload', kwargs={'company_slug': self.company.slug})
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            first = self.client.post(url, {'file': SimpleUploadedFile("rede.kml", self.KML_CONTENT.encode())})
+        second = self.client.post(url, {'file': SimpleUploadedFile("rede_copia.kml", self.KML_CONTENT.encode())})
+        
+        first_data = json.loads(first.content)
+        second_data = json.loads(second.content)
+        self.assertTrue(second_data['duplicate'])
+        self.assertEqual(second_data['file_id'], first_data['file_id'])
+        self.assertEqual(CTOMapFile.objects.filter(company=self.company).count(), 1)
+        # O arquivo do re-upload, gravado junto com o hash, é descartado
+        self.assertEqual(os.listdir(os.path.join(self.media_dir, 'cto_maps')), ['rede.kml'])
+    
+    def test_upload_rejects_invalid_extension_before_queue(self):
+        """Extensões inválidas são rejeitadas no request, sem criar registro"""
+        txt_file = SimpleUploadedFile("mapa.txt", b"conteudo", content_type="text/plain")
+        url = reverse('company:map_upload', kwargs={'company_slug': self.company.slug})
+        
+        response = self.client.post(url, {'file': txt_file}, HTTP_ACCEPT='application/json')
+        
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(CTOMapFile.objects.filter(company=self.company).exists())
+
+
+
+class CTOJournalTest(TestCase):
+    """Testes do journal de edições de CTOs"""
+    
+    def setUp(self):
+        import tempfile
+        from django.test import override_settings
+        self.media_dir = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_dir, MAP_INGESTION_ASYNC=False)
+        self.settings_override.enable()
+        
+        self.client = Client()
+        self.company = Company.objects.create(name="Journal Company", email="journal@company.com")
+        User.objects.create_user(
+            username="journaladmin",
+            email="journal@user.com",
+            password="testpass123",
+            company=self.company,
+            role="COMPANY_ADMIN",
+            must_change_password=False
+        )
+        self.client.login(username="journaladmin", password="testpass123")
+        
+        url = reverse('company:map_upload', kwargs={'company_slug': self.company.slug})
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, {'file': SimpleUploadedFile("rede.kml", MapIngestionTest.KML_CONTENT.encode())})
+        self.map_file = CTOMapFile.objects.get(id=json.loads(response.content)['file_id'])
+    
+    def tearDown(self):
+        import shutil
+        self.settings_override.disable()
+        shutil.rmtree(self.media_dir, ignore_errors=True)
+    
+    def _editar(self, url_name, payload):
+        payload = dict(payload, map_id=self.map_file.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                reverse(f'verificador:{url_name}'), json.dumps(payload), content_type='application/json'
+            )
+    
+    def test_edits_are_journaled_and_overlaid(self):
+        """Adicionar/remover não reescreve o arquivo, mas os leitores já veem a edição"""
+        from ftth_viewer.utils import get_all_ctos
+        with open(self.map_file.file.path, 'rb') as fh:
+            original = fh.read()
+        
+        self.assertEqual(self._editar('api_adicionar_cto', {'nome_cto': 'CTO-03', 'lat': -23.57, 'lon': -46.65}).status_code, 200)
+        self.assertEqual(self._editar('api_remover_cto', {'nome_cto': 'CTO-01', 'lat': -23.55, 'lon': -46.63}).status_code, 200)
+        self.assertEqual(self._editar('api_remover_cto', {'nome_cto': 'CTO-99', 'lat': 1, 'lon': 1}).status_code, 404)
+        
+        with open(self.map_file.file.path, 'rb') as fh:
+            self.assertEqual(fh.read(), original)
+        nomes = sorted(cto['nome'] for cto in get_all_ctos(self.company))
+        self.assertEqual(nomes, ['CTO-02', 'CTO-03'])
+    
+    def test_edit_updates_cached_index_and_coordinates_in_place(self):
+        """Edição atualiza índice e payload de coordenadas já cacheados, sem reler o arquivo"""
+        from unittest import mock
+        from ftth_viewer.utils import get_all_ctos
+        coords_url = reverse('verificador:api_coordenadas') + f'?id={self.map_file.id}'
+        get_all_ctos(self.company)
+        self.client.get(coords_url)
+        
+        with mock.patch('ftth_viewer.utils._ler_mapas') as ler_mapas, \
+                mock.patch('ftth_viewer.views.ler_kml') as ler_kml:
+            self._editar('api_adicionar_cto', {'nome_cto': 'CTO-03', 'lat': -23.57, 'lon': -46.65})
+            nomes_indice = sorted(cto['nome'] for cto in get_all_ctos(self.company))
+            nomes_coords = sorted(c['nome'] for c in json.loads(self.client.get(coords_url).content))
+        
+        ler_mapas.assert_not_called()
+        ler_kml.assert_not_called()
+        self.assertEqual(nomes_indice, ['CTO-01', 'CTO-02', 'CTO-03'])
+        self.assertEqual(nomes_coords, ['CTO-01', 'CTO-02', 'CTO-03'])
+
+    def test_index_served_from_local_tier_until_generation_changes(self):
+        """Com a geração inalterada o índice vem do L1 do worker, sem buscar o payload no Redis"""
+        from unittest import mock
+        from ftth_viewer import cache_camadas
+        from ftth_viewer.utils import avancar_geracao_indice, get_all_ctos
+        cache_camadas.limpar()
+        self.addCleanup(cache_camadas.limpar)
+        get_all_ctos(self.company)
+
+        with mock.patch.object(cache_camadas.cache, 'get', wraps=cache_camadas.cache.get) as cache_get:
+            self.assertEqual(len(get_all_ctos(self.company)), 2)
+        chaves = [chamada.args[0] for chamada in cache_get.call_args_list]
+        self.assertEqual(chaves, [f'ns_gen:company_{self.company.id}'])
+        self.assertEqual(cache_camadas.estatisticas()['l1_hits'], 1)
+
+        avancar_geracao_indice(self.company.id)
+        with mock.patch('ftth_viewer.utils._ler_mapas', return_value={self.map_file.id: ([], 0.0, None)}) as ler_mapas:
+            self.assertEqual(get_all_ctos(self.company), [])
+        ler_mapas.assert_called_once()
+
+    def test_map_delete_invalidates_file_listing_namespace(self):
+        """Excluir um mapa invalida a listagem em cache de todos os usuários da empresa"""
+        arquivos_url = reverse('verificador:api_arquivos')
+        self.assertEqual(len(json.loads(self.client.get(arquivos_url).content)), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('company:map_delete', kwargs={
+                'company_slug': self.company.slug, 'pk': self.map_file.id
+            }))
+
+        self.assertEqual(json.loads(self.client.get(arquivos_url).content), [])
+
+    def test_map_mutations_leave_no_stale_reads(self):
+        """Upload e exclusão invalidam índice, coordenadas e listagem já cacheados"""
+        from ftth_viewer.invalidation import artefatos
+        from ftth_viewer.utils import get_all_ctos
+        self.assertEqual(
+            sorted(artefatos('excluido')),
+            ['coordenadas', 'indice_ctos', 'listagem_arquivos', 'paineis', 'resultados_viabilidade']
+        )
+        arquivos_url = reverse('verificador:api_arquivos')
+        coords_url = reverse('verificador:api_coordenadas') + f'?id={self.map_file.id}'
+        self.assertEqual(len(get_all_ctos(self.company)), 2)
+        self.assertEqual(len(json.loads(self.client.get(arquivos_url).content)), 1)
+        self.assertEqual(len(json.loads(self.client.get(coords_url).content)), 2)
+
+        kml = MapIngestionTest.KML_CONTENT.replace('CTO-01', 'CTO-11').replace('CTO-02', 'CTO-12')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse('company:map_upload', kwargs={'company_slug': self.company.slug}),
+                {'file': SimpleUploadedFile("rede2.kml", kml.encode())}
+            )
+        self.assertEqual(len(get_all_ctos(self.company)), 4)
+        self.assertEqual(len(json.loads(self.client.get(arquivos_url).content)), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('company:map_delete', kwargs={
+                'company_slug': self.company.slug, 'pk': self.map_file.id
+            }))
+        self.assertEqual(sorted(cto['nome'] for cto in get_all_ctos(self.company)), ['CTO-11', 'CTO-12'])
+        self.assertEqual(len(json.loads(self.client.get(arquivos_url).content)), 1)
+        self.assertEqual(self.client.get(coords_url).status_code, 404)
+
+    def test_warm_caches_rebuilds_map_caches_after_cache_loss(self):
+        """Upload já deixa o índice pronto; após perder o cache, warm_caches o remonta com coordenadas e listagem"""
+        from io import StringIO
+        from unittest import mock
+        from django.core.cache import cache
+        from django.core.management import call_command
+        from ftth_viewer import cache_camadas
+        from ftth_viewer.utils import chave_listagem, get_all_ctos
+        coords_url = reverse('verificador:api_coordenadas') + f'?id={self.map_file.id}'
+        with mock.patch('ftth_viewer.utils._ler_mapas') as ler_mapas:
+            self.assertEqual(len(get_all_ctos(self.company)), 2)
+        ler_mapas.assert_not_called()
+
+        cache.clear()
+        cache_camadas.limpar()
+        self.addCleanup(cache_camadas.limpar)
+        out = StringIO()
+        call_command('warm_caches', concurrency=1, stdout=out)
+        self.assertIn(f'{self.company.slug}: 2 CTO(s), 1 mapa(s), 1 payload(s)', out.getvalue())
+
+        with mock.patch('ftth_viewer.utils._ler_mapas') as ler_mapas, \
+                mock.patch('ftth_viewer.views.ler_kml') as ler_kml:
+            self.assertEqual(len(get_all_ctos(self.company)), 2)
+            self.assertEqual(len(json.loads(self.client.get(coords_url).content)), 2)
+        ler_mapas.assert_not_called()
+        ler_kml.assert_not_called()
+        self.assertEqual(len(cache.get(chave_listagem(self.company.id))), 1)
+
+    def test_expired_index_served_stale_while_another_worker_rebuilds(self):
+        """Índice vencido com o lock de reconstrução ocupado: serve o valor antigo sem reler mapas"""
+        import time
+        from unittest import mock
+        from django.core.cache import cache
+        from ftth_viewer import cache_camadas
+        from ftth_viewer.utils import chave_indice, geracao_indice, get_all_ctos
+        cache_camadas.limpar()
+        self.addCleanup(cache_camadas.limpar)
+        cache_key = chave_indice(self.company.id, geracao_indice(self.company.id))
+        get_all_ctos(self.company)
+        cache.set(f'{cache_key}_meta', (time.time() - 1, 0))
+        cache.set(f'{cache_key}_rebuild_lock', 'outro-worker')
+        self.addCleanup(cache.delete, f'{cache_key}_rebuild_lock')
+        cache_camadas.limpar()
+
+        with mock.patch('ftth_viewer.utils._ler_mapas') as ler_mapas:
+            self.assertEqual(len(get_all_ctos(self.company)), 2)
+        ler_mapas.assert_not_called()
+        self.assertEqual(cache_camadas.estatisticas()['stale_hits'], 1)
+
+        cache.delete(f'{cache_key}_rebuild_lock')
+        with mock.patch('ftth_viewer.utils._ler_mapas', return_value={self.map_file.id: ([], 0.0, None)}) as ler_mapas:
+            get_all_ctos(self.company)
+        ler_mapas.assert_called_once()
+        self.assertIsNone(cache.get(f'{cache_key}_rebuild_lock'))
+
+    def test_bulk_edit_reports_each_operation(self):
+        """Lote com add/move/remove inválido: resultado por operação e índice já atualizado"""
+        from ftth_viewer.utils import get_all_ctos
+        get_all_ctos(self.company)  # índice em cache, atualizado incrementalmente pelo lote
+        
+        response = self._editar('api_editar_ctos_lote', {'operacoes': [
+            {'operacao': 'add', 'nome_cto': 'CTO-03', 'lat': -23.57, 'lon': -46.65},
+            {'operacao': 'move', 'nome_cto': 'CTO-02', 'lat': -23.56, 'lon': -46.64, 'nova_lat': -23.58, 'nova_lon': -46.66},
+            {'operacao': 'remove', 'nome_cto': 'CTO-99', 'lat': 1, 'lon': 1},
+        ]})
+        
+        data = json.loads(response.content)
+        self.assertEqual([r['sucesso'] for r in data['resultados']], [True, True, False])
+        ctos = {cto['nome']: cto for cto in get_all_ctos(self.company)}
+        self.assertEqual(sorted(ctos), ['CTO-01', 'CTO-02', 'CTO-03'])
+        self.assertAlmostEqual(ctos['CTO-02']['lat'], -23.58)
+    
+    def test_bulk_edit_is_rate_limited(self):
+        """O lote passa pelo mesmo rate limit das edições individuais"""
+        from unittest import mock
+        from ftth_viewer.models import CTOEdit
+        from .rate_limiting import RateLimitResult, api_limiter
+        negado = RateLimitResult(False, api_limiter.requests, 0, 30, 30)
+        with mock.patch.object(api_limiter, 'check', return_value=negado):
+            response = self._editar('api_editar_ctos_lote', {'operacoes': [
+                {'operacao': 'add', 'nome_cto': 'CTO-03', 'lat': -23.57, 'lon': -46.65},
+            ]})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '30')
+        self.assertFalse(CTOEdit.objects.filter(mapa=self.map_file).exists())
+    
+    def test_edits_invalidate_only_affected_viability_results(self):
+        """Remoção invalida quem tinha o CTO como vencedor; adição só pontos que ele pode atender melhor"""
+        from ftth_viewer.models import ViabilidadeCache
+        
+        def _cache(lat, lon, metros, cto_nome='CTO-02', cto_lat=-23.56, cto_lon=-46.64):
+            return ViabilidadeCache.objects.create(
+                lat=lat, lon=lon, company=self.company, resultado={'distancia': {'metros': metros}},
+                cto_nome=cto_nome, cto_lat=cto_lat, cto_lon=cto_lon, cto_map_id=self.map_file.id,
+            )
+        
+        vencido_pelo_removido = _cache(-23.5505, -46.6305, 60, 'CTO-01', -23.55, -46.63)
+        perto_mas_ja_atendido = _cache(-23.5702, -46.6502, 10)
+        perto_do_novo = _cache(-23.5705, -46.6505, 700)
+        longe_do_novo = _cache(-23.60, -46.70, 900)
+        
+        self._editar('api_remover_cto', {'nome_cto': 'CTO-01', 'lat': -23.55, 'lon': -46.63})
+        self._editar('api_adicionar_cto', {'nome_cto': 'CTO-03', 'lat': -23.57, 'lon': -46.65})
+        
+        restantes = set(ViabilidadeCache.objects.values_list('id', flat=True))
+        self.assertEqual(restantes, {perto_mas_ja_atendido.id, longe_do_novo.id})
+        self.assertNotIn(vencido_pelo_removido.id, restantes)
+        self.assertNotIn(perto_do_novo.id, restantes)
+    
+    def test_viability_cache_hit_for_nearby_click(self):
+        """Cliques na mesma célula da grade reaproveitam o resultado cacheado"""
+        from ftth_viewer.models import ViabilidadeCache
+        ViabilidadeCache.objects.create(
+            lat=-23.565, lon=-46.645, company=self.company, resultado={'viabilidade': {'status': 'Viável'}}
+        )
+        url = reverse('verificador:api_verificar_viabilidade')
+        
+        response = self.client.get(url, {'lat': -23.565001, 'lon': -46.645001})
+        
+        self.assertEqual(json.loads(response.content), {'viabilidade': {'status': 'Viável'}})
+
+    def test_viability_cache_hit_without_route_geometry(self):
+        """Entrada com a geometria descartada pela retenção continua sendo servida do cache"""
+        from ftth_viewer.models import ViabilidadeCache
+        resultado = {'viabilidade': {'status': 'Viável'}, 'rota': {'geometria': None}}
+        ViabilidadeCache.objects.create(
+            lat=-23.565, lon=-46.645, company=self.company, resultado=resultado, tem_geometria=False
+        )
+        url = reverse('verificador:api_verificar_viabilidade')
+
+        response = self.client.get(url, {'lat': -23.565001, 'lon': -46.645001})
+
+        self.assertEqual(json.loads(response.content), resultado)
+
+    def test_route_geometry_fetched_through_server(self):
+        """A geometria descartada é buscada pelo servidor, com o cliente OSRM e o cache de rotas dele"""
+        from unittest import mock
+        url = reverse('verificador:api_rota_viabilidade')
+        geometria = [[-46.645, -23.565], [-46.646, -23.566], [-46.647, -23.567]]
+        with mock.patch('ftth_viewer.views.calcular_rota_ruas', return_value=(250.0, geometria)) as rota:
+            response = self.client.get(url, {'lat': -23.565, 'lon': -46.645, 'cto_lat': -23.567, 'cto_lon': -46.647})
+        self.assertEqual(json.loads(response.content), {'rota': {'geometria': geometria}})
+        rota.assert_called_once_with(-23.565, -46.645, -23.567, -46.647)
+
+        self.assertEqual(self.client.get(url, {'lat': -23.565, 'lon': -46.645}).status_code, 400)
+
+    def test_viability_cache_key_fixed_width_and_square_cells(self):
+        """mapas_hash tem largura fixa e independe da ordem; a célula tem a mesma largura nos dois eixos"""
+        from ftth_viewer.models import ViabilidadeCache
+        mapas = [str(i) for i in range(1000, 1100)]
+        self.assertEqual(len(ViabilidadeCache.hash_mapas(mapas)), 40)
+        self.assertEqual(ViabilidadeCache.hash_mapas(mapas), ViabilidadeCache.hash_mapas(reversed(mapas)))
+        self.assertEqual(ViabilidadeCache.hash_mapas([]), '')
+
+        # A ~60° de latitude, 1 grau de longitude tem metade dos metros de 1 grau de latitude
+        lat_q, lon_q = ViabilidadeCache.quantizar(60.0, 10.0)
+        _lat_q, lon_q_leste = ViabilidadeCache.quantizar(60.0, 10.0 + 2 * 20 / 111320.0)
+        self.assertAlmostEqual(lon_q_leste - lon_q, 4, delta=1)
+
+    def test_viability_cache_writes_are_batched(self):
+        """Resultados ficam na fila (visíveis no próprio worker) e são gravados num único upsert"""
+        from unittest import mock
+        from ftth_viewer import viabilidade_buffer
+        from ftth_viewer.models import ViabilidadeCache
+        self.addCleanup(viabilidade_buffer.descartar_empresa, self.company.id)
+
+        def entrada(lat, status):
+            lat_q, lon_q = ViabilidadeCache.quantizar(lat, -46.6)
+            return ViabilidadeCache(
+                lat=lat, lon=-46.6, lat_q=lat_q, lon_q=lon_q, company=self.company,
+                resultado={'viabilidade': {'status': status}}, status=status
+            )
+
+        with mock.patch.object(viabilidade_buffer, '_iniciar_flusher'):
+            viabilidade_buffer.enfileirar(entrada(-23.5, 'Viável'))
+            viabilidade_buffer.enfileirar(entrada(-23.5, 'Sem viabilidade'))
+            viabilidade_buffer.enfileirar(entrada(-23.6, 'Viável'))
+
+        self.assertFalse(ViabilidadeCache.objects.exists())
+        lat_q, lon_q = ViabilidadeCache.quantizar(-23.5, -46.6)
+        self.assertEqual(
+            viabilidade_buffer.buscar_local(self.company.id, lat_q, lon_q, ''),
+            {'viabilidade': {'status': 'Sem viabilidade'}}
+        )
+
+        with self.assertNumQueries(1):
+            self.assertEqual(viabilidade_buffer.descarregar(), 2)
+        self.assertEqual(
+            sorted(ViabilidadeCache.objects.values_list('status', flat=True)),
+            ['Sem viabilidade', 'Viável']
+        )
+
+    def test_viability_buffer_drops_entries_invalidated_by_other_worker(self):
+        """Invalidação feita em outro worker (só a geração avança) descarta LRU e fila deste"""
+        from unittest import mock
+        from ftth_viewer import viabilidade_buffer
+        from ftth_viewer.models import ViabilidadeCache
+        from .cache_namespaces import bump_generation, viability_namespace
+        self.addCleanup(viabilidade_buffer.descartar_empresa, self.company.id)
+        lat_q, lon_q = ViabilidadeCache.quantizar(-23.5, -46.6)
+
+        geracao = viabilidade_buffer.geracao(self.company.id)
+        with mock.patch.object(viabilidade_buffer, '_iniciar_flusher'):
+            viabilidade_buffer.enfileirar(ViabilidadeCache(
+                lat=-23.5, lon=-46.6, lat_q=lat_q, lon_q=lon_q, company=self.company,
+                resultado={'viabilidade': {'status': 'Viável'}}, status='Viável'
+            ), geracao)
+        self.assertIsNotNone(viabilidade_buffer.buscar_local(self.company.id, lat_q, lon_q, ''))
+
+        bump_generation(viability_namespace(self.company.id))
+        self.assertIsNone(viabilidade_buffer.buscar_local(self.company.id, lat_q, lon_q, ''))
+        self.assertEqual(viabilidade_buffer.descarregar(), 0)
+        self.assertFalse(ViabilidadeCache.objects.exists())
+
+    def test_viability_buffer_undoes_write_invalidated_during_flush(self):
+        """Invalidação entre a verificação da geração e o INSERT: o lote apaga o que gravou"""
+        from unittest import mock
+        from ftth_viewer import viabilidade_buffer
+        from ftth_viewer.models import ViabilidadeCache
+        from .cache_namespaces import bump_generation, viability_namespace
+        self.addCleanup(viabilidade_buffer.descartar_empresa, self.company.id)
+        lat_q, lon_q = ViabilidadeCache.quantizar(-23.5, -46.6)
+        outro_lat_q, _lon_q = ViabilidadeCache.quantizar(-23.6, -46.6)
+        ViabilidadeCache.objects.create(
+            lat=-23.6, lon=-46.6, lat_q=outro_lat_q, lon_q=lon_q, company=self.company,
+            resultado={'viabilidade': {'status': 'Viável'}}, status='Viável'
+        )
+
+        with mock.patch.object(viabilidade_buffer, '_iniciar_flusher'):
+            viabilidade_buffer.enfileirar(ViabilidadeCache(
+                lat=-23.5, lon=-46.6, lat_q=lat_q, lon_q=lon_q, company=self.company,
+                resultado={'viabilidade': {'status': 'Viável'}}, status='Viável'
+            ))
+
+        bulk_create = ViabilidadeCache.objects.bulk_create
+
+        def gravar_e_invalidar(*args, **kwargs):
+            resultado = bulk_create(*args, **kwargs)
+            bump_generation(viability_namespace(self.company.id))
+            return resultado
+
+        with mock.patch.object(ViabilidadeCache.objects, 'bulk_create', side_effect=gravar_e_invalidar):
+            self.assertEqual(viabilidade_buffer.descarregar(), 0)
+        self.assertEqual(list(ViabilidadeCache.objects.values_list('lat_q', flat=True)), [outro_lat_q])
+
+    def test_viability_cache_retention_purge(self):
+        """A purga aplica a validade da empresa, o limite de linhas e o descarte de geometria"""
+        from ftth_viewer.models import ViabilidadeCache
+        from ftth_viewer.retention import purgar_viabilidade
+        self.company.viability_cache_ttl_days = 10
+        self.company.save()
+        agora = timezone.now()
+        for i, dias in enumerate([15, 12, 8, 1]):
+            entrada = ViabilidadeCache.objects.create(
+                lat=-23.5 - i * 0.01, lon=-46.6, company=self.company,
+                resultado={'rota': {'geometria': [[-46.6, -23.5]]}}
+            )
+            ViabilidadeCache.objects.filter(id=entrada.id).update(created_at=agora - timedelta(days=dias))
+
+        with self.settings(FTTH_VIABILIDADE_CACHE_MAX_LINHAS=2, FTTH_VIABILIDADE_GEOMETRIA_DIAS=7):
+            totais = purgar_viabilidade(company=self.company, lote=1)
+
+        self.assertEqual(totais, {'expiradas': 2, 'excedentes': 0, 'sem_geometria': 1})
+        restantes = ViabilidadeCache.objects.order_by('created_at')
+        self.assertEqual([e.tem_geometria for e in restantes], [False, True])
+        self.assertIsNone(restantes[0].resultado['rota']['geometria'])
+
+    def test_compaction_folds_journal_into_file(self):
+        """A compactação grava as edições num arquivo novo, troca o mapa para ele e esvazia o journal"""
+        from ftth_viewer.journal import compactar_mapa, edicoes_pendentes
+        from ftth_viewer.utils import ler_kml
+        self._editar('api_adicionar_cto', {'nome_cto': 'CTO-03', 'lat': -23.57, 'lon': -46.65})
+        self._editar('api_remover_cto', {'nome_cto': 'CTO-01', 'lat': -23.55, 'lon': -46.63})
+        caminho_antigo = self.map_file.file.path
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(compactar_mapa(self.map_file.id), 2)
+        
+        self.assertEqual(edicoes_pendentes([self.map_file.id]), {})
+        self.map_file.refresh_from_db()
+        self.assertNotEqual(self.map_file.file.path, caminho_antigo)
+        self.assertFalse(os.path.exists(caminho_antigo))
+        self.assertEqual(self.map_file.file_name, os.path.basename(caminho_antigo))
+        nomes = sorted(c['nome'] for c in ler_kml(self.map_file.file.path))
+        self.assertEqual(nomes, ['CTO-02', 'CTO-03'])
+        self.assertEqual(self.map_file.file_size, self.map_file.file.size)
+        # 2 edições no journal + 1 compactação
+        self.assertEqual(self.map_file.version, 4)
+    
+    def test_download_applies_journal_without_compacting_in_request(self):
+        """Download serve arquivo + journal sem bloquear/reescrever o mapa; falha no journal não vira 500"""
+        from unittest import mock
+        from ftth_viewer.journal import edicoes_pendentes
+        self._editar('api_adicionar_cto', {'nome_cto': 'CTO-03', 'lat': -23.57, 'lon': -46.65})
+        url = reverse('company:map_download', kwargs={'company_slug': self.company.slug, 'pk': self.map_file.id})
+        with open(self.map_file.file.path, 'rb') as fh:
+            original = fh.read()
+
+        with mock.patch('ftth_viewer.journal.agendar_compactacao') as agendar:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'CTO-03', response.content)
+        agendar.assert_called_once_with(self.map_file.id)
+        with open(self.map_file.file.path, 'rb') as fh:
+            self.assertEqual(fh.read(), original)
+        self.assertEqual(len(edicoes_pendentes([self.map_file.id])[self.map_file.id]), 1)
+
+        with mock.patch('ftth_viewer.utils.aplicar_edicoes_ao_mapa', side_effect=OSError('disco cheio')):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, original)
+
+    def test_failed_atomic_write_keeps_original_file(self):
+        """Erro durante a escrita não trunca o mapa nem deixa temporários"""
+        from ftth_viewer.utils import escrita_atomica
+        caminho = self.map_file.file.path
+        with open(caminho, 'rb') as fh:
+            original = fh.read()
+        
+        with self.assertRaises(RuntimeError):
+            with escrita_atomica(caminho) as temporario:
+                with open(temporario, 'wb') as fh:
+                    fh.write(b'<kml>')
+                raise RuntimeError('falha no meio da escrita')
+        
+        with open(caminho, 'rb') as fh:
+            self.assertEqual(fh.read(), original)
+        self.assertEqual(os.listdir(os.path.dirname(caminho)), [os.path.basename(caminho)])
+
+class SecureFileValidatorTest(TestCase):
+    """Testes do validador de upload em passada única"""
+    
+    KML_CONTENT = MapIngestionTest.KML_CONTENT.encode()
+    
+    def _kmz(self, extra_files=None):
+        import io
+        import zipfile
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            zip_file.writestr('doc.kml', self.KML_CONTENT)
+            for name, content in (extra_files or {}).items():
+                zip_file.writestr(name, content)
+        return buffer.getvalue()
+    
+    def test_kmz_report_has_hash_and_no_errors(self):
+        """KMZ válido gera relatório sem erros e com SHA256"""
+        import hashlib
+        from .security_validators import SecureFileValidator
+        content = self._kmz()
+        report = SecureFileValidator().inspect_file(SimpleUploadedFile("rede.kmz", content))
+        
+        self.assertTrue(report.is_valid, report.errors)
+        self.assertEqual(report.sha256, hashlib.sha256(content).hexdigest())
+    
+    def test_kmz_with_executable_is_rejected(self):
+        """KMZ com executável dentro é rejeitado pelo diretório central do ZIP"""
+        from django.core.exceptions import ValidationError
+        from .security_validators import SecureFileValidator
+        content = self._kmz({'payload.exe': b'MZ'})
+        
+        with self.assertRaises(ValidationError):
+            SecureFileValidator().validate_file(SimpleUploadedFile("rede.kmz", content))
+    
+    def test_zip_disguised_as_csv_is_rejected(self):
+        """ZIP com extensão .csv é bloqueado"""
+        from .security_validators import SecureFileValidator
+        report = SecureFileValidator().inspect_file(SimpleUploadedFile("dados.csv", self._kmz()))
+        
+        self.assertFalse(report.is_valid)
@@ -13,6 +13,7 @@ import logging
 
 from .forms import TicketForm, TicketMessageForm
 from .models import Ticket, TicketMessage, Company, CustomUser
+from .company_cache import get_company_or_404
 from .utils import send_ticket_created_email, send_ticket_message_email
 from .permissions import rm_admin_required, company_access_required, company_access_required_json
 
@@ -24,7 +25,7 @@ logger = logging.getLogger(__name__)
 def company_ticket_create(request, company_slug):
     """Criar novo ticket (empresa)"""
     try:
-        company = get_object_or_404(Company, slug=company_slug)
+        company = get_company_or_404(company_slug)
         
         if request.method == 'POST':
             form = TicketForm(request.POST, user=request.user, company=company)
@@ -108,7 +109,7 @@ def company_ticket_create(request, company_slug):
 def company_ticket_list(request, company_slug):
     """Listar tickets da empresa"""
     try:
-        company = get_object_or_404(Company, slug=company_slug)
+        company = get_company_or_404(company_slug)
         
         # Verificar se os modelos existem no banco (migrações aplicadas)
         try:
@@ -170,7 +171,7 @@ def company_ticket_list(request, company_slug):
 def company_ticket_detail(request, company_slug, ticket_id):
     """Visualizar ticket e chat (empresa)"""
     try:
-        company = get_object_or_404(Company, slug=company_slug)
+        company = get_company_or_404(company_slug)
         ticket = get_object_or_404(Ticket, id=ticket_id, company=company)
         
         # Verificar permissão (admin pode ver todos, usuário apenas os seus)
@@ -367,7 +368,7 @@ def rm_ticket_detail(request, ticket_id):
 def get_new_messages(request, company_slug, ticket_id):
     """API para buscar novas mensagens (AJAX)"""
     try:
-        company = get_object_or_404(Company, slug=company_slug)
+        company = get_company_or_404(company_slug)
         ticket = get_object_or_404(Ticket, id=ticket_id, company=company)
         
         # Verificar permissão
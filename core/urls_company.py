@@ -28,6 +28,7 @@ urlpatterns = [
     # Upload de mapas CTO (página de upload)
     path('upload/', views.company_map_upload_page, name='upload'),
     path('upload/arquivo/', views.company_map_upload, name='map_upload'),
+    path('upload/<int:pk>/status/', views.company_map_status, name='map_status'),
     path('verificar-coordenadas/', views.company_verificar_coordenadas, name='verificar_coordenadas'),
     
     # Gestão de usuários da empresa (apenas admins)
@@ -47,6 +47,17 @@ urlpatterns = [
     # Relatórios RM
     path('relatorios/', views.rm_reports, name='reports'),
     path('relatorios/exportar/csv/', views.rm_reports_export_csv, name='reports_export_csv'),
+
+    # Auditoria
+    path('auditoria/', views.rm_audit_events, name='audit_events'),
+
+    # Métricas (Prometheus)
+    path('metricas/', views.rm_metrics, name='metrics'),
+
+    # Perfis de requisições
+    path('perfis/', views.rm_profile_list, name='profile_list'),
+    path('perfis/<int:profile_id>/', views.rm_profile_detail, name='profile_detail'),
+    path('perfis/<int:profile_id>/download/', views.rm_profile_download, name='profile_download'),
     
     # Sistema de tickets (RM)
     path('tickets/', views.rm_ticket_list, name='ticket_list'),
@@ -3,13 +3,15 @@ Serviço de verificação de viabilidade (Migrado para Django)
 Agora usa serviços Django nativos ao invés de Flask
 """
 import os
+import hashlib
 import logging
 import uuid
 from typing import Dict, Any, Optional, List
-from django.conf import settings
+from django.core.files import File
 from django.core.files.uploadedfile import UploadedFile
-from django.utils import timezone
+from django.core.exceptions import ValidationError
 from core.models import CTOMapFile, Company, CustomUser
+from core import metrics
 from core.audit_logger import AuditLogger
 from core.security_validators import SecureFileValidator
 # Substitui integrações antigas do app 'verificador' pelo novo 'ftth_viewer'
@@ -18,6 +20,19 @@ from ftth_viewer import utils as ftth_utils
 logger = logging.getLogger(__name__)
 
 
+class _ArquivoComHash(File):
+    """Repassa os chunks do upload ao storage calculando o SHA256 na mesma passada"""
+
+    def __init__(self, uploaded_file):
+        super().__init__(uploaded_file, uploaded_file.name)
+        self.sha256 = hashlib.sha256()
+
+    def chunks(self, chunk_size=None):
+        for chunk in self.file.chunks(chunk_size):
+            self.sha256.update(chunk)
+            yield chunk
+
+
 class VerificadorService:
     """
     Serviço principal de verificação - agora Django native
@@ -37,18 +52,15 @@ class VerificadorService:
         Returns:
             Dict com resultados da análise
         """
-        temp_path = None
         validator = SecureFileValidator()
 
         try:
             validator.validate_file(uploaded_file)
             uploaded_file.seek(0)
-            # Salvar arquivo temporariamente
-            temp_path = cls._save_temp_file(uploaded_file)
-            file_type = cls._get_file_extension(uploaded_file.name)
             
-            # Usar serviço Django nativo (ftth_viewer utils)
-            coords = cls._ler_arquivo_por_extensao(temp_path)
+            # Ler direto do arquivo já gravado (disco ou upload temporário);
+            # uploads em memória são lidos do próprio handler, sem cópia extra
+            coords = cls._ler_arquivo_enviado(uploaded_file)
             processing_time = None  # opcional: medição se necessário
             viability_score = min(100, max(0, 100 - len(coords) * 0.1))
             result = {
@@ -63,6 +75,7 @@ class VerificadorService:
                         'name': uploaded_file.name,
                         'type': cls._get_file_extension(uploaded_file.name),
                         'size': uploaded_file.size,
+                        'sha256': validator.last_report.sha256 if validator.last_report else None,
                     }
                 }
             }
@@ -86,10 +99,6 @@ class VerificadorService:
                 'error': f'Erro na análise: {str(e)}',
                 'status': 'failed'
             }
-        finally:
-            # Sempre limpar arquivo temporário, mesmo em caso de erro
-            if temp_path:
-                cls._cleanup_temp_file(temp_path)
         
         # Adicionar analysis_id se não existir
         if result and result.get('success') and 'analysis_id' not in result:
@@ -239,7 +248,7 @@ class VerificadorService:
         """
         try:
             # Buscar arquivo no Django
-            mapa = CTOMapFile.objects.filter(file__icontains=arquivo).first()
+            mapa = CTOMapFile.objects.filter(file__icontains=arquivo, processing_status='completed').first()
             
             if mapa and mapa.file and hasattr(mapa.file, 'path'):
                 return cls._ler_arquivo_por_extensao(mapa.file.path)
@@ -286,56 +295,47 @@ class VerificadorService:
         }
     
     @classmethod
-    def _save_temp_file(cls, uploaded_file: UploadedFile) -> str:
+    def calcular_hash(cls, uploaded_file) -> str:
+        """SHA256 do conteúdo, lido em chunks"""
+        file_hash = hashlib.sha256()
+        uploaded_file.seek(0)
+        for chunk in uploaded_file.chunks():
+            file_hash.update(chunk)
+        uploaded_file.seek(0)
+        return file_hash.hexdigest()
+    
+    @classmethod
+    def _local_path(cls, uploaded_file) -> Optional[str]:
         """
-        Salva arquivo temporariamente para análise
-        
-        Args:
-            uploaded_file: Arquivo enviado
-            
-        Returns:
-            Caminho do arquivo temporário
+        Caminho em disco do arquivo, quando existir
+        (TemporaryUploadedFile, FieldFile ou File aberto a partir do disco)
         """
-        # Criar diretório temporário se não existir
-        temp_dir = os.path.join(settings.MEDIA_ROOT, 'temp_verificacao')
-        os.makedirs(temp_dir, exist_ok=True)
-        
-        # Gerar nome único para o arquivo
-        safe_name = os.path.basename(uploaded_file.name)
-        temp_filename = f"{uuid.uuid4()}_{safe_name}"
-        temp_path = os.path.join(temp_dir, temp_filename)
-        
-        # Salvar arquivo
-        with open(temp_path, 'wb') as f:
-            for chunk in uploaded_file.chunks():
-                f.write(chunk)
-        
-        return temp_path
+        if hasattr(uploaded_file, 'temporary_file_path'):
+            return uploaded_file.temporary_file_path()
+        try:
+            path = getattr(uploaded_file, 'path', None)
+        except (NotImplementedError, ValueError):
+            path = None
+        if isinstance(path, str) and os.path.isfile(path):
+            return path
+        inner_name = getattr(getattr(uploaded_file, 'file', None), 'name', None)
+        if isinstance(inner_name, str) and os.path.isfile(inner_name):
+            return inner_name
+        return None
     
     @classmethod
-    def _cleanup_temp_file(cls, temp_path: str):
-        """
-        Remove arquivo temporário de forma segura
+    def _ler_arquivo_enviado(cls, uploaded_file):
+        """Lê coordenadas do arquivo sem criar cópias temporárias"""
+        ext = cls._get_file_extension(uploaded_file.name)
+        local_path = cls._local_path(uploaded_file)
+        if local_path:
+            return cls._ler_arquivo_por_extensao(local_path, ext)
         
-        Args:
-            temp_path: Caminho do arquivo temporário
-        """
+        uploaded_file.seek(0)
         try:
-            if temp_path and os.path.exists(temp_path):
-                os.remove(temp_path)
-                logger.debug(f"Arquivo temporário removido: {temp_path}")
-        except PermissionError as e:
-            logger.warning(f"Sem permissão para remover arquivo temporário {temp_path}: {e}")
-            # Tentar novamente após um pequeno delay (arquivo pode estar em uso)
-            import time
-            time.sleep(0.1)
-            try:
-                if os.path.exists(temp_path):
-                    os.remove(temp_path)
-            except Exception as retry_error:
-                logger.error(f"Falha ao remover arquivo temporário após retry {temp_path}: {retry_error}")
-        except Exception as e:
-            logger.error(f"Erro inesperado ao remover arquivo temporário {temp_path}: {e}")
+            return cls._ler_arquivo_por_extensao(uploaded_file, ext)
+        finally:
+            uploaded_file.seek(0)
     
     @classmethod
     def _get_file_extension(cls, filename: str) -> str:
@@ -351,8 +351,8 @@ class VerificadorService:
         return filename.split('.')[-1].lower() if '.' in filename else ''
 
     @classmethod
-    def _ler_arquivo_por_extensao(cls, caminho_arquivo: str):
-        ext = cls._get_file_extension(caminho_arquivo).lower()
+    def _ler_arquivo_por_extensao(cls, caminho_arquivo, ext: Optional[str] = None):
+        ext = (ext or cls._get_file_extension(caminho_arquivo)).lower()
         if ext == 'kml':
             return ftth_utils.ler_kml(caminho_arquivo)
         if ext == 'kmz':
@@ -373,7 +373,8 @@ class VerificadorService:
         url = "https://nominatim.openstreetmap.org/search"
         params = { 'q': endereco, 'format': 'json', 'limit': 1, 'countrycodes': 'br' }
         headers = { 'User-Agent': 'FTTH-Viewer-Django/1.0' }
-        resp = requests.get(url, params=params, headers=headers, timeout=10)
+        with metrics.timer('upstream_request_duration_seconds', service='nominatim'):
+            resp = requests.get(url, params=params, headers=headers, timeout=10)
         resp.raise_for_status()
         data = resp.json()
         if not data:
@@ -391,69 +392,94 @@ class VerificadorIntegrationManager:
     """Gerenciador de integração - agora Django native"""
     
     @classmethod
-    def processar_upload_arquivo(cls, uploaded_file: UploadedFile, company: Company, user: CustomUser) -> Dict[str, Any]:
+    def registrar_upload_arquivo(cls, uploaded_file: UploadedFile, company: Company, user: CustomUser) -> Dict[str, Any]:
         """
-        Processa upload de arquivo completo usando Django native
-        
+        Grava o arquivo e agenda a análise na fila de ingestão (não bloqueia o request)
+
+        Apenas as validações baratas (tamanho, nome e extensão) rodam aqui; a validação
+        completa de conteúdo, a leitura e o score ficam a cargo do worker.
+
         Args:
             uploaded_file: Arquivo enviado
             company: Empresa do usuário
             user: Usuário que fez o upload
-            
+
         Returns:
-            Resultado completo do processamento
+            Dict com o id do CTOMapFile criado e o status inicial
         """
+        from core.ingestion import enqueue_map_ingestion
+
         validator = SecureFileValidator()
 
         try:
-            validator.validate_file(uploaded_file)
-            uploaded_file.seek(0)
-            # 1. Criar registro no banco Django
-            cto_file = CTOMapFile.objects.create(
-                file=uploaded_file,
-                description=f"Análise de {uploaded_file.name}",
-                company=company,
-                uploaded_by=user,
-                is_processed=False
+            if uploaded_file.size > validator.MAX_FILE_SIZE:
+                size_mb = round(uploaded_file.size / (1024 * 1024), 2)
+                raise ValidationError(
+                    f"Arquivo muito grande ({size_mb}MB). "
+                    f"Tamanho máximo permitido: {validator.MAX_FILE_SIZE // (1024 * 1024)}MB"
+                )
+            validator._validate_filename(uploaded_file.name)
+            validator._validate_extension(uploaded_file.name)
+
+            # Gravação e hash numa única leitura do upload
+            campo = CTOMapFile._meta.get_field('file')
+            arquivo = _ArquivoComHash(uploaded_file)
+            nome = campo.storage.save(
+                campo.generate_filename(None, uploaded_file.name), arquivo, max_length=campo.max_length
             )
-            
-            # 2. Verificar arquivo usando Django native
-            result = VerificadorService.verificar_arquivo(uploaded_file, company, user)
-            
-            # 3. Atualizar registro Django com resultado
-            if result.get('success'):
-                cto_file.is_processed = True
-                cto_file.processed_at = timezone.now()
-                
-                # Salvar dados do resultado
-                results = result.get('results', {})
-                cto_file.viability_score = results.get('viability_score')
-                cto_file.analysis_results = results
-                cto_file.issues_found = results.get('issues', [])
-                cto_file.recommendations = results.get('recommendations', [])
-                cto_file.coordinates_count = results.get('coordinates_count', 0)
-                cto_file.processing_time = results.get('processing_time')
-                
-                if results.get('file_info'):
-                    cto_file.file_size = results['file_info'].get('size')
-                
-                cto_file.description = f"Análise concluída - {results.get('viability_score', 'N/A')} pontos"
-                cto_file.save()
-            
+            content_hash = arquivo.sha256.hexdigest()
+
+            # Re-upload idêntico na mesma empresa: reaproveitar o mapa já analisado
+            existente = CTOMapFile.objects.filter(
+                company=company,
+                content_hash=content_hash
+            ).exclude(processing_status='failed').order_by('uploaded_at').first()
+            if existente:
+                campo.storage.delete(nome)
+                logger.info(
+                    f"Upload duplicado de {uploaded_file.name} reaproveitando mapa {existente.id} "
+                    f"(empresa {company.slug})"
+                )
+                return {
+                    'success': True,
+                    'cto_file_id': existente.id,
+                    'processing_status': existente.processing_status,
+                    'duplicate': True,
+                    'service': 'django_native'
+                }
+
+            try:
+                cto_file = CTOMapFile.objects.create(
+                    file=nome,
+                    description=f"Análise de {uploaded_file.name} - pendente",
+                    company=company,
+                    uploaded_by=user,
+                    is_processed=False,
+                    processing_status='pending',
+                    content_hash=content_hash,
+                    file_size=uploaded_file.size
+                )
+            except Exception:
+                campo.storage.delete(nome)
+                raise
+            enqueue_map_ingestion(cto_file.id, user.id)
+
             return {
-                'success': result.get('success', False),
+                'success': True,
                 'cto_file_id': cto_file.id,
-                'django_result': result,
+                'processing_status': cto_file.processing_status,
+                'duplicate': False,
                 'service': 'django_native'
             }
-            
+        except ValidationError:
+            raise
         except Exception as e:
-            logger.error(f"Erro no processamento completo: {str(e)}")
+            logger.error(f"Erro ao registrar upload: {str(e)}")
             return {
                 'success': False,
                 'error': f'Erro no processamento: {str(e)}'
             }
-    
+
     @classmethod
     def obter_estatisticas_integracao(cls) -> Dict[str, Any]:
         """
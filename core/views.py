@@ -4,8 +4,10 @@ from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout
 from django.http import HttpResponseForbidden, HttpResponse, Http404, JsonResponse
 from django.core.exceptions import ValidationError, PermissionDenied
+from django.core.validators import validate_ipv46_address
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.cache import cache_page
+from django.conf import settings
 from django.core.cache import cache
 from django.db import transaction
 from django.db.models import Count, Q
@@ -13,6 +15,8 @@ from django.db.models.functions import TruncMonth
 from django.core.paginator import Paginator
 from django.urls import reverse
 from django.utils import timezone
+from django.utils.dateparse import parse_date
+import hmac
 import logging
 import os
 import csv
@@ -20,7 +24,7 @@ from django.views.decorators.csrf import ensure_csrf_cookie
 from datetime import timedelta
 
 from .forms import CTOMapFileForm, CompanyForm, CustomUserForm, CustomUserChangeForm
-from .models import CTOMapFile, Company, CustomUser
+from .models import CTOMapFile, Company, CustomUser, AuditEvent, RequestProfile
 from .utils import send_user_credentials_email
 from .ticket_views import (
     company_ticket_create, company_ticket_list, company_ticket_detail,
@@ -36,9 +40,14 @@ from .permissions import (
 )
 from .reports import ReportGenerator, ExportManager
 from .audit_logger import log_user_action, log_data_access
+from . import company_stats, metrics, profiling
+from .cache_namespaces import RM_NAMESPACE, make_key
+from .company_cache import get_company_or_404
 from .rate_limiting import login_rate_limit, upload_rate_limit, general_rate_limit
 from .verificador_service import VerificadorService, VerificadorIntegrationManager
 from ftth_viewer.models import ViabilidadeCache
+from ftth_viewer.journal import exportar_mapa
+from ftth_viewer.retention import inicio_validade
 
 logger = logging.getLogger(__name__)
 
@@ -196,15 +205,15 @@ def rm_admin_dashboard(request):
     from django.utils import timezone
     
     # Usar cache para estatísticas que não mudam frequentemente
-    cache_key = f'rm_dashboard_stats_{request.user.id}'
+    cache_key = make_key(RM_NAMESPACE, f'rm_dashboard_stats_{request.user.id}')
     cached_stats = cache.get(cache_key)
     
     if cached_stats is None:
-        # Buscar dados do banco com otimizações
-        companies = Company.objects.all().only('id', 'name', 'slug', 'is_active')
-        active_companies = companies.filter(is_active=True).count()
-        total_users = CustomUser.objects.only('id').count()
-        total_maps = CTOMapFile.objects.only('id').count()
+        # Totais das empresas (uma consulta) e do rollup CompanyStats (outra)
+        company_counts = Company.objects.aggregate(
+            total=Count('id'), active=Count('id', filter=Q(is_active=True))
+        )
+        totals = company_stats.totals()
         
         # Atividades recentes (últimos uploads e criações) - usar select_related
         # Note: file_name é uma propriedade (@property), não um campo do banco, então não pode estar no .only()
@@ -223,10 +232,10 @@ def rm_admin_dashboard(request):
             })
         
         cached_stats = {
-            'total_companies': companies.count(),
-            'active_companies': active_companies,
-            'total_users': total_users,
-            'total_maps': total_maps,
+            'total_companies': company_counts['total'],
+            'active_companies': company_counts['active'],
+            'total_users': totals['total_users'],
+            'total_maps': totals['total_maps'],
             'recent_activities': recent_activities,
         }
         # Cache por 5 minutos
@@ -248,15 +257,14 @@ def rm_admin_dashboard(request):
 @login_required
 @rm_admin_required
 def rm_company_portal(request, company_slug):
-    company = get_object_or_404(Company, slug=company_slug)
-    users_qs = CustomUser.objects.filter(company=company)
-    maps_qs = CTOMapFile.objects.filter(company=company)
+    company = get_company_or_404(company_slug)
+    stats = company_stats.get_company_stats(company)
     context = {
         'company': company,
-        'total_users': users_qs.count(),
-        'active_users': users_qs.filter(is_active=True).count(),
-        'total_maps': maps_qs.count(),
-        'recent_maps': maps_qs.order_by('-uploaded_at')[:5],
+        'total_users': stats.total_users,
+        'active_users': stats.active_users,
+        'total_maps': stats.total_maps,
+        'recent_maps': CTOMapFile.objects.filter(company=company).order_by('-uploaded_at')[:5],
     }
     return render(request, 'core/rm_company_portal.html', context)
 
@@ -492,18 +500,17 @@ def company_login_view(request, company_slug):
 @company_access_required(require_admin=False, allow_user_role=False)
 def company_dashboard(request, company_slug):
     """Dashboard - apenas para COMPANY_ADMIN e RM"""
-    company = get_object_or_404(Company, slug=company_slug)
+    company = get_company_or_404(company_slug)
     
     # Debug logging (apenas em nível DEBUG para não expor informações sensíveis)
     logger.debug(f"Dashboard access - company: {company_slug}, user_id: {request.user.id}, role: {request.user.role}")
     
-    users_qs = CustomUser.objects.filter(company=company)
-    maps_qs = CTOMapFile.objects.filter(company=company)
+    stats = company_stats.get_company_stats(company)
     context = {
         'company': company,
-        'total_users': users_qs.count(),
-        'active_users': users_qs.filter(is_active=True).count(),
-        'total_maps': maps_qs.count(),
+        'total_users': stats.total_users,
+        'active_users': stats.active_users,
+        'total_maps': stats.total_maps,
     }
     return render(request, 'core/company_dashboard.html', context)
 
@@ -521,7 +528,7 @@ def company_verificador(request, company_slug):
 def company_map_upload_page(request, company_slug):
     """Página de upload de mapas CTO"""
     import os
-    company = get_object_or_404(Company, slug=company_slug)
+    company = get_company_or_404(company_slug)
     maps = CTOMapFile.objects.filter(company=company).order_by('-uploaded_at')[:20]
     
     # Adicionar informações de tamanho de arquivo com tratamento de erro
@@ -548,11 +555,11 @@ def company_map_upload_page(request, company_slug):
 @company_access_required(require_admin=False)
 @upload_rate_limit
 def company_map_upload(request, company_slug):
-    """Upload de mapa CTO via AJAX com verificação Flask"""
+    """Upload de mapa CTO via AJAX; a análise roda na fila de ingestão"""
     if request.method != 'POST':
         return JsonResponse({'success': False, 'message': 'Método não permitido'}, status=405)
     
-    company = get_object_or_404(Company, slug=company_slug)
+    company = get_company_or_404(company_slug)
     
     try:
         # Verificar se o usuário pode fazer upload (RM/Superuser/Company Admin sempre podem)
@@ -574,99 +581,45 @@ def company_map_upload(request, company_slug):
         
         uploaded_file = request.FILES['file']
         
-        # Processar arquivo usando o verificador Flask
-        result = VerificadorIntegrationManager.processar_upload_arquivo(
+        # Gravar arquivo e agendar análise na fila de ingestão (não bloqueia o worker HTTP)
+        result = VerificadorIntegrationManager.registrar_upload_arquivo(
             uploaded_file=uploaded_file,
             company=company,
             user=request.user
         )
         
-        if result['success']:
-            # Log do upload bem-sucedido
+        if not result['success']:
+            return JsonResponse({
+                'success': False,
+                'message': result.get('error', 'Erro desconhecido no upload')
+            }, status=400)
+        
+        if not result.get('duplicate'):
             try:
                 from .audit_logger import log_map_upload
                 map_file = CTOMapFile.objects.get(id=result['cto_file_id'])
                 log_map_upload(request.user, map_file, company)
-                
-                # Invalidar cache de arquivos após upload - para TODOS os usuários da empresa
-                # Buscar todos os usuários da empresa para invalidar seus caches
-                from core.models import CustomUser
-                company_users = CustomUser.objects.filter(company=company).values_list('id', flat=True)
-                
-                # Invalidar cache para todos os usuários da empresa
-                cache_keys_to_delete = [f'rm_dashboard_stats_{request.user.id}']
-                for user_id in company_users:
-                    cache_keys_to_delete.extend([
-                        f'api_arquivos_{user_id}_{company.slug}',
-                        f'api_arquivos_{user_id}_none',
-                    ])
-                
-                # Invalidar também para RM admins (que podem ver todas as empresas)
-                if request.user.is_rm_admin or request.user.is_superuser:
-                    cache_keys_to_delete.extend([
-                        f'api_arquivos_{request.user.id}_{company.slug}',
-                        f'api_arquivos_{request.user.id}_none',
-                    ])
-                
-                # Invalidar cache de CTOs também
-                cache_keys_to_delete.append(f'get_all_ctos_{company.id}')
-                
-                # Deletar todos os caches relacionados
-                if cache_keys_to_delete:
-                    cache.delete_many(cache_keys_to_delete)
             except Exception as log_error:
                 logger.warning(f"Erro no log de upload: {str(log_error)}")
-            
-            # Preparar resposta com dados do Flask
-            flask_result = result.get('flask_result', {})
-            flask_data = flask_result.get('results', {})
-            
-            response_data = {
-                'success': True,
-                'message': 'Arquivo analisado com sucesso!',
-                'file_id': result['cto_file_id'],
-                'file_name': os.path.basename(uploaded_file.name),
-                'analysis': {
-                    'viability_score': flask_data.get('viability_score', 'N/A'),
-                    'issues': flask_data.get('issues', []),
-                    'recommendations': flask_data.get('recommendations', []),
-                    'processing_time': flask_data.get('processing_time', 0),
-                    'coordinates_count': flask_data.get('coordinates_count', 0)
-                },
-                'flask_status': result.get('flask_status', {})
-            }
-            
-            return JsonResponse(response_data)
+        
+        if result.get('duplicate'):
+            message = 'Este arquivo já foi enviado para a empresa; a análise existente foi reaproveitada.'
         else:
-            # Upload falhou
-            error_message = result.get('error', 'Erro desconhecido na análise')
-            
-            # Se o Flask estiver offline, ainda salvar o arquivo
-            if result.get('flask_status', {}).get('status') != 'online':
-                # Criar arquivo sem análise
-                map_file = CTOMapFile(
-                    file=uploaded_file,
-                    description=request.POST.get('description', f'Arquivo enviado - Análise pendente'),
-                    company=company,
-                    uploaded_by=request.user,
-                    processing_status='pending'
-                )
-                map_file.save()
-                
-                return JsonResponse({
-                    'success': True,
-                    'message': 'Arquivo salvo. Análise será realizada quando o serviço estiver disponível.',
-                    'file_id': map_file.id,
-                    'file_name': os.path.basename(uploaded_file.name),
-                    'analysis_pending': True,
-                    'flask_status': result.get('flask_status', {})
-                })
-            else:
-                return JsonResponse({
-                    'success': False, 
-                    'message': error_message,
-                    'flask_status': result.get('flask_status', {})
-                }, status=400)
+            message = 'Arquivo enviado! A análise está em andamento.'
+        
+        return JsonResponse({
+            'success': True,
+            'message': message,
+            'file_id': result['cto_file_id'],
+            'file_name': os.path.basename(uploaded_file.name),
+            'duplicate': result.get('duplicate', False),
+            'analysis_pending': result['processing_status'] != 'completed',
+            'processing_status': result['processing_status'],
+            'status_url': reverse('company:map_status', kwargs={
+                'company_slug': company.slug,
+                'pk': result['cto_file_id'],
+            }),
+        }, status=200 if result.get('duplicate') else 202)
         
     except ValidationError as e:
         return JsonResponse({'success': False, 'message': str(e)}, status=400)
@@ -675,6 +628,30 @@ def company_map_upload(request, company_slug):
         return JsonResponse({'success': False, 'message': 'Erro interno do servidor'}, status=500)
 
 
+@login_required
+@company_access_required(require_admin=False)
+def company_map_status(request, company_slug, pk):
+    """Status de processamento de um mapa (consultado pela tela de upload)"""
+    company = get_company_or_404(company_slug)
+    map_file = get_object_or_404(CTOMapFile, pk=pk, company=company)
+    
+    return JsonResponse({
+        'success': True,
+        'file_id': map_file.id,
+        'file_name': map_file.file_name,
+        'processing_status': map_file.processing_status,
+        'is_processed': map_file.is_processed,
+        'processed_at': map_file.processed_at.isoformat() if map_file.processed_at else None,
+        'analysis': {
+            'viability_score': map_file.viability_score,
+            'issues': map_file.issues_found,
+            'recommendations': map_file.recommendations,
+            'processing_time': map_file.processing_time or 0,
+            'coordinates_count': map_file.coordinates_count or 0,
+        },
+    })
+
+
 @login_required
 @company_access_required(require_admin=False)
 def company_verificar_coordenadas(request, company_slug):
@@ -682,7 +659,7 @@ def company_verificar_coordenadas(request, company_slug):
     if request.method != 'POST':
         return JsonResponse({'success': False, 'message': 'Método não permitido'}, status=405)
     
-    company = get_object_or_404(Company, slug=company_slug)
+    company = get_company_or_404(company_slug)
     
     try:
         # Verificar se o usuário pode fazer verificações
@@ -733,7 +710,7 @@ def company_verificar_coordenadas(request, company_slug):
 def company_user_list(request, company_slug):
     from django.core.paginator import Paginator
     
-    company = get_object_or_404(Company, slug=company_slug)
+    company = get_company_or_404(company_slug)
     users_qs = CustomUser.objects.filter(company=company).select_related('company').order_by('username')
     
     # Paginação
@@ -752,7 +729,7 @@ def company_map_list(request, company_slug):
     
     if not (request.user.is_company_admin or request.user.is_rm_admin or request.user.is_superuser):
         return HttpResponseForbidden()
-    company = get_object_or_404(Company, slug=company_slug)
+    company = get_company_or_404(company_slug)
     if not (request.user.is_rm_admin or request.user.is_superuser) and request.user.company != company:
         return HttpResponseForbidden()
 
@@ -773,11 +750,31 @@ def company_map_list(request, company_slug):
 
 
 
+def _conteudo_para_download(map_file):
+    """
+    Conteúdo do mapa com o journal de edições de CTO aplicado; se a aplicação falhar,
+    o arquivo atual como está (o download não vira erro 500). None se não houver arquivo.
+    """
+    try:
+        return exportar_mapa(map_file.id)
+    except Exception as e:
+        logger.error(f"Erro ao aplicar o journal de edições no download do mapa {map_file.id}: {str(e)}", exc_info=True)
+    map_file.refresh_from_db(fields=['file'])
+    if not map_file.file:
+        return None
+    try:
+        with open(map_file.file.path, 'rb') as f:
+            return f.read()
+    except OSError as e:
+        logger.error(f"Erro ao ler arquivo do mapa {map_file.id}: {str(e)}")
+        return None
+
+
 @login_required
 @company_access_required(require_admin=False)
 def company_map_download(request, company_slug, pk):
     """Download de mapa da empresa"""
-    company = get_object_or_404(Company, slug=company_slug)
+    company = get_company_or_404(company_slug)
     
     # Verificar permissões
     if not request.user.is_rm_admin and not request.user.is_superuser:
@@ -833,14 +830,16 @@ def company_map_download(request, company_slug, pk):
         }
         content_type = content_types.get(file_ext, 'application/octet-stream')
         
-        # Ler e servir o arquivo
-        with open(file_path, 'rb') as f:
-            response = HttpResponse(f.read(), content_type=content_type)
-            # Usar nome seguro para o arquivo
-            safe_filename = map_file.file_name.encode('utf-8', 'replace').decode('utf-8')
-            response['Content-Disposition'] = f'attachment; filename="{safe_filename}"'
-            response['Content-Length'] = os.path.getsize(file_path)
-            return response
+        # Ler e servir o arquivo, com as edições de CTO pendentes do journal aplicadas
+        conteudo = _conteudo_para_download(map_file)
+        if conteudo is None:
+            raise IOError('mapa sem arquivo')
+        response = HttpResponse(conteudo, content_type=content_type)
+        # Usar nome seguro para o arquivo
+        safe_filename = map_file.file_name.encode('utf-8', 'replace').decode('utf-8')
+        response['Content-Disposition'] = f'attachment; filename="{safe_filename}"'
+        response['Content-Length'] = len(conteudo)
+        return response
     except IOError as e:
         logger.error(f"Erro ao ler arquivo {file_path}: {str(e)}")
         messages.error(request, f'Erro ao ler o arquivo "{map_file.file_name}". Tente novamente.')
@@ -860,7 +859,7 @@ def company_map_delete(request, company_slug, pk):
         messages.error(request, 'Sem permissão para excluir arquivos')
         return redirect('company:upload', company_slug=company_slug)
 
-    company = get_object_or_404(Company, slug=company_slug)
+    company = get_company_or_404(company_slug)
     map_file = get_object_or_404(CTOMapFile, pk=pk, company=company)
     
     try:
@@ -883,7 +882,7 @@ def company_map_delete(request, company_slug, pk):
 @login_required
 @company_access_required(require_admin=False, allow_user_role=False)
 def company_map_history(request, company_slug):
-    company = get_object_or_404(Company, slug=company_slug)
+    company = get_company_or_404(company_slug)
     maps = CTOMapFile.objects.filter(company=company).order_by('-uploaded_at')
     return render(request, 'company/maps/history.html', {'maps': maps, 'company': company})
 
@@ -919,28 +918,32 @@ def rm_user_quick_search(request):
 @rm_admin_required
 def rm_maps_by_company(request):
     """Visão RM: Mapas agrupados por empresa, com ações e gráficos"""
-    companies = Company.objects.all().order_by('name')
-    company_stats = []
+    companies = company_stats.companies_with_stats(Company.objects.order_by('name'))
+
+    # Todos os mapas em uma consulta, agrupados por empresa em memória
+    maps_by_company = {}
+    for map_file in CTOMapFile.objects.select_related('company', 'uploaded_by'):
+        maps_by_company.setdefault(map_file.company_id, []).append(map_file)
+
+    stats_by_company = []
     for c in companies:
-        maps_qs = CTOMapFile.objects.filter(company=c)
-        stats = {
+        stats_by_company.append({
             'company': c,
-            'maps': maps_qs.select_related('company', 'uploaded_by'),
-            'total_maps': maps_qs.count(),
-            'processed_maps': maps_qs.filter(is_processed=True).count(),
-            'pending_maps': maps_qs.filter(is_processed=False).count(),
-        }
-        company_stats.append(stats)
+            'maps': maps_by_company.get(c.id, []),
+            'total_maps': c.total_maps,
+            'processed_maps': c.processed_maps,
+            'pending_maps': c.pending_maps,
+        })
 
     # Dados agregados para gráficos gerais (total de mapas por empresa)
-    labels = [s['company'].name for s in company_stats]
-    totals = [s['total_maps'] for s in company_stats]
-    processed = [s['processed_maps'] for s in company_stats]
-    pending = [s['pending_maps'] for s in company_stats]
+    labels = [s['company'].name for s in stats_by_company]
+    totals = [s['total_maps'] for s in stats_by_company]
+    processed = [s['processed_maps'] for s in stats_by_company]
+    pending = [s['pending_maps'] for s in stats_by_company]
 
     context = {
         'companies': companies,
-        'company_stats': company_stats,
+        'company_stats': stats_by_company,
         'chart_labels': labels,
         'chart_totals': totals,
         'chart_processed': processed,
@@ -956,7 +959,7 @@ def company_map_admin(request, company_slug):
     if not (request.user.is_company_admin or request.user.is_rm_admin or request.user.is_superuser):
         return HttpResponseForbidden()
 
-    company = get_object_or_404(Company, slug=company_slug)
+    company = get_company_or_404(company_slug)
     if not (request.user.is_rm_admin or request.user.is_superuser) and request.user.company != company:
         return HttpResponseForbidden()
 
@@ -988,7 +991,7 @@ def company_map_admin(request, company_slug):
 @company_access_required(require_admin=True, allow_user_role=False)
 def company_reports(request, company_slug):
     """Relatórios completos para administradores da empresa"""
-    company = get_object_or_404(Company, slug=company_slug)
+    company = get_company_or_404(company_slug)
 
     maps_qs = CTOMapFile.objects.filter(company=company)
 
@@ -1011,11 +1014,22 @@ def company_reports(request, company_slug):
         'nao_analisado': viability_agg.get('nao_analisado', 0) or 0,
     }
 
-    verifications_qs = ViabilidadeCache.objects.filter(company=company)
-    total_verifications = verifications_qs.count()
-    verifications_viavel = verifications_qs.filter(resultado__viabilidade__status__iexact='Viável').count()
-    verifications_limitada = verifications_qs.filter(resultado__viabilidade__status__iexact='Viabilidade Limitada').count()
-    verifications_inviavel = verifications_qs.filter(resultado__viabilidade__status__iexact='Sem viabilidade').count()
+    # Apenas a janela de retenção (índice company+created_at) e a coluna status,
+    # numa única agregação em vez de varrer o JSON da tabela inteira por status
+    verifications_qs = ViabilidadeCache.objects.filter(
+        company=company,
+        created_at__gte=inicio_validade(company)
+    )
+    verifications_agg = verifications_qs.aggregate(
+        total=Count('id'),
+        viavel=Count('id', filter=Q(status='Viável')),
+        limitada=Count('id', filter=Q(status='Viabilidade Limitada')),
+        inviavel=Count('id', filter=Q(status='Sem viabilidade')),
+    )
+    total_verifications = verifications_agg['total'] or 0
+    verifications_viavel = verifications_agg['viavel'] or 0
+    verifications_limitada = verifications_agg['limitada'] or 0
+    verifications_inviavel = verifications_agg['inviavel'] or 0
     verifications_outros = max(total_verifications - (verifications_viavel + verifications_limitada + verifications_inviavel), 0)
 
     monthly_uploads = maps_qs.filter(uploaded_at__isnull=False).annotate(
@@ -1034,7 +1048,7 @@ def company_reports(request, company_slug):
 
     monthly_verifications = verifications_qs.annotate(
         month=TruncMonth('created_at')
-    ).values('month').order_by('month').annotate(total=Count('id')) if hasattr(ViabilidadeCache, 'created_at') else []
+    ).values('month').order_by('month').annotate(total=Count('id'))
 
     monthly_verification_labels = [format_month(entry['month']) for entry in monthly_verifications]
     monthly_verification_values = [entry['total'] for entry in monthly_verifications]
@@ -1106,14 +1120,12 @@ def company_reports(request, company_slug):
 @rm_admin_required
 def rm_map_list(request):
     """Lista de todos os mapas (visão RM), agrupados por empresa"""
-    from django.db.models import Count, Prefetch
     from django.core.paginator import Paginator
     
-    # Buscar todas as empresas com seus mapas, ordenadas por nome
-    # Otimizar com select_related e prefetch_related
-    companies_qs = Company.objects.annotate(
-        map_count=Count('cto_maps')
-    ).filter(map_count__gt=0).select_related().order_by('name')
+    # Empresas com mapas, pelo total do rollup CompanyStats (sem GROUP BY sobre os mapas)
+    companies_qs = company_stats.companies_with_stats(
+        Company.objects.order_by('name')
+    ).filter(total_maps__gt=0)
     
     # Paginação de empresas
     paginator = Paginator(companies_qs, 15)  # 15 empresas por página
@@ -1130,13 +1142,13 @@ def rm_map_list(request):
         companies_with_maps.append({
             'company': company,
             'maps': maps,
-            'count': company.map_count  # Usar o count do annotation
+            'count': company.total_maps
         })
     
     # Empresas sem mapas (opcional, pode ser removido se não for usado)
-    companies_without_maps = Company.objects.annotate(
-        map_count=Count('cto_maps')
-    ).filter(map_count=0).order_by('name')[:10]  # Limitar a 10
+    companies_without_maps = company_stats.companies_with_stats(
+        Company.objects.order_by('name')
+    ).filter(total_maps=0)[:10]  # Limitar a 10
     
     context = {
         'companies_with_maps': companies_with_maps,
@@ -1152,9 +1164,10 @@ def rm_map_list(request):
 @rm_admin_required
 def rm_map_download(request, pk):
     map_file = get_object_or_404(CTOMapFile, pk=pk)
-    if os.path.exists(map_file.file.path):
-        with open(map_file.file.path, 'rb') as f:
-            response = HttpResponse(f.read(), content_type='application/octet-stream')
+    if map_file.file and os.path.exists(map_file.file.path):
+        conteudo = _conteudo_para_download(map_file)
+        if conteudo is not None:
+            response = HttpResponse(conteudo, content_type='application/octet-stream')
             response['Content-Disposition'] = f'attachment; filename="{map_file.file_name}"'
             return response
     raise Http404('Arquivo não encontrado')
@@ -1165,37 +1178,11 @@ def rm_map_download(request, pk):
 @require_http_methods(["POST"])
 def rm_map_delete(request, pk):
     map_file = get_object_or_404(CTOMapFile, pk=pk)
-    company_slug = map_file.company.slug if map_file.company else None
     try:
         if map_file.file and os.path.exists(map_file.file.path):
             os.remove(map_file.file.path)
+        # Caches do mapa e da empresa são invalidados pelo post_delete (ftth_viewer.invalidation)
         map_file.delete()
-        
-        # Invalidar cache de arquivos - para TODOS os usuários da empresa
-        if map_file.company:
-            from core.models import CustomUser
-            company_users = CustomUser.objects.filter(company=map_file.company).values_list('id', flat=True)
-            
-            cache_keys_to_delete = []
-            for user_id in company_users:
-                cache_keys_to_delete.extend([
-                    f'api_arquivos_{user_id}_{company_slug}',
-                    f'api_arquivos_{user_id}_none',
-                    f'api_coordenadas_{map_file.id}_{company_slug}',
-                    f'api_coordenadas_{map_file.file_name}_{company_slug}',
-                ])
-            
-            # Invalidar também para RM admins
-            if request.user.is_rm_admin or request.user.is_superuser:
-                cache_keys_to_delete.extend([
-                    f'api_arquivos_{request.user.id}_{company_slug}',
-                    f'api_arquivos_{request.user.id}_none',
-                    f'api_coordenadas_{map_file.id}_{company_slug}',
-                    f'api_coordenadas_{map_file.file_name}_{company_slug}',
-                ])
-            
-            if cache_keys_to_delete:
-                cache.delete_many(cache_keys_to_delete)
         return JsonResponse({'success': True})
     except Exception:
         return JsonResponse({'success': False, 'message': 'Falha ao excluir'}, status=500)
@@ -1204,39 +1191,23 @@ def rm_map_delete(request, pk):
 @login_required
 @rm_admin_required
 def rm_reports(request):
-    companies = Company.objects.all().order_by('name')
-    users = CustomUser.objects.all()
-
-    # Estatísticas por empresa para gráficos
-    company_stats = []
-    for c in companies:
-        maps_qs = CTOMapFile.objects.filter(company=c)
-        company_stats.append({
-            'company': c,
-            'total_maps': maps_qs.count(),
-            'processed_maps': maps_qs.filter(is_processed=True).count(),
-            'pending_maps': maps_qs.filter(is_processed=False).count(),
-        })
-
-    labels = [s['company'].name for s in company_stats]
-    totals = [s['total_maps'] for s in company_stats]
-    processed = [s['processed_maps'] for s in company_stats]
-    pending = [s['pending_maps'] for s in company_stats]
+    # Uma consulta: empresas com os contadores do rollup CompanyStats
+    companies = list(company_stats.companies_with_stats(Company.objects.order_by('name')))
 
-    # Totais gerais para o gráfico de status e cards
-    overall_processed = CTOMapFile.objects.filter(is_processed=True).count()
-    overall_pending = CTOMapFile.objects.filter(is_processed=False).count()
-    companies_with_maps = sum(1 for stat in company_stats if stat['total_maps'] > 0)
+    labels = [c.name for c in companies]
+    totals = [c.total_maps for c in companies]
+    processed = [c.processed_maps for c in companies]
+    pending = [c.pending_maps for c in companies]
 
     context = {
-        'total_companies': companies.count(),
-        'active_companies': companies.filter(is_active=True).count(),
-        'total_users': users.count(),
-        'active_users': users.filter(is_active=True).count(),
-        'total_maps': CTOMapFile.objects.count(),
-        'companies_with_maps': companies_with_maps,
-        'overall_processed': overall_processed,
-        'overall_pending': overall_pending,
+        'total_companies': len(companies),
+        'active_companies': sum(1 for c in companies if c.is_active),
+        'total_users': sum(c.total_users for c in companies),
+        'active_users': sum(c.active_users for c in companies),
+        'total_maps': sum(totals),
+        'companies_with_maps': sum(1 for total in totals if total > 0),
+        'overall_processed': sum(processed),
+        'overall_pending': sum(pending),
         'chart_labels': labels,
         'chart_totals': totals,
         'chart_processed': processed,
@@ -1251,12 +1222,140 @@ def rm_reports_export_csv(request):
     response = HttpResponse(content_type='text/csv')
     response['Content-Disposition'] = 'attachment; filename="relatorios_rm.csv"'
     writer = csv.writer(response)
+    company_counts = Company.objects.aggregate(
+        total=Count('id'), active=Count('id', filter=Q(is_active=True))
+    )
+    totals = company_stats.totals()
     writer.writerow(['Métrica', 'Valor'])
-    writer.writerow(['Empresas (ativas)', Company.objects.filter(is_active=True).count()])
-    writer.writerow(['Empresas (total)', Company.objects.count()])
-    writer.writerow(['Usuários (ativos)', CustomUser.objects.filter(is_active=True).count()])
-    writer.writerow(['Usuários (total)', CustomUser.objects.count()])
-    writer.writerow(['Mapas CTO (total)', CTOMapFile.objects.count()])
+    writer.writerow(['Empresas (ativas)', company_counts['active']])
+    writer.writerow(['Empresas (total)', company_counts['total']])
+    writer.writerow(['Usuários (ativos)', totals['active_users']])
+    writer.writerow(['Usuários (total)', totals['total_users']])
+    writer.writerow(['Mapas CTO (total)', totals['total_maps']])
+    return response
+
+
+
+@login_required
+@rm_admin_required
+def rm_audit_events(request):
+    """Consulta filtrada dos eventos de auditoria (AuditEvent)"""
+    category_filter = request.GET.get('category', '')
+    action_filter = request.GET.get('action', '').strip()
+    username_filter = request.GET.get('username', '').strip()
+    company_filter = request.GET.get('company', '')
+    ip_filter = request.GET.get('ip', '').strip()
+
+    def _data(nome):
+        try:
+            return parse_date(request.GET.get(nome, '').strip())
+        except ValueError:
+            return None
+
+    # Sem período informado: últimos 7 dias (mantém a consulta em poucas partições)
+    hoje = timezone.localdate()
+    date_from = _data('date_from') or hoje - timedelta(days=7)
+    date_to = _data('date_to') or hoje
+
+    # `month` é do mês em UTC: folga de um dia para eventos na virada do mês
+    events = AuditEvent.objects.filter(
+        month__gte=(date_from - timedelta(days=1)).replace(day=1),
+        month__lte=(date_to + timedelta(days=1)).replace(day=1),
+        created_at__date__gte=date_from,
+        created_at__date__lte=date_to,
+    )
+    if category_filter:
+        events = events.filter(category=category_filter)
+    if action_filter:
+        events = events.filter(action=action_filter)
+    if username_filter:
+        events = events.filter(username=username_filter)
+    if company_filter.isdigit():
+        events = events.filter(company_id=int(company_filter))
+    if ip_filter:
+        try:
+            validate_ipv46_address(ip_filter)
+            events = events.filter(ip_address=ip_filter)
+        except ValidationError:
+            events = events.none()
+
+    paginator = Paginator(events, 50)
+    events_page = paginator.get_page(request.GET.get('page', 1))
+
+    companies = Company.objects.order_by('name').only('id', 'name')
+    company_names = {c.id: c.name for c in companies}
+    for event in events_page:
+        event.company_name = company_names.get(event.company_id)
+
+    filtros = request.GET.copy()
+    filtros.pop('page', None)
+    return render(request, 'rm/audit/list.html', {
+        'events': events_page,
+        'categories': AuditEvent.CATEGORY_CHOICES,
+        'companies': companies,
+        'category_filter': category_filter,
+        'action_filter': action_filter,
+        'username_filter': username_filter,
+        'company_filter': company_filter,
+        'ip_filter': ip_filter,
+        'date_from': date_from,
+        'date_to': date_to,
+        'query_string': filtros.urlencode(),
+    })
+
+
+
+def _metrics_response():
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@login_required
+@rm_admin_required
+def _rm_metrics_session(request):
+    return _metrics_response()
+
+
+def rm_metrics(request):
+    """Métricas agregadas dos workers no formato texto do Prometheus (RM ou token do scraper)"""
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    if token and hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode()):
+        return _metrics_response()
+    return _rm_metrics_session(request)
+
+
+
+@login_required
+@rm_admin_required
+def rm_profile_list(request):
+    """Perfis de requisições gravados (sob demanda ou amostrados)"""
+    view_filter = request.GET.get('view', '').strip()
+    profiles = RequestProfile.objects.defer('data', 'top_entries')
+    if view_filter:
+        profiles = profiles.filter(view_name=view_filter)
+    profiles_page = Paginator(profiles, 50).get_page(request.GET.get('page', 1))
+    return render(request, 'rm/profiles/list.html', {
+        'profiles': profiles_page,
+        'view_filter': view_filter,
+    })
+
+
+@login_required
+@rm_admin_required
+def rm_profile_detail(request, profile_id):
+    """Principais pilhas/funções de um perfil"""
+    profile = get_object_or_404(RequestProfile.objects.defer('data'), id=profile_id)
+    return render(request, 'rm/profiles/detail.html', {'profile': profile})
+
+
+@login_required
+@rm_admin_required
+def rm_profile_download(request, profile_id):
+    """Download do perfil completo (pstats para cProfile, speedscope para amostragem)"""
+    profile = get_object_or_404(RequestProfile, id=profile_id)
+    conteudo, content_type, nome = profiling.download(profile)
+    response = HttpResponse(conteudo, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{nome}"'
     return response
 
 
@@ -1380,7 +1479,7 @@ def company_user_create(request, company_slug):
     """Cria um novo usuário no painel da empresa"""
     logger.debug(f"company_user_create: method={request.method}, company_slug={company_slug}, user={request.user.username}")
     
-    company = get_object_or_404(Company, slug=company_slug)
+    company = get_company_or_404(company_slug)
     
     # Verificar se o usuário tem permissão para criar usuários nesta empresa
     if not request.user.is_company_admin:
@@ -1463,7 +1562,7 @@ def company_user_create(request, company_slug):
 @login_required
 @company_access_required(require_admin=True)
 def company_user_edit(request, company_slug, user_id):
-    company = get_object_or_404(Company, slug=company_slug)
+    company = get_company_or_404(company_slug)
     user_obj = get_object_or_404(CustomUser, id=user_id, company=company)
     
     if request.method == 'POST':
@@ -1495,7 +1594,7 @@ def company_user_edit(request, company_slug, user_id):
 @require_http_methods(["POST"])
 def company_user_delete(request, company_slug, user_id):
     """Deleta um usuário da empresa"""
-    company = get_object_or_404(Company, slug=company_slug)
+    company = get_company_or_404(company_slug)
     
     try:
         user_obj = get_object_or_404(CustomUser, id=user_id, company=company)
@@ -1701,7 +1800,7 @@ def rm_reports_dashboard(request):
 @company_access_required
 def company_reports_dashboard(request, company_slug):
     """Dashboard de relatórios da empresa"""
-    company = get_object_or_404(Company, slug=company_slug)
+    company = get_company_or_404(company_slug)
     metrics = ReportGenerator.get_company_metrics(company)
     
     context = {
@@ -1750,7 +1849,7 @@ def export_system_report(request, format='csv'):
 @company_access_required
 def export_company_report(request, company_slug, format='csv'):
     """Exportar relatório da empresa"""
-    company = get_object_or_404(Company, slug=company_slug)
+    company = get_company_or_404(company_slug)
     metrics = ReportGenerator.get_company_metrics(company)
     
     # Preparar dados para exportação
@@ -1787,7 +1886,7 @@ def export_company_report(request, company_slug, format='csv'):
 @company_access_required
 def export_user_list(request, company_slug, format='csv'):
     """Exportar lista de usuários da empresa"""
-    company = get_object_or_404(Company, slug=company_slug)
+    company = get_company_or_404(company_slug)
     users = CustomUser.objects.filter(company=company)
     
     export_data = []
@@ -1814,7 +1913,7 @@ def export_user_list(request, company_slug, format='csv'):
 @company_access_required
 def export_map_list(request, company_slug, format='csv'):
     """Exportar lista de mapas da empresa"""
-    company = get_object_or_404(Company, slug=company_slug)
+    company = get_company_or_404(company_slug)
     maps = CTOMapFile.objects.filter(company=company)
     
     export_data = []
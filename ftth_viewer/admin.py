@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import GeocodingCache, CTOFile, ViabilidadeCache
+from .models import GeocodingCache, CTOFile, ViabilidadeCache, CTOEdit
 
 
 @admin.register(GeocodingCache)
@@ -23,7 +23,7 @@ class CTOFileAdmin(admin.ModelAdmin):
 @admin.register(ViabilidadeCache)
 class ViabilidadeCacheAdmin(admin.ModelAdmin):
     list_display = ['lat', 'lon', 'status_display', 'distancia_display', 'created_at']
-    list_filter = ['created_at']
+    list_filter = ['status', 'tem_geometria', 'created_at']
     search_fields = ['lat', 'lon']
     readonly_fields = ['created_at', 'resultado']
     ordering = ['-created_at']
@@ -36,3 +36,11 @@ class ViabilidadeCacheAdmin(admin.ModelAdmin):
         return f"{obj.resultado.get('distancia', {}).get('metros', 0):.0f}m"
     distancia_display.short_description = 'Distância'
 
+
+@admin.register(CTOEdit)
+class CTOEditAdmin(admin.ModelAdmin):
+    list_display = ['mapa', 'operacao', 'nome', 'lat', 'lng', 'compactado', 'created_by', 'created_at']
+    list_filter = ['operacao', 'compactado', 'created_at']
+    search_fields = ['nome', 'mapa__file']
+    readonly_fields = ['created_at']
+    ordering = ['-created_at']
@@ -7,6 +7,6 @@ class FtthViewerConfig(AppConfig):
     verbose_name = 'FTTH Viewer'
     
     def ready(self):
-        # Importar signals se necessário
-        pass
+        # Registro de invalidação de caches (signals do CTOMapFile)
+        import ftth_viewer.invalidation  # noqa: F401
 
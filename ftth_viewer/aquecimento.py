@@ -0,0 +1,175 @@
+"""
+Pré-aquecimento dos caches derivados dos mapas CTO.
+
+Depois de um deploy, de um restart do Redis ou de um upload, o primeiro operador de
+cada empresa pagaria a leitura completa dos mapas. Aqui os mesmos caches lidos pelas
+views (índice de CTOs, payloads de api_coordenadas e listagem de arquivos) são
+montados antes, empresa por empresa, da atividade mais recente para a mais antiga.
+
+O aquecimento passa pelo mesmo caminho das leituras (cache_camadas.consultar): o que
+já está em cache não é relido e a reconstrução respeita o lock contra stampede.
+"""
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Max
+
+from core.cache_namespaces import get_generation, map_namespace
+from core.models import Company, CTOMapFile, CustomUser
+
+from . import cache_camadas
+from .journal import aplicar_edicoes, chave_coordenadas, edicoes_pendentes
+from .models import ViabilidadeCache
+from .utils import get_all_ctos, ler_arquivo_mapa, listar_arquivos
+
+logger = logging.getLogger(__name__)
+
+EXTENSOES = ('kml', 'kmz', 'csv', 'xls', 'xlsx')
+
+
+def empresas_por_atividade(limite=None):
+    """
+    Empresas ativas com mapas, da atividade mais recente (login, upload ou consulta
+    de viabilidade) para a mais antiga.
+    """
+    ultima = {}
+    consultas = (
+        CustomUser.objects.filter(company__isnull=False, last_login__isnull=False)
+        .values('company_id').annotate(ultima=Max('last_login')),
+        CTOMapFile.objects.filter(processing_status='completed')
+        .values('company_id').annotate(ultima=Max('uploaded_at')),
+        ViabilidadeCache.objects.values('company_id').annotate(ultima=Max('created_at')),
+    )
+    for consulta in consultas:
+        for linha in consulta.order_by():
+            atual = ultima.get(linha['company_id'])
+            if atual is None or linha['ultima'] > atual:
+                ultima[linha['company_id']] = linha['ultima']
+
+    empresas = list(Company.objects.filter(is_active=True, cto_maps__processing_status='completed').distinct())
+    empresas.sort(key=lambda company: (ultima.get(company.id) is not None, ultima.get(company.id)), reverse=True)
+    return empresas[:limite] if limite else empresas
+
+
+def aquecer_coordenadas(mapa):
+    """
+    Monta o payload de api_coordenadas do mapa se ainda não estiver em cache
+    (só de mapas já validados pela ingestão).
+
+    Returns:
+        True se o payload foi montado agora
+    """
+    if not mapa.file:
+        return False
+    caminho = mapa.file.path
+    ext = os.path.splitext(mapa.file.name)[1].lower().lstrip('.')
+    if ext not in EXTENSOES or not os.path.exists(caminho):
+        return False
+
+    geracao = get_generation(map_namespace(mapa.id))
+    cache_key = chave_coordenadas(mapa.id, mapa.version, geracao)
+    _coords, reconstruir = cache_camadas.consultar(cache_key, geracao)
+    if not reconstruir:
+        return False
+    try:
+        inicio = time.perf_counter()
+        coords, _segundos = ler_arquivo_mapa(caminho, ext)
+        coords = aplicar_edicoes(coords, edicoes_pendentes([mapa.id]).get(mapa.id))
+        # Mesmas condições de api_coordenadas: sem coordenadas ou versão alterada não grava
+        if not coords or not CTOMapFile.objects.filter(
+            id=mapa.id, version=mapa.version, processing_status='completed'
+        ).exists():
+            return False
+        cache_camadas.guardar(cache_key, coords, 3600, geracao, time.perf_counter() - inicio)
+        return True
+    finally:
+        cache_camadas.liberar(cache_key)
+
+
+def aquecer_empresa(company, coordenadas=True):
+    """
+    Monta índice de CTOs, listagem de arquivos e (opcionalmente) coordenadas de
+    cada mapa da empresa.
+
+    Returns:
+        dict com ctos, mapas, coordenadas (payloads montados agora) e segundos
+    """
+    inicio = time.perf_counter()
+    ctos = get_all_ctos(company)
+    listar_arquivos(company)
+
+    mapas = list(
+        CTOMapFile.objects.filter(company=company, processing_status='completed')
+        .only('id', 'file', 'version', 'company_id')
+    )
+    montadas = 0
+    if coordenadas:
+        for mapa in mapas:
+            try:
+                montadas += aquecer_coordenadas(mapa)
+            except Exception as e:
+                logger.error(f"Erro ao aquecer coordenadas do mapa {mapa.id}: {str(e)}")
+
+    return {
+        'ctos': len(ctos),
+        'mapas': len(mapas),
+        'coordenadas': montadas,
+        'segundos': round(time.perf_counter() - inicio, 2),
+    }
+
+
+def _aquecer_em_thread(company, coordenadas):
+    """Executa o aquecimento de uma empresa com conexões de banco limpas na thread"""
+    close_old_connections()
+    try:
+        return aquecer_empresa(company, coordenadas)
+    finally:
+        close_old_connections()
+
+
+def aquecer_empresas(empresas, concorrencia=None, coordenadas=True):
+    """
+    Aquece as empresas na ordem recebida, no máximo `concorrencia` ao mesmo tempo
+    (padrão FTTH_AQUECIMENTO_CONCORRENCIA; 1 executa na própria thread).
+
+    Yields:
+        (company, resultado, erro) à medida que cada empresa termina
+    """
+    if concorrencia is None:
+        concorrencia = getattr(settings, 'FTTH_AQUECIMENTO_CONCORRENCIA', 2)
+
+    if concorrencia <= 1:
+        for company in empresas:
+            try:
+                yield company, aquecer_empresa(company, coordenadas), None
+            except Exception as e:
+                logger.error(f"Erro ao aquecer caches da empresa {company.id}: {str(e)}", exc_info=True)
+                yield company, None, str(e)
+        return
+
+    with ThreadPoolExecutor(max_workers=concorrencia, thread_name_prefix='cache-warm') as executor:
+        # Submetidas em ordem: com o limite de workers, as mais ativas começam primeiro
+        futures = [(company, executor.submit(_aquecer_em_thread, company, coordenadas)) for company in empresas]
+        for company, future in futures:
+            try:
+                yield company, future.result(), None
+            except Exception as e:
+                logger.error(f"Erro ao aquecer caches da empresa {company.id}: {str(e)}", exc_info=True)
+                yield company, None, str(e)
+
+
+def aquecer_apos_upload(mapa):
+    """Reconstrói os caches da empresa logo após a ingestão de um mapa (FTTH_AQUECER_APOS_UPLOAD)"""
+    if not getattr(settings, 'FTTH_AQUECER_APOS_UPLOAD', True):
+        return None
+    try:
+        resultado = aquecer_empresa(mapa.company)
+    except Exception as e:
+        logger.error(f"Erro ao aquecer caches após o upload do mapa {mapa.id}: {str(e)}", exc_info=True)
+        return None
+    logger.info(f"Caches da empresa {mapa.company_id} aquecidos após o upload do mapa {mapa.id}: {resultado}")
+    return resultado
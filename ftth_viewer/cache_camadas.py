@@ -0,0 +1,267 @@
+"""
+Cache em duas camadas para os conjuntos grandes por empresa (get_all_ctos, api_coordenadas).
+
+L1 é um LRU em memória do worker, limitado em bytes (FTTH_CACHE_LOCAL_MAX_BYTES);
+L2 é o cache do Django (Redis em produção). Cada entrada do L1 guarda a geração do
+índice da empresa com que foi obtida: a leitura faz só um GET pequeno da geração e,
+se ela não mudou, devolve o valor local sem trazer o payload inteiro do Redis.
+
+As chaves embutem a geração do namespace (core.cache_namespaces): conteúdo novo
+sempre vai para uma chave nova, então um L1 nunca serve valor de geração anterior.
+
+Proteção contra stampede (consultar/guardar): o valor fica no Redis por
+FTTH_CACHE_STALE_S segundos além da validade lógica. Vencido, só o worker que
+obtém o lock de reconstrução remonta o valor; os demais continuam servindo o
+valor antigo ou, sem valor nenhum (chave invalidada), aguardam a reconstrução.
+Antes de vencer, cada leitura sorteia uma renovação antecipada com probabilidade
+crescente perto da validade e proporcional ao custo da última reconstrução
+(XFetch), espalhando as renovações no tempo.
+
+Os valores do L1 são compartilhados entre requests do worker: não devem ser alterados.
+"""
+import math
+import os
+import pickle
+import random
+import threading
+import time
+from collections import OrderedDict
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+
+from core import metrics
+
+_lock = threading.Lock()
+_entradas = OrderedDict()
+_bytes = 0
+_locks = threading.local()
+_stats = {
+    'l1_hits': 0,
+    'l2_hits': 0,
+    'misses': 0,
+    'evictions': 0,
+    'stale_hits': 0,
+    'reconstrucoes': 0,
+    'renovacoes_antecipadas': 0,
+    'esperas': 0,
+}
+
+
+# Itens serializados por coleção grande na estimativa de tamanho do L1
+_AMOSTRA = 16
+
+
+def _limite_bytes():
+    return getattr(settings, 'FTTH_CACHE_LOCAL_MAX_BYTES', 64 * 1024 * 1024)
+
+
+def _tamanho(valor):
+    """
+    Tamanho aproximado do valor serializado. Coleções grandes não são serializadas
+    inteiras: o tamanho vem de uma amostra de _AMOSTRA itens espaçados, proporcional
+    ao total.
+    """
+    try:
+        return _estimar(valor)
+    except Exception:
+        return None
+
+
+def _estimar(valor):
+    if isinstance(valor, dict):
+        if len(valor) <= _AMOSTRA:
+            return sum(_estimar(chave) + _estimar(item) for chave, item in valor.items())
+        amostra = list(islice(valor.items(), _AMOSTRA))
+        return int(sum(_estimar(chave) + _estimar(item) for chave, item in amostra) * len(valor) / _AMOSTRA)
+    if isinstance(valor, (list, tuple)) and len(valor) > _AMOSTRA:
+        passo = len(valor) / _AMOSTRA
+        amostra = [valor[int(i * passo)] for i in range(_AMOSTRA)]
+        return int(_estimar(amostra) * len(valor) / _AMOSTRA)
+    return len(pickle.dumps(valor, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def _contar(nome):
+    with _lock:
+        _stats[nome] += 1
+    metrics.increment('ftth_cache_events_total', event=nome)
+
+
+def _guardar_local(chave, valor, geracao, meta=None):
+    global _bytes
+    if geracao is None:
+        return
+    tamanho = _tamanho(valor)
+    limite = _limite_bytes()
+    if tamanho is None or tamanho > limite:
+        return
+    removidas = 0
+    with _lock:
+        anterior = _entradas.pop(chave, None)
+        if anterior is not None:
+            _bytes -= anterior[2]
+        _entradas[chave] = (valor, geracao, tamanho, meta)
+        _bytes += tamanho
+        while _bytes > limite and _entradas:
+            _chave, item = _entradas.popitem(last=False)
+            _bytes -= item[2]
+            _stats['evictions'] += 1
+            removidas += 1
+    if removidas:
+        metrics.increment('ftth_cache_events_total', removidas, event='evictions')
+
+
+def _chave_meta(chave):
+    return f'{chave}_meta'
+
+
+def _chave_lock(chave):
+    return f'{chave}_rebuild_lock'
+
+
+def _vencido(meta, agora):
+    """Validade lógica esgotada ou renovação antecipada sorteada (XFetch)"""
+    if not meta:
+        return False
+    expira, duracao = meta
+    if agora >= expira:
+        return True
+    if duracao <= 0:
+        return False
+    beta = getattr(settings, 'FTTH_CACHE_XFETCH_BETA', 1.0)
+    return agora - duracao * beta * math.log(1.0 - random.random()) >= expira
+
+
+def _adquirir(chave):
+    """Lock de reconstrução entre workers (cache.add); o token identifica o dono"""
+    token = f'{os.getpid()}:{threading.get_ident()}:{time.time_ns()}'
+    timeout = getattr(settings, 'FTTH_CACHE_REBUILD_LOCK_S', 60)
+    if not cache.add(_chave_lock(chave), token, timeout):
+        return False
+    if not hasattr(_locks, 'tokens'):
+        _locks.tokens = {}
+    _locks.tokens[chave] = token
+    return True
+
+
+def liberar(chave):
+    """Libera o lock de reconstrução se esta thread for a dona (sem efeito caso contrário)"""
+    token = getattr(_locks, 'tokens', {}).pop(chave, None)
+    if token is not None and cache.get(_chave_lock(chave)) == token:
+        cache.delete(_chave_lock(chave))
+
+
+def _aguardar(chave):
+    """Espera outro worker terminar a reconstrução; None se o prazo acabar"""
+    limite = time.monotonic() + getattr(settings, 'FTTH_CACHE_REBUILD_ESPERA_S', 10)
+    while time.monotonic() < limite:
+        time.sleep(0.1)
+        valor = cache.get(chave)
+        if valor is not None:
+            return valor
+        if cache.get(_chave_lock(chave)) is None:
+            return None
+    return None
+
+
+def consultar(chave, geracao):
+    """
+    Busca primeiro no L1 (válido apenas se a geração bate) e depois no L2, com
+    proteção contra stampede.
+
+    Args:
+        chave: Chave do valor no cache do Django
+        geracao: Geração atual do índice da empresa (None desativa o L1)
+
+    Returns:
+        (valor, reconstruir): com reconstruir=True quem chama deve montar o valor e
+        chamar guardar() (ou liberar() se desistir); valor é None ou, numa renovação
+        antecipada, o valor atual
+    """
+    agora = time.time()
+    valor = None
+    meta = None
+    if geracao is not None:
+        with _lock:
+            item = _entradas.get(chave)
+            if item is not None and item[1] == geracao:
+                _entradas.move_to_end(chave)
+                valor, meta = item[0], item[3]
+        if valor is not None and not _vencido(meta, agora):
+            _contar('l1_hits')
+            return valor, False
+
+    # L1 ausente ou vencido: o L2 pode já ter sido renovado por outro worker
+    valores = cache.get_many([chave, _chave_meta(chave)])
+    valor = valores.get(chave)
+    if valor is not None:
+        meta = valores.get(_chave_meta(chave))
+        _guardar_local(chave, valor, geracao, meta)
+        if not _vencido(meta, agora):
+            _contar('l2_hits')
+            return valor, False
+        if _adquirir(chave):
+            _contar('renovacoes_antecipadas' if agora < meta[0] else 'reconstrucoes')
+            return valor, True
+        _contar('stale_hits')
+        return valor, False
+
+    _contar('misses')
+    if _adquirir(chave):
+        _contar('reconstrucoes')
+        return None, True
+
+    # Outro worker está reconstruindo e não há valor antigo: aguardar em vez de reconstruir junto
+    _contar('esperas')
+    valor = _aguardar(chave)
+    if valor is not None:
+        _guardar_local(chave, valor, geracao, cache.get(_chave_meta(chave)))
+        return valor, False
+    return None, True
+
+
+def gravar(chave, valor, timeout, duracao=0):
+    """
+    Grava só no L2, com validade lógica `timeout`; o valor é mantido mais
+    FTTH_CACHE_STALE_S segundos para ser servido durante a reconstrução.
+    """
+    meta = (time.time() + timeout, duracao)
+    fisico = timeout + getattr(settings, 'FTTH_CACHE_STALE_S', 600)
+    cache.set_many({chave: valor, _chave_meta(chave): meta}, fisico)
+    return meta
+
+
+def guardar(chave, valor, timeout, geracao, duracao=0):
+    """
+    Grava no L2 e no L1 do worker, associado à geração com que o valor foi montado,
+    e libera o lock de reconstrução. `duracao` (segundos gastos na montagem) calibra
+    a renovação antecipada.
+    """
+    try:
+        meta = gravar(chave, valor, timeout, duracao)
+        _guardar_local(chave, valor, geracao, meta)
+    finally:
+        liberar(chave)
+
+
+def estatisticas():
+    """Contadores de acertos por camada, reconstruções e ocupação do L1 deste worker"""
+    with _lock:
+        stats = dict(_stats)
+        stats['l1_entradas'] = len(_entradas)
+        stats['l1_bytes'] = _bytes
+    stats['l1_limite_bytes'] = _limite_bytes()
+    total = stats['l1_hits'] + stats['l2_hits'] + stats['stale_hits'] + stats['misses']
+    stats['l1_hit_ratio'] = round(stats['l1_hits'] / total, 4) if total else None
+    return stats
+
+
+def limpar():
+    """Esvazia o L1 deste worker e zera as estatísticas"""
+    global _bytes
+    with _lock:
+        _entradas.clear()
+        _bytes = 0
+        for chave in _stats:
+            _stats[chave] = 0
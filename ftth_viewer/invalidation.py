@@ -0,0 +1,168 @@
+"""
+Registro central de invalidação dos caches derivados dos mapas CTO.
+
+Cada artefato derivado (índice de CTOs da empresa, payloads de coordenadas,
+listagem de arquivos, resultados de viabilidade, painéis) se registra com os
+eventos que o afetam. Os eventos vêm dos signals do CTOMapFile (post_save,
+post_delete) e de core.map_signals (ingestão, edições de CTO, compactação), sempre
+após o commit. Um artefato atualiza o cache no lugar ou devolve os namespaces
+(core.cache_namespaces) a invalidar; cada namespace avança uma única vez por evento.
+"""
+import logging
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from core.cache_namespaces import RM_NAMESPACE, bump_generation, company_namespace, map_namespace
+from core.map_signals import cto_edits_applied, map_compacted, map_processed
+from core.models import CTOMapFile
+
+from . import aquecimento, viabilidade_buffer
+from .journal import atualizar_coordenadas, atualizar_indice, invalidar_viabilidade
+from .models import ViabilidadeCache
+
+logger = logging.getLogger(__name__)
+
+EVENTOS = ('salvo', 'excluido', 'processado', 'editado', 'compactado')
+
+_registro = []
+
+
+def artefato(nome, *eventos):
+    """Registra a função que mantém um artefato de cache nos eventos informados"""
+    def decorador(funcao):
+        _registro.append((nome, frozenset(eventos), funcao))
+        return funcao
+    return decorador
+
+
+def artefatos(evento):
+    """Nomes dos artefatos afetados por um evento"""
+    return [nome for nome, eventos, _funcao in _registro if evento in eventos]
+
+
+def invalidar(evento, mapa, **contexto):
+    """
+    Aplica um evento de alteração do mapa a todos os artefatos registrados.
+
+    Returns:
+        Conjunto de namespaces invalidados
+    """
+    namespaces = set()
+    for nome, eventos, funcao in _registro:
+        if evento not in eventos:
+            continue
+        try:
+            namespaces.update(funcao(evento, mapa, **contexto) or ())
+        except Exception as e:
+            logger.error(f"Erro ao invalidar '{nome}' ({evento}) do mapa {mapa.id}: {str(e)}", exc_info=True)
+
+    for namespace in sorted(namespaces):
+        bump_generation(namespace)
+    logger.debug(f"Mapa {mapa.id} {evento}: namespaces invalidados {sorted(namespaces)}")
+    return namespaces
+
+
+def _empresas(mapa, contexto):
+    """Empresa atual do mapa e, se ele mudou de empresa, a anterior"""
+    ids = {mapa.company_id, contexto.get('company_id_anterior')}
+    return [company_id for company_id in ids if company_id]
+
+
+@artefato('indice_ctos', 'salvo', 'excluido', 'processado', 'editado', 'compactado')
+def _indice_ctos(evento, mapa, edicoes=(), **contexto):
+    """Conjunto de CTOs da empresa (get_all_ctos), usado também como índice da viabilidade"""
+    if evento == 'editado':
+        # Aplicado no lugar e gravado na próxima geração da empresa
+        atualizar_indice(mapa, edicoes)
+        return ()
+    # Compactação: o mapa passa a apontar para outro arquivo, então o índice é remontado
+    return [company_namespace(company_id) for company_id in _empresas(mapa, contexto)]
+
+
+@artefato('listagem_arquivos', 'salvo', 'excluido', 'processado', 'compactado')
+def _listagem_arquivos(evento, mapa, **contexto):
+    """api_arquivos de todos os usuários (inclusive admins RM) das empresas do mapa (com o caminho do arquivo)"""
+    return [company_namespace(company_id) for company_id in _empresas(mapa, contexto)]
+
+
+@artefato('coordenadas', 'salvo', 'excluido', 'editado', 'compactado')
+def _coordenadas(evento, mapa, edicoes=(), versao=None, **contexto):
+    """Payloads de api_coordenadas do mapa"""
+    if evento == 'editado':
+        atualizar_coordenadas(mapa.id, versao - 1, versao, edicoes)
+        return ()
+    if evento == 'compactado':
+        # Conteúdo equivalente ao overlay: o payload passa para a nova versão como está
+        atualizar_coordenadas(mapa.id, versao, versao + 1)
+        return ()
+    return [map_namespace(mapa.id)]
+
+
+@artefato('resultados_viabilidade', 'salvo', 'excluido', 'processado', 'editado')
+def _resultados_viabilidade(evento, mapa, edicoes=(), **contexto):
+    """ViabilidadeCache (banco, fila de escrita e LRU locais)"""
+    if evento == 'editado':
+        invalidar_viabilidade(mapa, edicoes)
+        return ()
+
+    if evento == 'processado':
+        # Mapa novo pode ter CTO mais próximo que o vencedor de qualquer consulta "todos os mapas"
+        afetados = ViabilidadeCache.objects.filter(company_id=mapa.company_id, mapas_hash='')
+    elif evento == 'excluido' or contexto.get('company_id_anterior') not in (None, mapa.company_id):
+        # Consultas cujo CTO vencedor vinha deste mapa
+        afetados = ViabilidadeCache.objects.filter(cto_map_id=mapa.id)
+    else:
+        return ()
+
+    # Antes do DELETE: filas de outros workers não regravam resultados calculados antes dele
+    for company_id in _empresas(mapa, contexto):
+        viabilidade_buffer.descartar_empresa(company_id)
+    apagados, _ = afetados.delete()
+    if apagados:
+        logger.info(f"{apagados} resultado(s) de viabilidade invalidado(s) ({evento}, mapa {mapa.id})")
+    return ()
+
+
+@artefato('paineis', 'salvo', 'excluido', 'processado')
+def _paineis(evento, mapa, **contexto):
+    """Estatísticas do painel RM (total de mapas, atividades recentes)"""
+    return [RM_NAMESPACE]
+
+
+@receiver(pre_save, sender=CTOMapFile)
+def _guardar_empresa_anterior(sender, instance, **kwargs):
+    instance._company_id_anterior = None
+    if instance.pk:
+        instance._company_id_anterior = CTOMapFile.objects.filter(
+            pk=instance.pk
+        ).values_list('company_id', flat=True).first()
+
+
+@receiver(post_save, sender=CTOMapFile)
+def _mapa_salvo(sender, instance, **kwargs):
+    anterior = getattr(instance, '_company_id_anterior', None)
+    transaction.on_commit(lambda: invalidar('salvo', instance, company_id_anterior=anterior))
+
+
+@receiver(post_delete, sender=CTOMapFile)
+def _mapa_excluido(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalidar('excluido', instance))
+
+
+@receiver(map_processed, sender=CTOMapFile)
+def _mapa_processado(sender, instance, **kwargs):
+    invalidar('processado', instance)
+    # Já fora do request quando a ingestão é assíncrona: o primeiro operador não paga a releitura
+    aquecimento.aquecer_apos_upload(instance)
+
+
+@receiver(cto_edits_applied, sender=CTOMapFile)
+def _ctos_editados(sender, instance, edits, version, **kwargs):
+    invalidar('editado', instance, edicoes=edits, versao=version)
+
+
+@receiver(map_compacted, sender=CTOMapFile)
+def _mapa_compactado(sender, instance, version, **kwargs):
+    invalidar('compactado', instance, versao=version)
@@ -0,0 +1,474 @@
+"""
+Journal append-only de edições de CTOs.
+
+Adicionar ou remover um CTO não reescreve mais o arquivo do mapa: a edição é gravada
+em CTOEdit e aplicada como overlay por quem lê o mapa (api_coordenadas, get_all_ctos).
+A compactação incorpora as edições pendentes ao arquivo em segundo plano, quando o
+journal do mapa passa de FTTH_JOURNAL_COMPACT_THRESHOLD edições, pelo comando
+compact_cto_journal ou após um download. O download (exportar_mapa) não espera a
+compactação: aplica o journal sobre uma cópia temporária do arquivo.
+"""
+import logging
+import math
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files import File
+from django.db import DatabaseError, close_old_connections, transaction
+from django.db.models import F, Q
+
+from core.cache_namespaces import get_generation, make_key, map_namespace
+from core.map_signals import cto_edits_applied, map_compacted
+
+from . import cache_camadas
+from .models import CTOEdit
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+_agendados = set()
+# Locks locais em faixas fixas (map_id % N): memória constante com qualquer número de mapas;
+# mapas da mesma faixa só se serializam entre si dentro do processo
+_LOCKS_LOCAIS = [threading.Lock() for _ in range(64)]
+
+
+def _get_executor():
+    """Worker único por processo: compactações do mesmo mapa nunca rodam em paralelo aqui"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='cto-journal')
+    return _executor
+
+
+def registrar_edicao(mapa, operacao, lat, lng, nome='', user=None):
+    """Grava uma edição no journal do mapa e agenda a compactação se o journal cresceu"""
+    return registrar_edicoes(mapa, [{'operacao': operacao, 'nome': nome, 'lat': lat, 'lng': lng}], user=user)[0]
+
+
+def registrar_edicoes(mapa, edicoes, user=None):
+    """
+    Grava várias edições (dicts com operacao, nome, lat, lng) num único INSERT.
+
+    A versão do mapa avança na mesma transação (o UPDATE vem primeiro e serializa editores
+    do mesmo mapa); após o commit, cto_edits_applied aciona o registro de invalidação
+    (ftth_viewer.invalidation), que atualiza índice e coordenadas no lugar, sem releitura
+    dos arquivos.
+    """
+    from core.models import CTOMapFile
+
+    created_by = user if user and user.is_authenticated else None
+    with transaction.atomic():
+        CTOMapFile.objects.filter(id=mapa.id).update(version=F('version') + 1)
+        objetos = CTOEdit.objects.bulk_create([
+            CTOEdit(
+                mapa=mapa,
+                operacao=edicao['operacao'],
+                nome=edicao.get('nome') or '',
+                lat=edicao['lat'],
+                lng=edicao['lng'],
+                created_by=created_by,
+            )
+            for edicao in edicoes
+        ])
+        versao = CTOMapFile.objects.filter(id=mapa.id).values_list('version', flat=True).first()
+
+    transaction.on_commit(lambda: cto_edits_applied.send(
+        sender=CTOMapFile, instance=mapa, edits=objetos, version=versao
+    ))
+
+    limite = getattr(settings, 'FTTH_JOURNAL_COMPACT_THRESHOLD', 20)
+    if CTOEdit.objects.filter(mapa_id=mapa.id, compactado=False).count() >= limite:
+        agendar_compactacao(mapa.id)
+    return objetos
+
+
+def invalidar_viabilidade(mapa, edicoes):
+    """
+    Remove do ViabilidadeCache apenas os pontos cuja resposta pode mudar com as edições.
+
+    - remoção: pontos cujo CTO vencedor era o CTO removido deste mapa;
+    - adição: pontos dentro do raio 'inviavel' do novo CTO (bounding box no índice
+      company/lat_q/lon_q) que consideravam este mapa e cuja distância atual é maior que
+      a distância em linha reta até o novo CTO (a rota nunca é menor que ela).
+    """
+    from .models import ViabilidadeCache
+    from .utils import calcular_distancia
+    from .viabilidade_buffer import descartar_empresa
+
+    # Fila de escrita e LRU locais: gravar depois do DELETE traria o resultado antigo de volta
+    descartar_empresa(mapa.company_id)
+
+    config = getattr(settings, 'FTTH_VIABILIDADE_CONFIG', {})
+    raio = config.get('inviavel', 800)
+    por_empresa = ViabilidadeCache.objects.filter(company_id=mapa.company_id)
+    ids = set()
+
+    for edicao in edicoes:
+        if edicao.operacao == 'remove':
+            tolerancia = 1e-5
+            filtro = Q(cto_lat__range=(edicao.lat - tolerancia, edicao.lat + tolerancia),
+                       cto_lon__range=(edicao.lng - tolerancia, edicao.lng + tolerancia))
+            if edicao.nome.strip():
+                filtro |= Q(cto_nome__iexact=edicao.nome.strip())
+            ids.update(por_empresa.filter(filtro, cto_map_id=mapa.id).values_list('id', flat=True))
+            continue
+
+        delta_lat = raio / 111320.0
+        delta_lon = delta_lat / max(math.cos(math.radians(edicao.lat)), 0.01)
+        # A largura da célula em longitude varia com a latitude: faixa de lon_q pelos cantos
+        # (e pelo equador, onde o passo em graus é menor, se estiver dentro da caixa)
+        lats = [edicao.lat - delta_lat, edicao.lat + delta_lat]
+        if lats[0] < 0 < lats[1]:
+            lats.append(0.0)
+        celulas = [
+            ViabilidadeCache.quantizar(lat, lng)
+            for lat in lats
+            for lng in (edicao.lng - delta_lon, edicao.lng + delta_lon)
+        ]
+        lat_min, lat_max = min(c[0] for c in celulas), max(c[0] for c in celulas)
+        lon_min, lon_max = min(c[1] for c in celulas), max(c[1] for c in celulas)
+        candidatos = por_empresa.filter(
+            lat_q__range=(lat_min, lat_max),
+            lon_q__range=(lon_min, lon_max),
+        ).values_list('id', 'lat', 'lon', 'map_ids', 'resultado__distancia__metros')
+        for cache_id, lat, lon, map_ids, metros in candidatos:
+            if map_ids and mapa.id not in map_ids:
+                continue
+            distancia = calcular_distancia(lat, lon, edicao.lat, edicao.lng)
+            if distancia <= raio and (metros is None or distancia < float(metros)):
+                ids.add(cache_id)
+
+    if ids:
+        ViabilidadeCache.objects.filter(id__in=ids).delete()
+        logger.info(f"{len(ids)} resultado(s) de viabilidade invalidado(s) por edição no mapa {mapa.id}")
+    return len(ids)
+
+
+def chave_coordenadas(map_id, versao, geracao=None):
+    """Chave do payload de api_coordenadas de um mapa numa versão (namespace do mapa)"""
+    return make_key(map_namespace(map_id), f'api_coordenadas_v{versao}', geracao)
+
+
+def atualizar_coordenadas(map_id, versao_anterior, versao, edicoes=()):
+    """Deriva o payload de coordenadas da nova versão a partir do da versão anterior"""
+    geracao = get_generation(map_namespace(map_id))
+    coords = cache.get(chave_coordenadas(map_id, versao_anterior, geracao))
+    if coords is None:
+        return
+    cache_camadas.gravar(chave_coordenadas(map_id, versao, geracao), aplicar_edicoes(coords, edicoes), 3600)
+
+
+def edicoes_pendentes(map_ids):
+    """Edições ainda não compactadas, agrupadas por mapa e em ordem de gravação"""
+    pendentes = {}
+    if not map_ids:
+        return pendentes
+    for edicao in CTOEdit.objects.filter(mapa_id__in=list(map_ids), compactado=False).order_by('id'):
+        pendentes.setdefault(edicao.mapa_id, []).append(edicao)
+    return pendentes
+
+
+def edicao_corresponde(coord, lat, lng, nome=None, tolerance=1e-5):
+    """Mesmo critério de remover_cto_*: coordenada dentro da tolerância ou mesmo nome"""
+    from .utils import _coords_match
+
+    if coord.get('tipo', 'point') != 'point':
+        return False
+    if _coords_match(coord.get('lat'), coord.get('lng'), lat, lng, tolerance):
+        return True
+    nome_alvo = (nome or '').strip().lower()
+    return bool(nome_alvo) and str(coord.get('nome') or '').strip().lower() == nome_alvo
+
+
+def aplicar_edicoes(coords, edicoes):
+    """Aplica as edições do journal (em ordem) sobre as coordenadas lidas do arquivo"""
+    if not edicoes:
+        return coords
+
+    resultado = list(coords)
+    for edicao in edicoes:
+        if edicao.operacao == 'add':
+            resultado.append({
+                'nome': edicao.nome,
+                'lat': edicao.lat,
+                'lng': edicao.lng,
+                'tipo': 'point',
+            })
+        elif edicao.operacao == 'remove':
+            resultado = [
+                coord for coord in resultado
+                if not edicao_corresponde(coord, edicao.lat, edicao.lng, edicao.nome)
+            ]
+    return resultado
+
+
+def atualizar_indice(mapa, edicoes):
+    """
+    Aplica as edições no índice de CTOs da empresa em cache (get_all_ctos), evitando
+    reler todos os mapas, e o grava na próxima geração da empresa. Sem índice em cache
+    só a geração avança; se outro request estiver atualizando o mesmo índice, ou outra
+    invalidação da empresa acontecer no meio, o índice é remontado na próxima leitura.
+    """
+    from .utils import (
+        _normalizar_nome_cto, avancar_geracao_indice, calcular_distancia, chave_indice,
+        cto_pertence_aos_mapas, geracao_indice
+    )
+
+    lock_key = f'get_all_ctos_{mapa.company_id}_edit_lock'
+    if not cache.add(lock_key, 1, 30):
+        avancar_geracao_indice(mapa.company_id)
+        return
+    try:
+        geracao = geracao_indice(mapa.company_id)
+        coords = cache.get(chave_indice(mapa.company_id, geracao))
+        # Reconstruções em andamento (iniciadas antes desta edição) gravam numa chave que não é mais lida
+        nova_geracao = avancar_geracao_indice(mapa.company_id)
+        if coords is None or nova_geracao != geracao + 1:
+            return
+
+        tolerancia = getattr(settings, 'FTTH_CTO_DEDUP_TOLERANCE_M', 5)
+        for edicao in edicoes:
+            if edicao.operacao == 'add':
+                nome = _normalizar_nome_cto(edicao.nome)
+                duplicado = next((
+                    coord for coord in coords
+                    if coord.get('tipo', 'point') == 'point'
+                    and _normalizar_nome_cto(coord.get('nome')) == nome
+                    and calcular_distancia(edicao.lat, edicao.lng, coord['lat'], coord['lng']) <= tolerancia
+                ), None) if tolerancia > 0 else None
+                if duplicado is not None:
+                    # Mesmo critério de deduplicar_ctos: o CTO existente passa a constar também neste mapa
+                    map_ids = duplicado.setdefault('map_ids', [duplicado.get('map_id')])
+                    if mapa.id not in map_ids:
+                        map_ids.append(mapa.id)
+                    continue
+                coords.append({
+                    'nome': edicao.nome,
+                    'lat': edicao.lat,
+                    'lng': edicao.lng,
+                    'tipo': 'point',
+                    'arquivo': mapa.file_name,
+                    'map_id': mapa.id,
+                })
+                continue
+
+            restantes = []
+            for coord in coords:
+                if cto_pertence_aos_mapas(coord, [mapa.id]) and edicao_corresponde(coord, edicao.lat, edicao.lng, edicao.nome):
+                    # CTO deduplicado continua existindo nos outros mapas onde aparece
+                    outros = [mid for mid in coord.get('map_ids', ()) if str(mid) != str(mapa.id)]
+                    if not outros:
+                        continue
+                    coord['map_ids'] = outros
+                    if str(coord.get('map_id')) == str(mapa.id):
+                        coord['map_id'] = outros[0]
+                restantes.append(coord)
+            coords = restantes
+
+        cache_camadas.gravar(chave_indice(mapa.company_id, nova_geracao), coords, 3600)
+    finally:
+        cache.delete(lock_key)
+
+
+class MapaOcupado(Exception):
+    """Outra thread/worker está alterando o arquivo do mesmo mapa"""
+
+
+def _lock_local(map_id):
+    return _LOCKS_LOCAIS[map_id % len(_LOCKS_LOCAIS)]
+
+
+@contextmanager
+def bloqueio_mapa(map_id, aguardar=True):
+    """
+    Lock exclusivo para alterar o arquivo de um mapa.
+
+    Entre threads do processo usa o threading.Lock da faixa do mapa; entre workers do gunicorn,
+    SELECT ... FOR UPDATE na linha do CTOMapFile (o bloco roda numa transação).
+    Com aguardar=False levanta MapaOcupado em vez de esperar.
+    """
+    from core.models import CTOMapFile
+
+    lock = _lock_local(map_id)
+    if not lock.acquire(blocking=aguardar):
+        raise MapaOcupado(map_id)
+    try:
+        with transaction.atomic():
+            try:
+                list(CTOMapFile.objects.select_for_update(nowait=not aguardar).filter(id=map_id).values_list('id', flat=True))
+            except DatabaseError as e:
+                raise MapaOcupado(map_id) from e
+            yield
+    finally:
+        lock.release()
+
+
+def compactar_mapa(map_id, aguardar=False):
+    """
+    Incorpora as edições pendentes ao arquivo do mapa.
+
+    Roda sob bloqueio_mapa. O resultado vai para um arquivo novo
+    (cto_maps/compactados/<map_id>/v<versão>/), nunca sobre o original: na mesma
+    transação as edições são marcadas como compactadas e o CTOMapFile passa a apontar
+    para ele. Quem lê vê o arquivo antigo com o journal pendente ou o novo sem ele,
+    nunca o novo com as edições ainda pendentes (que seriam aplicadas duas vezes).
+    O arquivo antigo só é removido após o commit; se a transação falhar, o novo é
+    descartado.
+
+    Args:
+        map_id: ID do CTOMapFile
+        aguardar: esperar outra alteração do mesmo mapa terminar (senão desiste)
+
+    Returns:
+        Número de edições incorporadas, ou None se o mapa estava ocupado/indisponível
+    """
+    from core.models import CTOMapFile
+    from core.verificador_service import VerificadorService
+    from .utils import aplicar_edicoes_ao_mapa
+
+    destino = None
+    try:
+        with bloqueio_mapa(map_id, aguardar=aguardar):
+            edicoes = edicoes_pendentes([map_id]).get(map_id, [])
+            if not edicoes:
+                return 0
+
+            mapa = CTOMapFile.objects.filter(id=map_id).first()
+            if not mapa or not mapa.file or not os.path.exists(mapa.file.path):
+                logger.warning(f"Mapa {map_id} sem arquivo; journal não compactado")
+                return None
+
+            storage = mapa.file.storage
+            nome_antigo = mapa.file.name
+            # Nome original preservado; só um nome longo demais para a coluna é encurtado
+            nome_novo = storage.get_available_name(
+                storage.generate_filename(
+                    f'cto_maps/compactados/{map_id}/v{mapa.version + 1}/{os.path.basename(nome_antigo)}'
+                ),
+                max_length=CTOMapFile._meta.get_field('file').max_length,
+            )
+            destino = storage.path(nome_novo)
+            os.makedirs(os.path.dirname(destino), exist_ok=True)
+
+            # Todas as edições numa única leitura do original e escrita (atômica) do novo
+            ok = aplicar_edicoes_ao_mapa(mapa.file.path, [
+                {'operacao': e.operacao, 'nome': e.nome, 'lat': e.lat, 'lng': e.lng}
+                for e in edicoes
+            ], file_type=mapa.file_type, destino=destino)
+            if not ok:
+                logger.error(f"Erro ao compactar journal do mapa {map_id}")
+                return None
+
+            CTOEdit.objects.filter(id__in=[e.id for e in edicoes]).update(compactado=True)
+            if os.path.exists(destino):
+                with open(destino, 'rb') as fh:
+                    content_hash = VerificadorService.calcular_hash(File(fh))
+                CTOMapFile.objects.filter(id=map_id).update(
+                    file=nome_novo,
+                    content_hash=content_hash,
+                    file_size=os.path.getsize(destino),
+                    version=F('version') + 1,
+                )
+                # Ninguém mais aponta para o arquivo antigo depois do commit
+                transaction.on_commit(lambda: storage.delete(nome_antigo))
+            else:
+                # Nenhuma edição alterou o arquivo (ex.: remoção de CTO já ausente)
+                CTOMapFile.objects.filter(id=map_id).update(version=F('version') + 1)
+
+            # Versão anterior à compactação (os payloads passam dela para a seguinte)
+            versao = mapa.version
+            mapa.refresh_from_db()
+            transaction.on_commit(lambda: map_compacted.send(
+                sender=CTOMapFile, instance=mapa, version=versao
+            ))
+    except MapaOcupado:
+        logger.info(f"Mapa {map_id} em alteração; compactação adiada")
+        return None
+    except Exception:
+        # Transação desfeita: o arquivo novo não é referenciado por ninguém
+        if destino and os.path.exists(destino):
+            os.remove(destino)
+        raise
+
+    logger.info(f"Journal do mapa {map_id} compactado ({len(edicoes)} edições)")
+    return len(edicoes)
+
+
+def exportar_mapa(map_id, tentativas=3):
+    """
+    Conteúdo do arquivo do mapa com as edições pendentes aplicadas, para download.
+
+    Não bloqueia o mapa nem altera o arquivo: o journal é aplicado numa cópia temporária
+    e a compactação fica agendada em segundo plano. Arquivo e edições são lidos de um
+    mesmo estado (o nome do arquivo é relido depois das edições); se uma compactação
+    trocar o arquivo no meio, a leitura é refeita.
+
+    Returns:
+        bytes do arquivo, ou None se o mapa não tem arquivo
+    """
+    from core.models import CTOMapFile
+    from .utils import aplicar_edicoes_ao_mapa
+
+    for tentativa in range(tentativas):
+        mapa = CTOMapFile.objects.filter(id=map_id).first()
+        if not mapa or not mapa.file:
+            return None
+        edicoes = edicoes_pendentes([map_id]).get(map_id, [])
+        nome = CTOMapFile.objects.filter(id=map_id).values_list('file', flat=True).first()
+        if nome != mapa.file.name:
+            continue
+        try:
+            if not edicoes:
+                with open(mapa.file.path, 'rb') as fh:
+                    return fh.read()
+            with tempfile.TemporaryDirectory(prefix='cto_export_') as diretorio:
+                destino = os.path.join(diretorio, os.path.basename(mapa.file.name))
+                ok = aplicar_edicoes_ao_mapa(mapa.file.path, [
+                    {'operacao': e.operacao, 'nome': e.nome, 'lat': e.lat, 'lng': e.lng}
+                    for e in edicoes
+                ], file_type=mapa.file_type, destino=destino)
+                if not ok:
+                    raise IOError(f"Erro ao aplicar o journal do mapa {map_id} para download")
+                # Sem alteração efetiva o destino não é criado: o arquivo já está atualizado
+                with open(destino if os.path.exists(destino) else mapa.file.path, 'rb') as fh:
+                    conteudo = fh.read()
+        except FileNotFoundError:
+            # Arquivo antigo removido por uma compactação concluída no meio da leitura
+            if tentativa == tentativas - 1:
+                raise
+            continue
+        agendar_compactacao(map_id)
+        return conteudo
+    raise IOError(f"Mapa {map_id} alterado durante a leitura para download")
+
+
+def agendar_compactacao(map_id):
+    """Agenda a compactação do mapa em segundo plano (após o commit da transação)"""
+    def _submit():
+        with _executor_lock:
+            if map_id in _agendados:
+                return
+            _agendados.add(map_id)
+        _get_executor().submit(_run_in_worker, map_id)
+
+    transaction.on_commit(_submit)
+
+
+def _run_in_worker(map_id):
+    close_old_connections()
+    try:
+        compactar_mapa(map_id)
+    except Exception as e:
+        logger.exception(f"Erro inesperado na compactação do mapa {map_id}: {str(e)}")
+    finally:
+        with _executor_lock:
+            _agendados.discard(map_id)
+        close_old_connections()
@@ -0,0 +1,38 @@
+# Generated manually
+# Journal append-only de edições de CTOs (aplicado como overlay até a compactação)
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ftth_viewer', '0003_make_company_required'),
+        ('core', '0012_ctomapfile_content_hash'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CTOEdit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('operacao', models.CharField(choices=[('add', 'Adicionar'), ('remove', 'Remover')], max_length=10)),
+                ('nome', models.CharField(blank=True, default='', max_length=255)),
+                ('lat', models.FloatField()),
+                ('lng', models.FloatField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('compactado', models.BooleanField(default=False, help_text='Edição já incorporada ao arquivo do mapa')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='cto_edits', to=settings.AUTH_USER_MODEL, verbose_name='Criado por')),
+                ('mapa', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cto_edits', to='core.ctomapfile', verbose_name='Mapa')),
+            ],
+            options={
+                'verbose_name': 'Edição de CTO',
+                'verbose_name_plural': 'Edições de CTOs',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['mapa', 'compactado'], name='ftth_ctoedit_mapa_pend_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,87 @@
+# Generated manually
+# - Cria a coluna mapas_hash (presente no modelo, mas nunca criada por migração) e
+#   alinha unique_together/índice com o modelo
+# - Registra o CTO vencedor e os mapas considerados em cada resultado de viabilidade,
+#   com índice (company, lat, lon) para invalidação por região
+
+from django.db import migrations, models
+
+
+def preencher_cto_vencedor(apps, schema_editor):
+    """Copia o CTO vencedor do JSON do resultado para as novas colunas"""
+    ViabilidadeCache = apps.get_model('ftth_viewer', 'ViabilidadeCache')
+    for cache_obj in ViabilidadeCache.objects.all().iterator():
+        cto = (cache_obj.resultado or {}).get('cto') or {}
+        try:
+            cache_obj.cto_lat = float(cto['lat'])
+            cache_obj.cto_lon = float(cto['lon'])
+        except (KeyError, TypeError, ValueError):
+            continue
+        cache_obj.cto_nome = str(cto.get('nome') or '')[:255]
+        try:
+            cache_obj.cto_map_id = int(cto.get('map_id'))
+        except (TypeError, ValueError):
+            cache_obj.cto_map_id = None
+        cache_obj.map_ids = [int(mid) for mid in cache_obj.mapas_hash.split(',') if mid.strip().isdigit()]
+        cache_obj.save(update_fields=['cto_nome', 'cto_lat', 'cto_lon', 'cto_map_id', 'map_ids'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ftth_viewer', '0004_ctoedit'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='viabilidadecache',
+            name='ftth_viewer_lat_e90c5a_idx',
+        ),
+        migrations.AlterUniqueTogether(
+            name='viabilidadecache',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='viabilidadecache',
+            name='mapas_hash',
+            field=models.CharField(blank=True, db_index=True, default='', help_text='Hash dos IDs dos mapas ativos quando a verificação foi feita', max_length=500),
+        ),
+        migrations.AlterUniqueTogether(
+            name='viabilidadecache',
+            unique_together={('lat', 'lon', 'company', 'mapas_hash')},
+        ),
+        migrations.AddIndex(
+            model_name='viabilidadecache',
+            index=models.Index(fields=['lat', 'lon', 'company', 'mapas_hash'], name='ftth_viewer_lat_b315ec_idx'),
+        ),
+        migrations.AddField(
+            model_name='viabilidadecache',
+            name='cto_nome',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='viabilidadecache',
+            name='cto_lat',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='viabilidadecache',
+            name='cto_lon',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='viabilidadecache',
+            name='cto_map_id',
+            field=models.IntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='viabilidadecache',
+            name='map_ids',
+            field=models.JSONField(blank=True, default=list, help_text='IDs dos mapas considerados (vazio = todos os mapas da empresa)'),
+        ),
+        migrations.AddIndex(
+            model_name='viabilidadecache',
+            index=models.Index(fields=['company', 'lat', 'lon'], name='ftth_viab_company_lat_lon_idx'),
+        ),
+        migrations.RunPython(preencher_cto_vencedor, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,66 @@
+# Generated manually
+# Chave do ViabilidadeCache passa a ser (company, lat_q, lon_q, mapas_hash) com coordenadas
+# inteiras quantizadas; os índices por float (lat, lon, ...) deixam de ser necessários
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def quantizar_existentes(apps, schema_editor):
+    """Preenche lat_q/lon_q; na mesma célula, mantém só o resultado mais recente"""
+    ViabilidadeCache = apps.get_model('ftth_viewer', 'ViabilidadeCache')
+    passo = getattr(settings, 'FTTH_VIABILIDADE_CACHE_RESOLUCAO_M', 5) / 111320.0
+    vistos = set()
+    duplicados = []
+    for cache_obj in ViabilidadeCache.objects.order_by('-created_at', '-id').iterator():
+        lat_q, lon_q = int(round(cache_obj.lat / passo)), int(round(cache_obj.lon / passo))
+        chave = (cache_obj.company_id, lat_q, lon_q, cache_obj.mapas_hash)
+        if chave in vistos:
+            duplicados.append(cache_obj.id)
+            continue
+        vistos.add(chave)
+        ViabilidadeCache.objects.filter(id=cache_obj.id).update(lat_q=lat_q, lon_q=lon_q)
+    ViabilidadeCache.objects.filter(id__in=duplicados).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ftth_viewer', '0005_viabilidadecache_cto_vencedor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='viabilidadecache',
+            name='lat_q',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='viabilidadecache',
+            name='lon_q',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.RunPython(quantizar_existentes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='viabilidadecache',
+            name='lat_q',
+            field=models.IntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='viabilidadecache',
+            name='lon_q',
+            field=models.IntegerField(),
+        ),
+        migrations.AlterUniqueTogether(
+            name='viabilidadecache',
+            unique_together={('company', 'lat_q', 'lon_q', 'mapas_hash')},
+        ),
+        migrations.RemoveIndex(
+            model_name='viabilidadecache',
+            name='ftth_viewer_lat_b315ec_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='viabilidadecache',
+            name='ftth_viab_company_lat_lon_idx',
+        ),
+    ]
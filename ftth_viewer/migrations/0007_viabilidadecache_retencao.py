@@ -0,0 +1,36 @@
+# Generated manually
+# Política de retenção do ViabilidadeCache: status desnormalizado para relatórios,
+# marcação de geometria descartada e índice (company, created_at) para purga em lotes
+
+from django.db import migrations, models
+
+
+def preencher_status(apps, schema_editor):
+    ViabilidadeCache = apps.get_model('ftth_viewer', 'ViabilidadeCache')
+    for status in ('Viável', 'Viabilidade Limitada', 'Sem viabilidade'):
+        ViabilidadeCache.objects.filter(resultado__viabilidade__status=status).update(status=status)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ftth_viewer', '0006_viabilidadecache_quantized_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='viabilidadecache',
+            name='status',
+            field=models.CharField(blank=True, default='', max_length=30),
+        ),
+        migrations.AddField(
+            model_name='viabilidadecache',
+            name='tem_geometria',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddIndex(
+            model_name='viabilidadecache',
+            index=models.Index(fields=['company', 'created_at'], name='ftth_viab_company_created_idx'),
+        ),
+        migrations.RunPython(preencher_status, migrations.RunPython.noop),
+    ]
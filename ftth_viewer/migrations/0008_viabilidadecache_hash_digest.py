@@ -0,0 +1,56 @@
+# Generated manually
+# mapas_hash passa a ser o SHA-1 (40 caracteres) dos IDs dos mapas, em vez da lista de IDs
+# (até 500 caracteres na chave única), sem o índice próprio redundante; a grade do cache
+# passa a ter o passo em longitude corrigido pelo cosseno da latitude
+
+import hashlib
+import math
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def recalcular_chaves(apps, schema_editor):
+    """Recalcula lon_q e mapas_hash; na mesma célula, mantém só o resultado mais recente"""
+    ViabilidadeCache = apps.get_model('ftth_viewer', 'ViabilidadeCache')
+    passo = getattr(settings, 'FTTH_VIABILIDADE_CACHE_RESOLUCAO_M', 5) / 111320.0
+    vistos = set()
+    duplicados = []
+    for cache_obj in ViabilidadeCache.objects.order_by('-created_at', '-id').iterator():
+        lat_q = int(round(cache_obj.lat / passo))
+        passo_lon = passo / max(math.cos(math.radians(lat_q * passo)), 0.01)
+        lon_q = int(round(cache_obj.lon / passo_lon))
+        ids = sorted(i.strip() for i in cache_obj.mapas_hash.split(',') if i.strip())
+        mapas_hash = hashlib.sha1(','.join(ids).encode()).hexdigest() if ids else ''
+        chave = (cache_obj.company_id, lat_q, lon_q, mapas_hash)
+        if chave in vistos:
+            duplicados.append(cache_obj.id)
+            continue
+        vistos.add(chave)
+        ViabilidadeCache.objects.filter(id=cache_obj.id).update(lat_q=lat_q, lon_q=lon_q, mapas_hash=mapas_hash)
+    ViabilidadeCache.objects.filter(id__in=duplicados).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ftth_viewer', '0007_viabilidadecache_retencao'),
+    ]
+
+    operations = [
+        # Sem a chave única enquanto as linhas são regravadas uma a uma
+        migrations.AlterUniqueTogether(
+            name='viabilidadecache',
+            unique_together=set(),
+        ),
+        migrations.RunPython(recalcular_chaves, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='viabilidadecache',
+            name='mapas_hash',
+            field=models.CharField(blank=True, default='', help_text='Hash dos IDs dos mapas ativos quando a verificação foi feita', max_length=40),
+        ),
+        migrations.AlterUniqueTogether(
+            name='viabilidadecache',
+            unique_together={('company', 'lat_q', 'lon_q', 'mapas_hash')},
+        ),
+    ]
@@ -1,6 +1,9 @@
+from django.conf import settings
 from django.db import models
 from django.core.cache import cache
+import hashlib
 import json
+import math
 
 
 class GeocodingCache(models.Model):
@@ -60,6 +63,10 @@ class ViabilidadeCache(models.Model):
     """Cache de verificações de viabilidade - separado por empresa e mapas ativos"""
     lat = models.FloatField()
     lon = models.FloatField()
+    # Coordenadas quantizadas (grade de FTTH_VIABILIDADE_CACHE_RESOLUCAO_M metros nos dois
+    # eixos): chave do cache, cliques praticamente no mesmo ponto reaproveitam o mesmo resultado
+    lat_q = models.IntegerField()
+    lon_q = models.IntegerField()
     company = models.ForeignKey(
         'core.Company',
         on_delete=models.CASCADE,
@@ -67,27 +74,119 @@ class ViabilidadeCache(models.Model):
         null=False,  # Obrigatório - sempre deve ter empresa
         verbose_name="Empresa"
     )
+    # SHA-1 dos IDs dos mapas ativos (largura fixa na chave única); vazio = todos os mapas
     mapas_hash = models.CharField(
-        max_length=500,
+        max_length=40,
         blank=True,
         default='',
-        db_index=True,
         help_text="Hash dos IDs dos mapas ativos quando a verificação foi feita"
     )
     resultado = models.JSONField()
+    # CTO vencedor e mapas considerados: permitem invalidar só os pontos afetados por uma edição
+    cto_nome = models.CharField(max_length=255, blank=True, default='')
+    cto_lat = models.FloatField(null=True, blank=True)
+    cto_lon = models.FloatField(null=True, blank=True)
+    cto_map_id = models.IntegerField(null=True, blank=True, db_index=True)
+    map_ids = models.JSONField(
+        default=list,
+        blank=True,
+        help_text="IDs dos mapas considerados (vazio = todos os mapas da empresa)"
+    )
+    # Status da viabilidade fora do JSON: relatórios agregam sem ler `resultado`
+    status = models.CharField(max_length=30, blank=True, default='')
+    # False quando a geometria da rota já foi descartada pela política de retenção
+    tem_geometria = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         verbose_name = 'Cache de Viabilidade'
         verbose_name_plural = 'Cache de Viabilidades'
-        unique_together = [['lat', 'lon', 'company', 'mapas_hash']]  # Cache único por coordenada, empresa E mapas ativos
+        # Cache único por célula, empresa E mapas ativos; o prefixo (company, lat_q, lon_q)
+        # também atende a busca por região ao invalidar pontos próximos a um CTO editado
+        unique_together = [['company', 'lat_q', 'lon_q', 'mapas_hash']]
         indexes = [
-            models.Index(fields=['lat', 'lon', 'company', 'mapas_hash']),
+            # Expiração, limite de tamanho e relatórios percorrem faixas de created_at por empresa
+            models.Index(fields=['company', 'created_at'], name='ftth_viab_company_created_idx'),
         ]
     
+    @staticmethod
+    def quantizar(lat, lon):
+        """
+        Célula (lat_q, lon_q) de uma coordenada na grade do cache.
+
+        O passo em longitude é dividido pelo cosseno da latitude da linha (lat_q), para
+        a célula ter a mesma largura em metros nos dois eixos.
+        """
+        passo = getattr(settings, 'FTTH_VIABILIDADE_CACHE_RESOLUCAO_M', 5) / 111320.0
+        lat_q = int(round(lat / passo))
+        passo_lon = passo / max(math.cos(math.radians(lat_q * passo)), 0.01)
+        return lat_q, int(round(lon / passo_lon))
+    
+    @staticmethod
+    def hash_mapas(map_ids):
+        """mapas_hash de um conjunto de IDs de mapas ('' = todos os mapas da empresa)"""
+        ids = sorted(str(map_id).strip() for map_id in map_ids if str(map_id).strip())
+        if not ids:
+            return ''
+        return hashlib.sha1(','.join(ids).encode()).hexdigest()
+    
+    def save(self, *args, **kwargs):
+        if self.lat_q is None or self.lon_q is None:
+            self.lat_q, self.lon_q = self.quantizar(self.lat, self.lon)
+        super().save(*args, **kwargs)
+    
     def __str__(self):
         status = self.resultado.get('viabilidade', {}).get('status', 'N/A')
         company_name = self.company.name if self.company else 'N/A'
-        mapas_info = f" - {len(self.mapas_hash.split(','))} mapa(s)" if self.mapas_hash else ""
+        mapas_info = f" - {len(self.map_ids)} mapa(s)" if self.map_ids else ""
         return f"({self.lat:.6f}, {self.lon:.6f}) - {company_name}{mapas_info} - {status}"
 
+
+
+class CTOEdit(models.Model):
+    """
+    Journal append-only de edições de CTOs em um mapa.
+
+    Adicionar/remover CTO apenas grava uma linha aqui; leitores e o índice de CTOs
+    aplicam as edições pendentes sobre o conteúdo do arquivo, e a compactação
+    incorpora o journal ao arquivo em segundo plano (ou antes do download).
+    """
+    OPERACAO_CHOICES = [
+        ('add', 'Adicionar'),
+        ('remove', 'Remover'),
+    ]
+
+    mapa = models.ForeignKey(
+        'core.CTOMapFile',
+        on_delete=models.CASCADE,
+        related_name='cto_edits',
+        verbose_name="Mapa"
+    )
+    operacao = models.CharField(max_length=10, choices=OPERACAO_CHOICES)
+    nome = models.CharField(max_length=255, blank=True, default='')
+    lat = models.FloatField()
+    lng = models.FloatField()
+    created_by = models.ForeignKey(
+        'core.CustomUser',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='cto_edits',
+        verbose_name="Criado por"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    compactado = models.BooleanField(
+        default=False,
+        help_text="Edição já incorporada ao arquivo do mapa"
+    )
+
+    class Meta:
+        verbose_name = 'Edição de CTO'
+        verbose_name_plural = 'Edições de CTOs'
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['mapa', 'compactado'], name='ftth_ctoedit_mapa_pend_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_operacao_display()} {self.nome or 'CTO'} ({self.lat:.6f}, {self.lng:.6f}) - mapa {self.mapa_id}"
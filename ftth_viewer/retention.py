@@ -0,0 +1,148 @@
+"""
+Política de retenção do cache de viabilidade (ViabilidadeCache).
+
+- Validade (TTL) por empresa: Company.viability_cache_ttl_days ou
+  FTTH_VIABILIDADE_CACHE_TTL_DIAS; entradas vencidas deixam de ser servidas
+  imediatamente e são apagadas pela purga.
+- Tamanho máximo por empresa (FTTH_VIABILIDADE_CACHE_MAX_LINHAS): as entradas
+  mais antigas além do limite são apagadas.
+- Geometria da rota descartada após FTTH_VIABILIDADE_GEOMETRIA_DIAS: a linha
+  continua contando nos relatórios, mas não é mais servida como cache.
+
+A purga trabalha em lotes pequenos de IDs (cada lote é uma transação curta),
+de modo que a tabela nunca fica travada por muito tempo.
+"""
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ViabilidadeCache
+
+logger = logging.getLogger(__name__)
+
+
+def ttl_dias(company):
+    """Validade do cache de viabilidade da empresa, em dias"""
+    dias = getattr(company, 'viability_cache_ttl_days', None) if company else None
+    if dias:
+        return dias
+    return getattr(settings, 'FTTH_VIABILIDADE_CACHE_TTL_DIAS', 30)
+
+
+def inicio_validade(company, agora=None):
+    """Entradas criadas antes deste instante estão vencidas"""
+    return (agora or timezone.now()) - timedelta(days=ttl_dias(company))
+
+
+def _apagar_em_lotes(queryset, lote, pausa):
+    """Apaga os registros do queryset em lotes de IDs, uma transação curta por lote"""
+    total = 0
+    while True:
+        ids = list(queryset.order_by('id').values_list('id', flat=True)[:lote])
+        if not ids:
+            return total
+        with transaction.atomic():
+            apagados, _ = ViabilidadeCache.objects.filter(id__in=ids).delete()
+        total += apagados
+        if len(ids) < lote:
+            return total
+        if pausa:
+            time.sleep(pausa)
+
+
+def expirar(company, lote=1000, pausa=0, agora=None):
+    """Apaga as entradas da empresa mais antigas que a validade configurada"""
+    vencidas = ViabilidadeCache.objects.filter(
+        company=company,
+        created_at__lt=inicio_validade(company, agora)
+    )
+    return _apagar_em_lotes(vencidas, lote, pausa)
+
+
+def limitar_tamanho(company, max_linhas=None, lote=1000, pausa=0):
+    """Mantém no máximo `max_linhas` entradas da empresa, apagando as mais antigas"""
+    if max_linhas is None:
+        max_linhas = getattr(settings, 'FTTH_VIABILIDADE_CACHE_MAX_LINHAS', 50000)
+    if not max_linhas:
+        return 0
+
+    # Data de corte = created_at da primeira linha além do limite (índice company+created_at)
+    corte = ViabilidadeCache.objects.filter(company=company).order_by(
+        '-created_at', '-id'
+    ).values_list('created_at', 'id')[max_linhas:max_linhas + 1]
+    corte = list(corte)
+    if not corte:
+        return 0
+    created_at, ultimo_id = corte[0]
+    excedentes = ViabilidadeCache.objects.filter(company=company).filter(
+        Q(created_at__lt=created_at) | Q(created_at=created_at, id__lte=ultimo_id)
+    )
+    return _apagar_em_lotes(excedentes, lote, pausa)
+
+
+def remover_geometria(company, dias=None, lote=1000, pausa=0, agora=None):
+    """Descarta a geometria da rota das entradas mais antigas que `dias`"""
+    if dias is None:
+        dias = getattr(settings, 'FTTH_VIABILIDADE_GEOMETRIA_DIAS', 7)
+    if not dias:
+        return 0
+
+    limite = (agora or timezone.now()) - timedelta(days=dias)
+    pendentes = ViabilidadeCache.objects.filter(
+        company=company,
+        tem_geometria=True,
+        created_at__lt=limite
+    )
+    total = 0
+    while True:
+        entradas = list(pendentes.order_by('id').only('id', 'resultado')[:lote])
+        if not entradas:
+            return total
+        for entrada in entradas:
+            rota = (entrada.resultado or {}).get('rota')
+            if isinstance(rota, dict):
+                rota['geometria'] = None
+            entrada.tem_geometria = False
+        with transaction.atomic():
+            ViabilidadeCache.objects.bulk_update(entradas, ['resultado', 'tem_geometria'])
+        total += len(entradas)
+        if len(entradas) < lote:
+            return total
+        if pausa:
+            time.sleep(pausa)
+
+
+def purgar_viabilidade(company=None, lote=1000, pausa=0):
+    """
+    Aplica a política de retenção completa (TTL, tamanho máximo e geometria).
+
+    Args:
+        company: Empresa específica ou None para todas as empresas com cache
+        lote: Quantidade de linhas por transação
+        pausa: Segundos de espera entre lotes (alivia o banco em produção)
+
+    Returns:
+        dict com os totais de linhas expiradas, excedentes e sem geometria
+    """
+    from core.models import Company
+
+    if company is not None:
+        empresas = [company]
+    else:
+        empresa_ids = ViabilidadeCache.objects.order_by().values_list('company_id', flat=True).distinct()
+        empresas = Company.objects.filter(id__in=empresa_ids)
+
+    totais = {'expiradas': 0, 'excedentes': 0, 'sem_geometria': 0}
+    agora = timezone.now()
+    for empresa in empresas:
+        totais['expiradas'] += expirar(empresa, lote=lote, pausa=pausa, agora=agora)
+        totais['excedentes'] += limitar_tamanho(empresa, lote=lote, pausa=pausa)
+        totais['sem_geometria'] += remover_geometria(empresa, lote=lote, pausa=pausa, agora=agora)
+
+    logger.info(f"Purga do cache de viabilidade: {totais}")
+    return totais
@@ -17,9 +17,12 @@ urlpatterns = [
     path('api/geocode', views.api_geocode, name='api_geocode'),
     path('api/geocode/suggestions', views.api_geocode_suggestions, name='api_geocode_suggestions'),
     path('api/verificar-viabilidade', views.api_verificar_viabilidade, name='api_verificar_viabilidade'),
+    path('api/rota-viabilidade', views.api_rota_viabilidade, name='api_rota_viabilidade'),
     path('api/cache/geocoding/stats', views.api_cache_geocoding_stats, name='api_cache_geocoding_stats'),
+    path('api/cache/stats', views.api_cache_stats, name='api_cache_stats'),
     path('api/cache/geocoding/clear', views.api_cache_geocoding_clear, name='api_cache_geocoding_clear'),
     path('api/adicionar-cto', views.api_adicionar_cto, name='api_adicionar_cto'),
     path('api/remover-cto', views.api_remover_cto, name='api_remover_cto'),
+    path('api/editar-ctos-lote', views.api_editar_ctos_lote, name='api_editar_ctos_lote'),
 ]
 
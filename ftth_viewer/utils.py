@@ -12,11 +12,25 @@ import csv
 import pandas as pd
 import unicodedata
 import re
+import time
+import logging
+import threading
+import multiprocessing
+import shutil
+import tempfile
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import django
 from django.conf import settings
 from django.core.cache import cache
 from .models import GeocodingCache, ViabilidadeCache
+from . import cache_camadas
+from core import metrics
+from core.cache_namespaces import bump_generation, company_namespace, get_generation, make_key
+
+logger = logging.getLogger(__name__)
 
 
 def _normalize_decimal(value):
@@ -48,7 +62,7 @@ def get_base_path():
 
 
 def ler_kml(caminho_kml):
-    """Lê um arquivo KML e extrai coordenadas"""
+    """Lê um arquivo KML (caminho ou arquivo aberto) e extrai coordenadas"""
     try:
         tree = ET.parse(caminho_kml)
         root = tree.getroot()
@@ -106,27 +120,19 @@ def ler_kml(caminho_kml):
 
 
 def ler_kmz(caminho_kmz, filtrar_brasil=False):
-    """Lê um arquivo KMZ e extrai coordenadas"""
-    import tempfile
+    """Lê um arquivo KMZ (caminho ou arquivo aberto) e extrai coordenadas"""
     try:
         with zipfile.ZipFile(caminho_kmz, 'r') as kmz:
             for arquivo in kmz.namelist():
                 if arquivo.endswith('.kml'):
+                    # Ler o KML direto do ZIP, sem extrair para arquivo temporário
                     with kmz.open(arquivo) as kml_file:
-                        with tempfile.NamedTemporaryFile(mode='wb', delete=False, suffix='.kml') as temp_kml:
-                            temp_kml.write(kml_file.read())
-                            temp_path = temp_kml.name
-                        
-                        coordenadas = ler_kml(temp_path)
-                        
-                        # Remover arquivo temporário
-                        if os.path.exists(temp_path):
-                            os.remove(temp_path)
-                        
-                        if filtrar_brasil:
-                            coordenadas = filtrar_coordenadas_brasil(coordenadas)
-                        
-                        return coordenadas
+                        coordenadas = ler_kml(kml_file)
+                    
+                    if filtrar_brasil:
+                        coordenadas = filtrar_coordenadas_brasil(coordenadas)
+                    
+                    return coordenadas
         return []
     except Exception as e:
         print(f"Erro ao ler KMZ {caminho_kmz}: {e}")
@@ -147,14 +153,19 @@ def filtrar_coordenadas_brasil(coordenadas):
 
 
 def ler_csv(caminho_csv):
-    """Lê um arquivo CSV e extrai coordenadas"""
+    """Lê um arquivo CSV (caminho ou arquivo aberto em modo binário) e extrai coordenadas"""
     try:
         coordenadas = []
         
-        with open(caminho_csv, 'r', encoding='utf-8') as f:
-            sample = f.read(1024)
-            sniffer = csv.Sniffer()
-            delimiter = sniffer.sniff(sample).delimiter
+        if hasattr(caminho_csv, 'read'):
+            caminho_csv.seek(0)
+            sample = caminho_csv.read(1024).decode('utf-8', errors='ignore')
+            caminho_csv.seek(0)
+        else:
+            with open(caminho_csv, 'r', encoding='utf-8') as f:
+                sample = f.read(1024)
+        sniffer = csv.Sniffer()
+        delimiter = sniffer.sniff(sample).delimiter
         
         df = pd.read_csv(caminho_csv, delimiter=delimiter, encoding='utf-8')
         
@@ -197,7 +208,7 @@ def ler_csv(caminho_csv):
 
 
 def ler_excel(caminho_excel):
-    """Lê um arquivo Excel (XLS ou XLSX) e extrai coordenadas"""
+    """Lê um arquivo Excel (XLS ou XLSX, caminho ou arquivo aberto) e extrai coordenadas"""
     try:
         coordenadas = []
         df = pd.read_excel(caminho_excel)
@@ -258,6 +269,7 @@ def calcular_distancia(lat1, lon1, lat2, lon2):
     return R * c
 
 
+@metrics.hot_path('routing')
 def calcular_rota_ruas(lat1, lon1, lat2, lon2):
     """Calcula rota usando OSRM e retorna (distancia_metros, geometria)"""
     try:
@@ -278,7 +290,8 @@ def calcular_rota_ruas(lat1, lon1, lat2, lon2):
         
         # Reduzir timeout para respostas mais rápidas (5 segundos ao invés de 15)
         timeout = min(getattr(settings, 'FTTH_ROUTING_TIMEOUT', 15), 5)  # Máximo 5 segundos
-        resp = requests.get(url, params=params, headers=headers, timeout=timeout)
+        with metrics.timer('upstream_request_duration_seconds', service='osrm'):
+            resp = requests.get(url, params=params, headers=headers, timeout=timeout)
         resp.raise_for_status()
         data = resp.json()
         
@@ -431,14 +444,17 @@ def get_cached_geocoding(endereco):
     try:
         # Tentar busca exata primeiro
         cache_obj = GeocodingCache.objects.get(endereco=endereco)
+        metrics.increment('geocoding_cache_requests_total', result='hit')
         return cache_obj.to_dict()
     except GeocodingCache.DoesNotExist:
         # Tentar busca normalizada
         try:
             normalized = normalize_address(endereco)
             cache_obj = GeocodingCache.objects.get(endereco=normalized)
+            metrics.increment('geocoding_cache_requests_total', result='hit')
             return cache_obj.to_dict()
         except (GeocodingCache.DoesNotExist, Exception):
+            metrics.increment('geocoding_cache_requests_total', result='miss')
             return None
 
 
@@ -467,16 +483,230 @@ def set_cached_geocoding(endereco, data):
         )
 
 
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+
+def _get_parse_pool():
+    """
+    Pool de processos (lazy, um por worker) para leitura paralela de mapas.
+    A leitura é CPU-bound (XML/pandas), então threads não ajudam por causa do GIL.
+    Retorna None quando o pool está desabilitado (FTTH_PARSE_WORKERS <= 1, o padrão:
+    o pool se multiplica pelos workers do gunicorn) ou indisponível.
+    """
+    global _parse_pool
+    workers = getattr(settings, 'FTTH_PARSE_WORKERS', 1)
+    if workers <= 1:
+        return None
+    if _parse_pool is None:
+        with _parse_pool_lock:
+            if _parse_pool is None:
+                try:
+                    # fork num worker com threads copiaria locks presos por outras threads
+                    # (logging, conexões); os filhos partem de um processo limpo e só
+                    # carregam o Django para importar as funções de leitura
+                    metodo = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                    ctx = multiprocessing.get_context(metodo)
+                    _parse_pool = ProcessPoolExecutor(
+                        max_workers=workers, mp_context=ctx, initializer=django.setup
+                    )
+                except (ValueError, OSError) as e:
+                    print(f"Pool de processos indisponível, leitura será sequencial: {e}")
+                    return None
+    return _parse_pool
+
+
+def _reset_parse_pool():
+    """Descarta um pool quebrado (ex.: processo filho morto) para ser recriado"""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is not None:
+            _parse_pool.shutdown(wait=False, cancel_futures=True)
+        _parse_pool = None
+
+
+def ler_arquivo_mapa(caminho, ext):
+    """
+    Lê um arquivo de mapa pelo tipo e mede o tempo de leitura.
+    Função de módulo para poder ser executada no pool de processos.
+
+    Returns:
+        (coordenadas, segundos)
+    """
+    inicio = time.perf_counter()
+    if ext == 'kml':
+        coords = ler_kml(caminho)
+    elif ext == 'kmz':
+        coords = ler_kmz(caminho)
+    elif ext == 'csv':
+        coords = ler_csv(caminho)
+    elif ext in ['xls', 'xlsx']:
+        coords = ler_excel(caminho)
+    else:
+        coords = []
+    return coords, time.perf_counter() - inicio
+
+
+def _ler_mapas(arquivos):
+    """
+    Lê vários mapas, em paralelo quando houver mais de um arquivo.
+
+    Args:
+        arquivos: lista de (map_id, caminho, ext)
+
+    Returns:
+        dict map_id -> (coordenadas, segundos, erro)
+    """
+    resultados = {}
+    pool = _get_parse_pool() if len(arquivos) > 1 else None
+
+    if pool is not None:
+        try:
+            futures = {
+                pool.submit(ler_arquivo_mapa, caminho, ext): map_id
+                for map_id, caminho, ext in arquivos
+            }
+            for future in as_completed(futures):
+                map_id = futures[future]
+                try:
+                    coords, elapsed = future.result()
+                    resultados[map_id] = (coords, elapsed, None)
+                except BrokenProcessPool:
+                    raise
+                except Exception as e:
+                    resultados[map_id] = ([], 0.0, str(e))
+            return _medir_leituras(arquivos, resultados)
+        except BrokenProcessPool as e:
+            print(f"Pool de leitura quebrado, refazendo leitura sequencial: {e}")
+            _reset_parse_pool()
+            resultados = {}
+
+    for map_id, caminho, ext in arquivos:
+        try:
+            coords, elapsed = ler_arquivo_mapa(caminho, ext)
+            resultados[map_id] = (coords, elapsed, None)
+        except Exception as e:
+            resultados[map_id] = ([], 0.0, str(e))
+    return _medir_leituras(arquivos, resultados)
+
+
+def _medir_leituras(arquivos, resultados):
+    """Registra o tempo de leitura de cada mapa (medido no processo que leu) por tipo"""
+    for map_id, _caminho, ext in arquivos:
+        _coords, elapsed, erro = resultados.get(map_id, ([], 0.0, None))
+        if not erro:
+            metrics.observe(metrics.HOT_PATH, elapsed, name=f'parse_{ext}')
+    return resultados
+
+
+def _normalizar_nome_cto(nome):
+    """Nome em minúsculas, sem acentos e espaços extras (para comparar CTOs)"""
+    nome = unicodedata.normalize('NFKD', str(nome or ''))
+    nome = ''.join(c for c in nome if not unicodedata.combining(c))
+    return ' '.join(nome.lower().split())
+
+
+@metrics.hot_path('dedup')
+def deduplicar_ctos(coords, tolerancia_metros=None):
+    """
+    Remove CTOs repetidos entre mapas: mesmo nome a até `tolerancia_metros`.
+
+    Usa uma grade (células do tamanho da tolerância) como índice espacial, comparando
+    cada ponto apenas com os das 9 células vizinhas em vez de todos os pares.
+    O CTO mantido acumula em `map_ids` os mapas onde também aparece.
+    """
+    if tolerancia_metros is None:
+        tolerancia_metros = getattr(settings, 'FTTH_CTO_DEDUP_TOLERANCE_M', 5)
+    if tolerancia_metros <= 0 or len(coords) < 2:
+        return coords
+
+    # ~111.32 km por grau de latitude; na longitude o grau encolhe com cos(lat), então
+    # a célula de longitude é alargada para a maior latitude do conjunto (nunca perde vizinhos)
+    latitudes = [abs(float(c['lat'])) for c in coords if isinstance(c.get('lat'), (int, float))]
+    cos_min = math.cos(math.radians(min(89.0, max(latitudes, default=0.0))))
+    celula_lat = tolerancia_metros / 111320.0
+    celula_lng = celula_lat / cos_min
+    grade = {}
+    resultado = []
+
+    for coord in coords:
+        if coord.get('tipo', 'point') != 'point':
+            resultado.append(coord)
+            continue
+        try:
+            lat = float(coord['lat'])
+            lng = float(coord['lng'])
+        except (KeyError, TypeError, ValueError):
+            resultado.append(coord)
+            continue
+
+        nome = _normalizar_nome_cto(coord.get('nome'))
+        cx, cy = int(math.floor(lat / celula_lat)), int(math.floor(lng / celula_lng))
+
+        duplicado = None
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for existente in grade.get((cx + dx, cy + dy), ()):
+                    if existente[0] == nome and calcular_distancia(lat, lng, existente[1], existente[2]) <= tolerancia_metros:
+                        duplicado = existente[3]
+                        break
+                if duplicado:
+                    break
+            if duplicado:
+                break
+
+        if duplicado is not None:
+            map_ids = duplicado.setdefault('map_ids', [duplicado.get('map_id')])
+            for map_id in coord.get('map_ids', [coord.get('map_id')]):
+                if map_id not in map_ids:
+                    map_ids.append(map_id)
+            continue
+
+        grade.setdefault((cx, cy), []).append((nome, lat, lng, coord))
+        resultado.append(coord)
+
+    return resultado
+
+
+def cto_pertence_aos_mapas(cto, map_ids):
+    """Verifica se o CTO (ou uma cópia deduplicada dele) está em algum dos mapas"""
+    ids = {str(mid) for mid in map_ids}
+    if str(cto.get('map_id')) in ids:
+        return True
+    return any(str(mid) in ids for mid in cto.get('map_ids', ()))
+
+
+def geracao_indice(company_id):
+    """Geração do namespace de cache da empresa (índice de CTOs, listagem de arquivos)"""
+    return get_generation(company_namespace(company_id))
+
+
+def avancar_geracao_indice(company_id):
+    """
+    Invalida o índice de CTOs e os demais caches da empresa num único incremento;
+    reconstruções iniciadas antes disso gravam numa chave que ninguém mais lê.
+    """
+    return bump_generation(company_namespace(company_id))
+
+
+def chave_indice(company_id, geracao):
+    """Chave do índice de CTOs da empresa numa geração"""
+    return make_key(company_namespace(company_id), 'get_all_ctos', geracao)
+
+
 def get_all_ctos(company=None):
     """Retorna todos os CTOs apenas dos arquivos enviados via upload (banco de dados)"""
     from django.core.cache import cache
     
-    # Verificar cache primeiro (por empresa)
+    # Verificar cache primeiro (por empresa): L1 do worker validado pela geração, depois Redis.
+    # Vencido ou invalidado, só quem obtém o lock de reconstrução relê os mapas
     if company:
-        cache_key = f'get_all_ctos_{company.id}'
-        cached_coords = cache.get(cache_key)
-        if cached_coords is not None:
+        geracao = geracao_indice(company.id)
+        cache_key = chave_indice(company.id, geracao)
+        cached_coords, reconstruir = cache_camadas.consultar(cache_key, geracao)
+        if not reconstruir:
             return cached_coords
+        inicio_reconstrucao = time.perf_counter()
     
     coords = []
     
@@ -489,16 +719,31 @@ def get_all_ctos(company=None):
             # Se não foi fornecida empresa, não retornar nada
             return []
         
-        # Filtrar APENAS por empresa específica - otimizar query
+        # Filtrar APENAS por empresa específica e só mapas já validados pela ingestão
         map_files = CTOMapFile.objects.filter(
             company=company, 
-            file__isnull=False
-        ).only('id', 'file', 'company_id').select_related('company')
+            file__isnull=False,
+            processing_status='completed'
+        ).only('id', 'file', 'company_id', 'content_hash').order_by('uploaded_at')
+        map_files = list(map_files)
+        
+        # Edições de CTO ainda não compactadas no arquivo (journal aplicado como overlay)
+        from .journal import edicoes_pendentes, aplicar_edicoes
+        pendentes = edicoes_pendentes([map_file.id for map_file in map_files])
         
-        # Processar cada arquivo do banco
+        # Montar lista de arquivos existentes fisicamente
+        arquivos = []
+        nomes = {}
+        # Arquivos com conteúdo idêntico são lidos uma única vez (hash -> map_id lido)
+        por_hash = {}
+        copias = {}
         for map_file in map_files:
             try:
-                # Verificar se o arquivo existe fisicamente
+                # Mapa com journal pendente diverge do arquivo: não compartilha leitura por hash
+                compartilha = map_file.content_hash and map_file.id not in pendentes
+                if compartilha and map_file.content_hash in por_hash:
+                    copias.setdefault(por_hash[map_file.content_hash], []).append(map_file.id)
+                    continue
                 if not map_file.file or not hasattr(map_file.file, 'path'):
                     continue
                 
@@ -506,36 +751,59 @@ def get_all_ctos(company=None):
                 if not os.path.exists(caminho):
                     continue
                 
-                # Determinar extensão
-                file_name = map_file.file.name
-                ext = os.path.splitext(file_name)[1].lower().lstrip('.')
-                
-                # Ler coordenadas baseado no tipo
-                try:
-                    if ext == 'kml':
-                        arquivo_coords = ler_kml(caminho)
-                    elif ext == 'kmz':
-                        arquivo_coords = ler_kmz(caminho)
-                    elif ext == 'csv':
-                        arquivo_coords = ler_csv(caminho)
-                    elif ext in ['xls', 'xlsx']:
-                        arquivo_coords = ler_excel(caminho)
-                    else:
-                        continue
-                    
-                    # Adicionar informações do arquivo
-                    for coord in arquivo_coords:
-                        coord["arquivo"] = os.path.basename(file_name)
-                        coord["map_id"] = map_file.id
-                        coords.append(coord)
-                except Exception as e:
-                    # Log erro mas continue processando outros arquivos
-                    print(f"Erro ao processar arquivo {file_name}: {e}")
+                ext = os.path.splitext(map_file.file.name)[1].lower().lstrip('.')
+                if ext not in ('kml', 'kmz', 'csv', 'xls', 'xlsx'):
                     continue
+                
+                arquivos.append((map_file.id, caminho, ext))
+                nomes[map_file.id] = os.path.basename(map_file.file.name)
+                if compartilha:
+                    por_hash[map_file.content_hash] = map_file.id
             except Exception as e:
                 # Log erro mas continue processando outros arquivos
                 print(f"Erro ao acessar arquivo {map_file.id}: {e}")
                 continue
+        
+        # Ler os arquivos (pool de processos) e juntar no índice da empresa
+        inicio = time.perf_counter()
+        resultados = _ler_mapas(arquivos)
+        diagnostico = []
+        for map_id, _caminho, _ext in arquivos:
+            arquivo_coords, elapsed, erro = resultados.get(map_id, ([], 0.0, 'sem resultado'))
+            if erro:
+                print(f"Erro ao processar arquivo {nomes[map_id]}: {erro}")
+            arquivo_coords = aplicar_edicoes(arquivo_coords, pendentes.get(map_id))
+            for coord in arquivo_coords:
+                coord["arquivo"] = nomes[map_id]
+                coord["map_id"] = map_id
+                if map_id in copias:
+                    coord["map_ids"] = [map_id] + copias[map_id]
+                coords.append(coord)
+            diagnostico.append({
+                'map_id': map_id,
+                'arquivo': nomes[map_id],
+                'pontos': len(arquivo_coords),
+                'parse_ms': round(elapsed * 1000, 1),
+                'erro': erro,
+            })
+        
+        # Remover CTOs repetidos entre mapas (mesmo nome, mesma posição)
+        antes = len(coords)
+        coords = deduplicar_ctos(coords)
+        
+        if arquivos:
+            total_ms = round((time.perf_counter() - inicio) * 1000, 1)
+            diagnostico.sort(key=lambda d: d['parse_ms'], reverse=True)
+            cache.set(f'get_all_ctos_stats_{company.id}', {
+                'total_ms': total_ms,
+                'arquivos': diagnostico,
+                'arquivos_duplicados': sum(len(ids) for ids in copias.values()),
+                'ctos_duplicados': antes - len(coords),
+            }, 3600)
+            logger.info(
+                f"get_all_ctos: empresa {company.id} reconstruída em {total_ms}ms "
+                f"({len(arquivos)} arquivos, {len(coords)} pontos)"
+            )
     except Exception as e:
         # Se houver erro ao acessar o banco, logar mas não buscar de pastas antigas
         print(f"Erro ao acessar banco de dados: {e}")
@@ -544,14 +812,60 @@ def get_all_ctos(company=None):
     # Não buscar mais de pastas antigas ou diretórios do sistema
     # Apenas usar mapas que foram enviados via upload (banco de dados)
     
-    # Cachear resultado por 1 hora (CTOs não mudam frequentemente)
+    # Cachear resultado por 1 hora (CTOs não mudam frequentemente), a menos que a geração
+    # da empresa tenha avançado durante a reconstrução (a chave antiga não é mais lida)
     if company:
-        cache_key = f'get_all_ctos_{company.id}'
-        cache.set(cache_key, coords, 3600)  # 1 hora
+        duracao = time.perf_counter() - inicio_reconstrucao
+        metrics.observe(metrics.HOT_PATH, duracao, name='index_build')
+        if geracao_indice(company.id) == geracao:
+            cache_camadas.guardar(cache_key, coords, 3600, geracao, duracao)  # 1 hora
+        else:
+            cache_camadas.liberar(cache_key)
+            logger.info(f"get_all_ctos: índice da empresa {company.id} alterado durante a reconstrução; não cacheado")
     
     return coords
 
 
+def chave_listagem(company_id):
+    """Chave da listagem de arquivos (api_arquivos) da empresa"""
+    return make_key(company_namespace(company_id), 'api_arquivos')
+
+
+def listar_arquivos(company, refresh=False):
+    """
+    Arquivos de mapas enviados pela empresa, como retornados por api_arquivos.
+
+    A listagem é a mesma para todos os usuários da empresa e fica no namespace dela:
+    upload/exclusão de mapa a invalida, então o timeout só limita o tempo em memória.
+    """
+    from core.models import CTOMapFile
+
+    cache_key = chave_listagem(company.id)
+    if not refresh:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    arquivos = []
+    # Mapas pendentes ou recusados pela validação não são listados
+    mapas = CTOMapFile.objects.filter(company=company, processing_status='completed')
+    for mapa in mapas.only('id', 'file', 'file_type').order_by('-uploaded_at'):
+        if mapa.file:
+            arquivos.append({
+                'nome': mapa.file_name,
+                'tipo': mapa.file_type,
+                'caminho': mapa.file.path,
+                'id': mapa.id
+            })
+    cache.set(cache_key, arquivos, 3600)
+    return arquivos
+
+
+def get_parse_stats(company):
+    """Tempos de leitura por arquivo da última reconstrução de CTOs da empresa"""
+    return cache.get(f'get_all_ctos_stats_{company.id}')
+
+
 def get_arquivo_caminho(arquivo):
     """Retorna o caminho completo de um arquivo baseado na extensão"""
     settings_map = {
@@ -573,33 +887,7 @@ def get_arquivo_caminho(arquivo):
 def adicionar_cto_kml(caminho_kml, nome_cto, lat, lng):
     """Adiciona um CTO a um arquivo KML"""
     try:
-        # Ler arquivo existente
-        tree = ET.parse(caminho_kml)
-        root = tree.getroot()
-        
-        ns = {'kml': 'http://www.opengis.net/kml/2.2'}
-        
-        # Encontrar ou criar Document
-        document = root.find('.//kml:Document', ns)
-        if document is None:
-            # Se não houver Document, criar um
-            document = ET.SubElement(root, '{http://www.opengis.net/kml/2.2}Document')
-        
-        # Criar novo Placemark
-        placemark = ET.SubElement(document, '{http://www.opengis.net/kml/2.2}Placemark')
-        
-        # Adicionar nome
-        name_elem = ET.SubElement(placemark, '{http://www.opengis.net/kml/2.2}name')
-        name_elem.text = nome_cto
-        
-        # Adicionar Point com coordenadas
-        point = ET.SubElement(placemark, '{http://www.opengis.net/kml/2.2}Point')
-        coords_elem = ET.SubElement(point, '{http://www.opengis.net/kml/2.2}coordinates')
-        coords_elem.text = f"{lng:.6f},{lat:.6f},0"
-        
-        # Salvar arquivo
-        tree.write(caminho_kml, encoding='utf-8', xml_declaration=True)
-        return True
+        return _aplicar_edicoes_kml(caminho_kml, [{'operacao': 'add', 'nome': nome_cto, 'lat': lat, 'lng': lng}]) > 0
     except Exception as e:
         print(f"Erro ao adicionar CTO em KML {caminho_kml}: {e}")
         return False
@@ -607,47 +895,8 @@ def adicionar_cto_kml(caminho_kml, nome_cto, lat, lng):
 
 def adicionar_cto_kmz(caminho_kmz, nome_cto, lat, lng):
     """Adiciona um CTO a um arquivo KMZ"""
-    import tempfile
-    import shutil
     try:
-        # Criar diretório temporário
-        temp_dir = tempfile.mkdtemp()
-        
-        # Extrair KMZ
-        with zipfile.ZipFile(caminho_kmz, 'r') as kmz:
-            kmz.extractall(temp_dir)
-        
-        # Encontrar arquivo KML dentro do KMZ
-        kml_file = None
-        for arquivo in os.listdir(temp_dir):
-            if arquivo.endswith('.kml'):
-                kml_file = os.path.join(temp_dir, arquivo)
-                break
-        
-        if not kml_file:
-            # Se não houver KML, criar um novo
-            kml_file = os.path.join(temp_dir, 'doc.kml')
-            root = ET.Element('{http://www.opengis.net/kml/2.2}kml')
-            document = ET.SubElement(root, '{http://www.opengis.net/kml/2.2}Document')
-            tree = ET.ElementTree(root)
-            tree.write(kml_file, encoding='utf-8', xml_declaration=True)
-        
-        # Adicionar CTO ao KML
-        if not adicionar_cto_kml(kml_file, nome_cto, lat, lng):
-            shutil.rmtree(temp_dir)
-            return False
-        
-        # Recriar KMZ
-        with zipfile.ZipFile(caminho_kmz, 'w', zipfile.ZIP_DEFLATED) as kmz:
-            for root, dirs, files in os.walk(temp_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    arcname = os.path.relpath(file_path, temp_dir)
-                    kmz.write(file_path, arcname)
-        
-        # Limpar diretório temporário
-        shutil.rmtree(temp_dir)
-        return True
+        return _aplicar_edicoes_kmz(caminho_kmz, [{'operacao': 'add', 'nome': nome_cto, 'lat': lat, 'lng': lng}]) > 0
     except Exception as e:
         print(f"Erro ao adicionar CTO em KMZ {caminho_kmz}: {e}")
         return False
@@ -656,53 +905,7 @@ def adicionar_cto_kmz(caminho_kmz, nome_cto, lat, lng):
 def adicionar_cto_csv(caminho_csv, nome_cto, lat, lng):
     """Adiciona um CTO a um arquivo CSV"""
     try:
-        # Ler CSV existente para detectar delimitador e colunas
-        with open(caminho_csv, 'r', encoding='utf-8') as f:
-            sample = f.read(1024)
-            f.seek(0)
-            sniffer = csv.Sniffer()
-            delimiter = sniffer.sniff(sample).delimiter
-            reader = csv.DictReader(f, delimiter=delimiter)
-            fieldnames = reader.fieldnames
-        
-        # Se não houver colunas de nome, lat, lng, criar padrão
-        if not fieldnames:
-            fieldnames = ['nome', 'lat', 'lng']
-        
-        # Garantir que existam colunas necessárias
-        if 'nome' not in fieldnames:
-            fieldnames.insert(0, 'nome')
-        if 'lat' not in fieldnames:
-            fieldnames.append('lat')
-        if 'lng' not in fieldnames:
-            fieldnames.append('lng')
-        
-        # Ler todos os dados existentes
-        f.seek(0)
-        reader = csv.DictReader(f, delimiter=delimiter)
-        rows = list(reader)
-        
-        # Adicionar novo CTO
-        new_row = {}
-        for field in fieldnames:
-            if field == 'nome':
-                new_row[field] = nome_cto
-            elif field == 'lat':
-                new_row[field] = str(lat)
-            elif field == 'lng':
-                new_row[field] = str(lng)
-            else:
-                new_row[field] = ''
-        
-        rows.append(new_row)
-        
-        # Escrever CSV atualizado
-        with open(caminho_csv, 'w', encoding='utf-8', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames, delimiter=delimiter)
-            writer.writeheader()
-            writer.writerows(rows)
-        
-        return True
+        return _aplicar_edicoes_csv(caminho_csv, [{'operacao': 'add', 'nome': nome_cto, 'lat': lat, 'lng': lng}]) > 0
     except Exception as e:
         print(f"Erro ao adicionar CTO em CSV {caminho_csv}: {e}")
         return False
@@ -711,39 +914,7 @@ def adicionar_cto_csv(caminho_csv, nome_cto, lat, lng):
 def adicionar_cto_excel(caminho_excel, nome_cto, lat, lng):
     """Adiciona um CTO a um arquivo Excel"""
     try:
-        # Ler Excel existente
-        df = pd.read_excel(caminho_excel)
-        
-        # Verificar se existem colunas de nome, lat, lng
-        nome_cols = [col for col in df.columns if any(keyword in col.lower() for keyword in ['nome', 'name', 'id', 'cto'])]
-        lat_cols = [col for col in df.columns if any(keyword in col.lower() for keyword in ['lat', 'latitude', 'y'])]
-        lng_cols = [col for col in df.columns if any(keyword in col.lower() for keyword in ['lng', 'lon', 'longitude', 'x'])]
-        
-        # Se não houver colunas apropriadas, criar novas
-        if not nome_cols:
-            df['nome'] = ''
-        if not lat_cols:
-            df['lat'] = None
-        if not lng_cols:
-            df['lng'] = None
-        
-        # Usar primeira coluna encontrada ou criar padrão
-        nome_col = nome_cols[0] if nome_cols else 'nome'
-        lat_col = lat_cols[0] if lat_cols else 'lat'
-        lng_col = lng_cols[0] if lng_cols else 'lng'
-        
-        # Adicionar nova linha
-        new_row = df.iloc[0].copy() if len(df) > 0 else pd.Series()
-        new_row[nome_col] = nome_cto
-        new_row[lat_col] = lat
-        new_row[lng_col] = lng
-        
-        # Adicionar ao DataFrame
-        df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-        
-        # Salvar Excel
-        df.to_excel(caminho_excel, index=False)
-        return True
+        return _aplicar_edicoes_excel(caminho_excel, [{'operacao': 'add', 'nome': nome_cto, 'lat': lat, 'lng': lng}]) > 0
     except Exception as e:
         print(f"Erro ao adicionar CTO em Excel {caminho_excel}: {e}")
         return False
@@ -772,48 +943,9 @@ def adicionar_cto_ao_mapa(caminho_arquivo, nome_cto, lat, lng, file_type=None):
 
 def remover_cto_kml(caminho_kml, lat, lng, nome_cto=None, tolerance=1e-5):
     """Remove um CTO de um arquivo KML"""
+    edicao = {'operacao': 'remove', 'nome': nome_cto, 'lat': lat, 'lng': lng, 'tolerancia': tolerance}
     try:
-        tree = ET.parse(caminho_kml)
-        root = tree.getroot()
-
-        ns = {'kml': 'http://www.opengis.net/kml/2.2'}
-        candidatos = root.findall('.//kml:Document', ns) + root.findall('.//kml:Folder', ns)
-        if not candidatos:
-            candidatos = [root]
-
-        removed = False
-        target_name = nome_cto.strip().lower() if nome_cto else None
-
-        for parent in candidatos:
-            for placemark in list(parent.findall('kml:Placemark', ns)):
-                coords_elem = placemark.find('.//kml:Point/kml:coordinates', ns)
-                if coords_elem is None or not coords_elem.text:
-                    continue
-
-                coords = coords_elem.text.strip().split(',')
-                if len(coords) < 2:
-                    continue
-
-                try:
-                    coord_lng = float(coords[0])
-                    coord_lat = float(coords[1])
-                except ValueError:
-                    continue
-
-                name_elem = placemark.find('kml:name', ns)
-                name_text = name_elem.text.strip().lower() if name_elem is not None and name_elem.text else ''
-
-                matches = _coords_match(coord_lat, coord_lng, lat, lng, tolerance)
-                if target_name:
-                    matches = matches or (name_text == target_name)
-
-                if matches:
-                    parent.remove(placemark)
-                    removed = True
-
-        if removed:
-            tree.write(caminho_kml, encoding='utf-8', xml_declaration=True)
-        return removed
+        return _aplicar_edicoes_kml(caminho_kml, [edicao]) > 0
     except Exception as e:
         print(f"Erro ao remover CTO em KML {caminho_kml}: {e}")
         return False
@@ -821,38 +953,9 @@ def remover_cto_kml(caminho_kml, lat, lng, nome_cto=None, tolerance=1e-5):
 
 def remover_cto_kmz(caminho_kmz, lat, lng, nome_cto=None, tolerance=1e-5):
     """Remove um CTO de um arquivo KMZ"""
-    import tempfile
-    import shutil
-
+    edicao = {'operacao': 'remove', 'nome': nome_cto, 'lat': lat, 'lng': lng, 'tolerancia': tolerance}
     try:
-        temp_dir = tempfile.mkdtemp()
-        with zipfile.ZipFile(caminho_kmz, 'r') as kmz:
-            kmz.extractall(temp_dir)
-
-        kml_file = None
-        for arquivo in os.listdir(temp_dir):
-            if arquivo.endswith('.kml'):
-                kml_file = os.path.join(temp_dir, arquivo)
-                break
-
-        if not kml_file:
-            shutil.rmtree(temp_dir)
-            return False
-
-        removed = remover_cto_kml(kml_file, lat, lng, nome_cto=nome_cto, tolerance=tolerance)
-        if not removed:
-            shutil.rmtree(temp_dir)
-            return False
-
-        with zipfile.ZipFile(caminho_kmz, 'w', zipfile.ZIP_DEFLATED) as kmz:
-            for root_dir, dirs, files in os.walk(temp_dir):
-                for file in files:
-                    file_path = os.path.join(root_dir, file)
-                    arcname = os.path.relpath(file_path, temp_dir)
-                    kmz.write(file_path, arcname)
-
-        shutil.rmtree(temp_dir)
-        return True
+        return _aplicar_edicoes_kmz(caminho_kmz, [edicao]) > 0
     except Exception as e:
         print(f"Erro ao remover CTO em KMZ {caminho_kmz}: {e}")
         return False
@@ -860,60 +963,9 @@ def remover_cto_kmz(caminho_kmz, lat, lng, nome_cto=None, tolerance=1e-5):
 
 def remover_cto_csv(caminho_csv, lat, lng, nome_cto=None, tolerance=1e-5):
     """Remove um CTO de um arquivo CSV"""
+    edicao = {'operacao': 'remove', 'nome': nome_cto, 'lat': lat, 'lng': lng, 'tolerancia': tolerance}
     try:
-        with open(caminho_csv, 'r', encoding='utf-8') as f:
-            sample = f.read(1024)
-            f.seek(0)
-            try:
-                delimiter = csv.Sniffer().sniff(sample).delimiter if sample else ','
-            except csv.Error:
-                delimiter = ','
-            reader = csv.DictReader(f, delimiter=delimiter)
-            fieldnames = reader.fieldnames or []
-            rows = list(reader)
-
-        if not rows:
-            return False
-
-        lat_cols = [col for col in fieldnames if any(keyword in col.lower() for keyword in ['lat', 'latitude', 'y'])]
-        lng_cols = [col for col in fieldnames if any(keyword in col.lower() for keyword in ['lng', 'lon', 'longitude', 'x'])]
-        nome_cols = [col for col in fieldnames if any(keyword in col.lower() for keyword in ['nome', 'name', 'id', 'cto'])]
-
-        if not lat_cols or not lng_cols:
-            return False
-
-        lat_col = lat_cols[0]
-        lng_col = lng_cols[0]
-        nome_col = nome_cols[0] if nome_cols else None
-        target_name = nome_cto.strip().lower() if nome_cto else None
-
-        filtered_rows = []
-        removed = False
-
-        for row in rows:
-            row_lat = _normalize_decimal(row.get(lat_col))
-            row_lng = _normalize_decimal(row.get(lng_col))
-            match = _coords_match(row_lat, row_lng, lat, lng, tolerance)
-
-            if target_name and nome_col:
-                nome_val = str(row.get(nome_col, '')).strip().lower()
-                match = match or (nome_val == target_name)
-
-            if match:
-                removed = True
-                continue
-
-            filtered_rows.append(row)
-
-        if not removed:
-            return False
-
-        with open(caminho_csv, 'w', encoding='utf-8', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames, delimiter=delimiter)
-            writer.writeheader()
-            writer.writerows(filtered_rows)
-
-        return True
+        return _aplicar_edicoes_csv(caminho_csv, [edicao]) > 0
     except Exception as e:
         print(f"Erro ao remover CTO em CSV {caminho_csv}: {e}")
         return False
@@ -921,46 +973,13 @@ def remover_cto_csv(caminho_csv, lat, lng, nome_cto=None, tolerance=1e-5):
 
 def remover_cto_excel(caminho_excel, lat, lng, nome_cto=None, tolerance=1e-5):
     """Remove um CTO de um arquivo Excel"""
+    edicao = {'operacao': 'remove', 'nome': nome_cto, 'lat': lat, 'lng': lng, 'tolerancia': tolerance}
     try:
-        df = pd.read_excel(caminho_excel)
+        return _aplicar_edicoes_excel(caminho_excel, [edicao]) > 0
     except Exception as e:
-        print(f"Erro ao ler Excel {caminho_excel}: {e}")
+        print(f"Erro ao remover CTO em Excel {caminho_excel}: {e}")
         return False
 
-    if df.empty:
-        return False
-
-    nome_cols = [col for col in df.columns if isinstance(col, str) and any(keyword in col.lower() for keyword in ['nome', 'name', 'id', 'cto'])]
-    lat_cols = [col for col in df.columns if isinstance(col, str) and any(keyword in col.lower() for keyword in ['lat', 'latitude', 'y'])]
-    lng_cols = [col for col in df.columns if isinstance(col, str) and any(keyword in col.lower() for keyword in ['lng', 'lon', 'longitude', 'x'])]
-
-    if not lat_cols or not lng_cols:
-        return False
-
-    lat_col = lat_cols[0]
-    lng_col = lng_cols[0]
-    nome_col = nome_cols[0] if nome_cols else None
-    target_name = nome_cto.strip().lower() if nome_cto else None
-
-    def _row_match(row):
-        row_lat = _normalize_decimal(row.get(lat_col))
-        row_lng = _normalize_decimal(row.get(lng_col))
-        match = _coords_match(row_lat, row_lng, lat, lng, tolerance)
-
-        if target_name and nome_col:
-            nome_val = row.get(nome_col)
-            if pd.notna(nome_val):
-                match = match or (str(nome_val).strip().lower() == target_name)
-        return match
-
-    mask = df.apply(_row_match, axis=1)
-    if not mask.any():
-        return False
-
-    df = df[~mask]
-    df.to_excel(caminho_excel, index=False)
-    return True
-
 
 def remover_cto_do_mapa(caminho_arquivo, lat, lng, nome_cto=None, file_type=None):
     """Remove um CTO de um arquivo de mapa baseado no tipo"""
@@ -982,3 +1001,235 @@ def remover_cto_do_mapa(caminho_arquivo, lat, lng, nome_cto=None, file_type=None
     print(f"Tipo de arquivo não suportado para remover CTO: {file_type}")
     return False
 
+
+
+@contextmanager
+def escrita_atomica(caminho):
+    """
+    Escreve um arquivo de mapa sem expor conteúdo parcial: entrega um caminho temporário
+    no mesmo diretório (mesma extensão), e só com o bloco concluído o temporário é
+    gravado em disco e substitui o original com os.replace. Em erro, o original fica intacto.
+    """
+    diretorio = os.path.dirname(os.path.abspath(caminho))
+    fd, temporario = tempfile.mkstemp(dir=diretorio, prefix='.tmp_', suffix=os.path.splitext(caminho)[1])
+    os.close(fd)
+    try:
+        yield temporario
+        if os.path.exists(caminho):
+            shutil.copymode(caminho, temporario)
+        fd = os.open(temporario, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.replace(temporario, caminho)
+    finally:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+
+
+def _colunas_cto(colunas):
+    """Colunas de nome, latitude e longitude de uma planilha (None quando ausentes)"""
+    colunas = [col for col in colunas if isinstance(col, str)]
+    nome_cols = [col for col in colunas if any(keyword in col.lower() for keyword in ['nome', 'name', 'id', 'cto'])]
+    lat_cols = [col for col in colunas if any(keyword in col.lower() for keyword in ['lat', 'latitude', 'y'])]
+    lng_cols = [col for col in colunas if any(keyword in col.lower() for keyword in ['lng', 'lon', 'longitude', 'x'])]
+    return (
+        nome_cols[0] if nome_cols else None,
+        lat_cols[0] if lat_cols else None,
+        lng_cols[0] if lng_cols else None,
+    )
+
+
+def _edicao_remove(edicao, lat, lng, nome):
+    """Mesmo critério de remover_cto_*: coordenada dentro da tolerância ou mesmo nome"""
+    if _coords_match(lat, lng, edicao['lat'], edicao['lng'], edicao.get('tolerancia', 1e-5)):
+        return True
+    alvo = (edicao.get('nome') or '').strip().lower()
+    return bool(alvo) and nome is not None and str(nome).strip().lower() == alvo
+
+
+def _aplicar_edicoes_kml_root(root, edicoes):
+    """Aplica as edições sobre a árvore de um KML já carregado; retorna o número de alterações"""
+    kml_ns = 'http://www.opengis.net/kml/2.2'
+    ns = {'kml': kml_ns}
+    alteracoes = 0
+
+    document = root.find('.//kml:Document', ns)
+    if document is None:
+        document = ET.SubElement(root, f'{{{kml_ns}}}Document')
+
+    for edicao in edicoes:
+        if edicao['operacao'] == 'add':
+            placemark = ET.SubElement(document, f'{{{kml_ns}}}Placemark')
+            ET.SubElement(placemark, f'{{{kml_ns}}}name').text = edicao.get('nome') or ''
+            point = ET.SubElement(placemark, f'{{{kml_ns}}}Point')
+            ET.SubElement(point, f'{{{kml_ns}}}coordinates').text = f"{edicao['lng']:.6f},{edicao['lat']:.6f},0"
+            alteracoes += 1
+            continue
+
+        candidatos = root.findall('.//kml:Document', ns) + root.findall('.//kml:Folder', ns) or [root]
+        for parent in candidatos:
+            for placemark in list(parent.findall('kml:Placemark', ns)):
+                coords_elem = placemark.find('.//kml:Point/kml:coordinates', ns)
+                if coords_elem is None or not coords_elem.text:
+                    continue
+                coords = coords_elem.text.strip().split(',')
+                if len(coords) < 2:
+                    continue
+                name_elem = placemark.find('kml:name', ns)
+                nome = name_elem.text if name_elem is not None and name_elem.text else ''
+                if _edicao_remove(edicao, _normalize_decimal(coords[1]), _normalize_decimal(coords[0]), nome):
+                    parent.remove(placemark)
+                    alteracoes += 1
+    return alteracoes
+
+
+def _aplicar_edicoes_kml(caminho_kml, edicoes, destino=None):
+    ET.register_namespace('', 'http://www.opengis.net/kml/2.2')
+    tree = ET.parse(caminho_kml)
+    alteracoes = _aplicar_edicoes_kml_root(tree.getroot(), edicoes)
+    if alteracoes:
+        with escrita_atomica(destino or caminho_kml) as temporario:
+            tree.write(temporario, encoding='utf-8', xml_declaration=True)
+    return alteracoes
+
+
+def _aplicar_edicoes_kmz(caminho_kmz, edicoes, destino=None):
+    """Reescreve o KMZ uma única vez: só o KML principal é alterado, os demais membros são copiados"""
+    ET.register_namespace('', 'http://www.opengis.net/kml/2.2')
+    with zipfile.ZipFile(caminho_kmz, 'r') as origem:
+        kml_nome = next((n for n in origem.namelist() if n.lower().endswith('.kml')), None)
+        if kml_nome:
+            root = ET.fromstring(origem.read(kml_nome))
+        else:
+            kml_nome = 'doc.kml'
+            root = ET.Element('{http://www.opengis.net/kml/2.2}kml')
+        alteracoes = _aplicar_edicoes_kml_root(root, edicoes)
+        if not alteracoes:
+            return 0
+
+        with escrita_atomica(destino or caminho_kmz) as temporario:
+            with zipfile.ZipFile(temporario, 'w', zipfile.ZIP_DEFLATED) as destino:
+                destino.writestr(kml_nome, ET.tostring(root, encoding='utf-8', xml_declaration=True))
+                for info in origem.infolist():
+                    if info.filename == kml_nome:
+                        continue
+                    with origem.open(info) as src, destino.open(info, 'w') as dst:
+                        shutil.copyfileobj(src, dst, 1024 * 1024)
+    return alteracoes
+
+
+def _aplicar_edicoes_csv(caminho_csv, edicoes, destino=None):
+    with open(caminho_csv, 'r', encoding='utf-8', newline='') as f:
+        sample = f.read(1024)
+        f.seek(0)
+        try:
+            delimiter = csv.Sniffer().sniff(sample).delimiter if sample else ','
+        except csv.Error:
+            delimiter = ','
+        reader = csv.DictReader(f, delimiter=delimiter)
+        fieldnames = list(reader.fieldnames or [])
+        rows = list(reader)
+
+    nome_col, lat_col, lng_col = _colunas_cto(fieldnames)
+    if not nome_col:
+        nome_col = 'nome'
+        fieldnames.insert(0, nome_col)
+    if not lat_col:
+        lat_col = 'lat'
+        fieldnames.append(lat_col)
+    if not lng_col:
+        lng_col = 'lng'
+        fieldnames.append(lng_col)
+
+    alteracoes = 0
+    for edicao in edicoes:
+        if edicao['operacao'] == 'add':
+            row = {field: '' for field in fieldnames}
+            row.update({nome_col: edicao.get('nome') or '', lat_col: str(edicao['lat']), lng_col: str(edicao['lng'])})
+            rows.append(row)
+            alteracoes += 1
+        else:
+            restantes = [
+                row for row in rows
+                if not _edicao_remove(edicao, _normalize_decimal(row.get(lat_col)),
+                                      _normalize_decimal(row.get(lng_col)), row.get(nome_col))
+            ]
+            alteracoes += len(rows) - len(restantes)
+            rows = restantes
+
+    if alteracoes:
+        with escrita_atomica(destino or caminho_csv) as temporario:
+            with open(temporario, 'w', encoding='utf-8', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=fieldnames, delimiter=delimiter)
+                writer.writeheader()
+                writer.writerows(rows)
+    return alteracoes
+
+
+def _aplicar_edicoes_excel(caminho_excel, edicoes, destino=None):
+    df = pd.read_excel(caminho_excel)
+    colunas = list(df.columns)
+    nome_col, lat_col, lng_col = _colunas_cto(colunas)
+    nome_col = nome_col or 'nome'
+    lat_col = lat_col or 'lat'
+    lng_col = lng_col or 'lng'
+    for col in (nome_col, lat_col, lng_col):
+        if col not in colunas:
+            colunas.append(col)
+
+    alteracoes = 0
+    registros = df.to_dict('records')
+    for edicao in edicoes:
+        if edicao['operacao'] == 'add':
+            registros.append({nome_col: edicao.get('nome') or '', lat_col: edicao['lat'], lng_col: edicao['lng']})
+            alteracoes += 1
+        else:
+            restantes = [
+                reg for reg in registros
+                if not _edicao_remove(
+                    edicao,
+                    _normalize_decimal(reg.get(lat_col)),
+                    _normalize_decimal(reg.get(lng_col)),
+                    reg.get(nome_col) if pd.notna(reg.get(nome_col)) else None,
+                )
+            ]
+            alteracoes += len(registros) - len(restantes)
+            registros = restantes
+
+    if alteracoes:
+        with escrita_atomica(destino or caminho_excel) as temporario:
+            pd.DataFrame(registros, columns=colunas).to_excel(temporario, index=False)
+    return alteracoes
+
+
+def aplicar_edicoes_ao_mapa(caminho_arquivo, edicoes, file_type=None, destino=None):
+    """
+    Aplica uma lista de edições (dicts com operacao, nome, lat, lng) ao arquivo do mapa,
+    em ordem, com uma única leitura e uma única escrita atômica do arquivo.
+
+    Com `destino`, o resultado é gravado nesse caminho e o original fica intacto
+    (sem alterações efetivas, o destino não é criado).
+    """
+    if not file_type:
+        file_type = os.path.splitext(caminho_arquivo)[1].lower().lstrip('.')
+    file_type = (file_type or '').lower()
+
+    aplicar = {
+        'kml': _aplicar_edicoes_kml,
+        'kmz': _aplicar_edicoes_kmz,
+        'csv': _aplicar_edicoes_csv,
+        'xls': _aplicar_edicoes_excel,
+        'xlsx': _aplicar_edicoes_excel,
+    }.get(file_type)
+    if not aplicar:
+        print(f"Tipo de arquivo não suportado para editar CTOs: {file_type}")
+        return False
+
+    try:
+        aplicar(caminho_arquivo, edicoes, destino)
+        return True
+    except Exception as e:
+        print(f"Erro ao aplicar edições em {caminho_arquivo}: {e}")
+        return False
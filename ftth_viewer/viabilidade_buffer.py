@@ -0,0 +1,214 @@
+"""
+Escrita write-behind do cache de viabilidade.
+
+A verificação de viabilidade não grava mais o ViabilidadeCache no caminho da
+requisição: o resultado entra numa fila em memória (uma entrada por célula
+quantizada, a última vence) e um flusher em segundo plano grava a fila em lote
+num único INSERT ... ON CONFLICT. Um LRU local pequeno garante read-your-writes
+no mesmo worker enquanto a entrada ainda não chegou ao banco.
+
+Cada entrada leva a geração de invalidação da empresa (viability_namespace em
+core.cache_namespaces) lida antes do cálculo. Invalidar avança a geração no cache
+compartilhado, então todos os workers descartam, na leitura do LRU e na hora de
+gravar o lote, as entradas calculadas antes da invalidação. Como a invalidação
+avança a geração antes do DELETE, o lote relê as gerações depois de gravar e
+apaga as linhas que acabou de gravar das empresas invalidadas no meio tempo:
+ou o DELETE da invalidação vem depois da gravação, ou a releitura já vê a nova
+geração.
+
+Com FTTH_VIABILIDADE_WRITE_BEHIND=False (testes, ambientes sem threads) a
+gravação é feita na hora, ainda pelo mesmo caminho em lote.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Q
+
+from core.cache_namespaces import bump_generation, get_generation, get_generations, viability_namespace
+
+from .models import ViabilidadeCache
+
+logger = logging.getLogger(__name__)
+
+CAMPOS_UNICOS = ['company', 'lat_q', 'lon_q', 'mapas_hash']
+# created_at renovado: a validade conta a partir do último cálculo
+CAMPOS_ATUALIZADOS = ['lat', 'lon', 'resultado', 'cto_nome', 'cto_lat', 'cto_lon', 'cto_map_id',
+                      'map_ids', 'status', 'tem_geometria', 'created_at']
+
+_lock = threading.Lock()
+_pendentes = OrderedDict()
+_recentes = OrderedDict()
+_flusher = None
+_acordar = threading.Event()
+
+
+def _chave(company_id, lat_q, lon_q, mapas_hash):
+    return (company_id, lat_q, lon_q, mapas_hash)
+
+
+def _write_behind():
+    return getattr(settings, 'FTTH_VIABILIDADE_WRITE_BEHIND', True)
+
+
+def geracao(company_id):
+    """Geração de invalidação atual dos resultados de viabilidade da empresa"""
+    return get_generation(viability_namespace(company_id))
+
+
+def buscar_local(company_id, lat_q, lon_q, mapas_hash, geracao_atual=None):
+    """
+    Resultado calculado recentemente por este worker (ainda não gravado ou recém-gravado).
+
+    Entradas de uma geração anterior (empresa invalidada por qualquer worker) são descartadas.
+    """
+    chave = _chave(company_id, lat_q, lon_q, mapas_hash)
+    validade = getattr(settings, 'FTTH_VIABILIDADE_LRU_TTL', 60)
+    if geracao_atual is None:
+        geracao_atual = geracao(company_id)
+    with _lock:
+        item = _recentes.get(chave)
+        if item is None:
+            return None
+        resultado, criado_em, geracao_item = item
+        if geracao_item != geracao_atual or time.monotonic() - criado_em > validade:
+            del _recentes[chave]
+            return None
+        _recentes.move_to_end(chave)
+        return resultado
+
+
+def enfileirar(entrada, geracao_calculo=None):
+    """
+    Agenda a gravação de um ViabilidadeCache (instância não salva).
+
+    O resultado fica disponível imediatamente em buscar_local() para este worker.
+
+    Args:
+        geracao_calculo: geração lida (geracao()) antes de calcular o resultado;
+            padrão: a atual
+    """
+    if geracao_calculo is None:
+        geracao_calculo = geracao(entrada.company_id)
+    chave = _chave(entrada.company_id, entrada.lat_q, entrada.lon_q, entrada.mapas_hash)
+    tamanho_lru = getattr(settings, 'FTTH_VIABILIDADE_LRU_TAMANHO', 1024)
+    lote = getattr(settings, 'FTTH_VIABILIDADE_FLUSH_LOTE', 200)
+
+    with _lock:
+        _pendentes[chave] = (entrada, geracao_calculo)
+        _pendentes.move_to_end(chave)
+        _recentes[chave] = (entrada.resultado, time.monotonic(), geracao_calculo)
+        _recentes.move_to_end(chave)
+        while len(_recentes) > tamanho_lru:
+            _recentes.popitem(last=False)
+        cheio = len(_pendentes) >= lote
+
+    if not _write_behind():
+        descarregar()
+        return
+    _iniciar_flusher()
+    if cheio:
+        _acordar.set()
+
+
+def descarregar():
+    """Grava num único upsert em lote as entradas pendentes ainda da geração atual da empresa"""
+    with _lock:
+        if not _pendentes:
+            return 0
+        itens = list(_pendentes.values())
+        _pendentes.clear()
+
+    try:
+        atuais = get_generations(*{viability_namespace(entrada.company_id) for entrada, _g in itens})
+    except Exception as e:
+        logger.error(f"Erro ao ler gerações de invalidação da viabilidade: {str(e)}")
+        return 0
+    # Calculadas antes de uma invalidação (de qualquer worker): gravar traria o resultado antigo de volta
+    entradas = [
+        entrada for entrada, geracao_calculo in itens
+        if atuais[viability_namespace(entrada.company_id)] == geracao_calculo
+    ]
+    if not entradas:
+        return 0
+
+    try:
+        ViabilidadeCache.objects.bulk_create(
+            entradas,
+            update_conflicts=True,
+            unique_fields=CAMPOS_UNICOS,
+            update_fields=CAMPOS_ATUALIZADOS,
+        )
+    except Exception as e:
+        # Cache é descartável: perder um lote só custa recalcular esses pontos
+        logger.error(f"Erro ao gravar {len(entradas)} resultado(s) de viabilidade em lote: {str(e)}")
+        return 0
+
+    # Invalidação entre a verificação e a gravação: o DELETE dela pode ter rodado antes do INSERT
+    try:
+        depois = get_generations(*{viability_namespace(entrada.company_id) for entrada in entradas})
+    except Exception as e:
+        # Sem como confirmar: desfazer o lote é mais seguro que servir resultado antigo
+        logger.error(f"Erro ao reler gerações de invalidação da viabilidade: {str(e)}")
+        depois = {}
+    invalidadas = [
+        entrada for entrada in entradas
+        if depois.get(viability_namespace(entrada.company_id)) != atuais[viability_namespace(entrada.company_id)]
+    ]
+    if invalidadas:
+        filtro = Q()
+        for entrada in invalidadas:
+            filtro |= Q(company_id=entrada.company_id, lat_q=entrada.lat_q,
+                        lon_q=entrada.lon_q, mapas_hash=entrada.mapas_hash)
+        try:
+            ViabilidadeCache.objects.filter(filtro).delete()
+        except Exception as e:
+            logger.error(f"Erro ao descartar resultados de viabilidade invalidados durante a gravação: {str(e)}")
+    return len(entradas) - len(invalidadas)
+
+
+def descartar_empresa(company_id):
+    """
+    Invalida os resultados em memória da empresa em todos os workers (avança a geração)
+    e esquece na hora as entradas pendentes e recentes deste worker.
+
+    Chamar antes do DELETE no ViabilidadeCache: uma entrada só é gravada se a geração
+    dela ainda for a atual.
+    """
+    bump_generation(viability_namespace(company_id))
+    with _lock:
+        for fila in (_pendentes, _recentes):
+            for chave in [c for c in fila if c[0] == company_id]:
+                del fila[chave]
+
+
+def _loop_flusher():
+    intervalo = getattr(settings, 'FTTH_VIABILIDADE_FLUSH_INTERVALO', 2)
+    while True:
+        _acordar.wait(intervalo)
+        _acordar.clear()
+        close_old_connections()
+        try:
+            descarregar()
+        except Exception as e:
+            logger.exception(f"Erro inesperado no flusher do cache de viabilidade: {str(e)}")
+        finally:
+            close_old_connections()
+
+
+def _iniciar_flusher():
+    """Cria a thread do flusher sob demanda (uma por processo)"""
+    global _flusher
+    if _flusher is not None:
+        return
+    with _lock:
+        if _flusher is None:
+            _flusher = threading.Thread(
+                target=_loop_flusher, name='viabilidade-flusher', daemon=True
+            )
+            _flusher.start()
+            atexit.register(descarregar)
@@ -2,6 +2,7 @@
 Views Django para FTTH Viewer
 """
 import os
+import time
 import requests
 import logging
 import traceback
@@ -22,12 +23,21 @@ logger = logging.getLogger(__name__)
 
 from .utils import (
     ler_kml, ler_kmz, ler_csv, ler_excel, filtrar_coordenadas_brasil,
-    calcular_distancia, calcular_rota_ruas_single, classificar_viabilidade,
-    get_all_ctos, get_arquivo_caminho, get_cached_geocoding, set_cached_geocoding,
-    remover_cto_do_mapa, normalize_address, generate_search_variations
+    calcular_distancia, calcular_rota_ruas, calcular_rota_ruas_single, classificar_viabilidade,
+    get_all_ctos, listar_arquivos, cto_pertence_aos_mapas, get_arquivo_caminho, get_cached_geocoding, set_cached_geocoding,
+    normalize_address, generate_search_variations
 )
 from .models import ViabilidadeCache
-from core.models import CTOMapFile, Company
+from .retention import inicio_validade
+from . import cache_camadas, viabilidade_buffer
+from .journal import (
+    registrar_edicao, registrar_edicoes, edicoes_pendentes, aplicar_edicoes, edicao_corresponde, chave_coordenadas
+)
+from core.cache_namespaces import get_generation, map_namespace
+from core import metrics, session_backends
+from core.rate_limiting import api_rate_limit
+from core.company_cache import get_company_by_slug
+from core.models import CTOMapFile
 
 
 @login_required
@@ -48,14 +58,6 @@ def api_arquivos(request, company_slug=None):
     # Permitir bypass do cache com parâmetro refresh
     force_refresh = request.GET.get('refresh', 'false').lower() == 'true'
     
-    # Cache baseado no usuário e empresa
-    cache_key = f'api_arquivos_{user.id}_{company_slug or (user.company.slug if user.company else "none")}'
-    
-    if not force_refresh:
-        cached_result = cache.get(cache_key)
-        if cached_result is not None:
-            return JsonResponse(cached_result, safe=False)
-    
     # Determinar empresa a ser listada
     target_company_slug = company_slug
     if not target_company_slug:
@@ -75,55 +77,36 @@ def api_arquivos(request, company_slug=None):
         if target_company_slug != user.company.slug:
             return JsonResponse({'erro': 'Acesso negado à empresa'}, status=403)
     
-    arquivos = []
+    # Listagem compartilhada por todos os usuários da empresa, no namespace dela:
+    # upload/exclusão de mapa a invalida com um único incremento de geração
+    if user.is_rm_admin or user.is_superuser:
+        if target_company_slug:
+            company = get_company_by_slug(target_company_slug, exact=True)
+        else:
+            # RM Admin sem company_slug específico: apenas mapas da empresa do usuário (se tiver)
+            company = user.company
+    else:
+        company = user.company
+    
+    if company is None:
+        # RM Admin sem empresa: não retornar mapas (precisa especificar empresa)
+        return JsonResponse([], safe=False)
     
-    # Primeiro, tentar buscar do banco de dados
     try:
-        if user.is_rm_admin or user.is_superuser:
-            if target_company_slug:
-                try:
-                    company = Company.objects.only('id', 'name', 'slug').get(slug=target_company_slug)
-                    maps = CTOMapFile.objects.filter(company=company).select_related('company').order_by('-uploaded_at')
-                except Company.DoesNotExist:
-                    maps = CTOMapFile.objects.none()
-            else:
-                # RM Admin sem company_slug específico: retornar apenas mapas da empresa do usuário (se tiver)
-                # OU retornar erro se não tiver empresa associada
-                if user.company:
-                    maps = CTOMapFile.objects.filter(company=user.company).select_related('company').order_by('-uploaded_at')
-                else:
-                    # RM Admin sem empresa: não retornar mapas (precisa especificar empresa)
-                    maps = CTOMapFile.objects.none()
-        else:
-            if not user.company:
-                return JsonResponse({'erro': 'Usuário não está associado a uma empresa'}, status=403)
-            maps = CTOMapFile.objects.filter(company=user.company).select_related('company').order_by('-uploaded_at')
-        
-        # Processar arquivos do banco
-        for mapa in maps:
-            if mapa.file:
-                arquivos.append({
-                    'nome': mapa.file_name,
-                    'tipo': mapa.file_type,
-                    'caminho': mapa.file.path if mapa.file else None,
-                    'id': mapa.id
-                })
+        arquivos = listar_arquivos(company, refresh=force_refresh)
     except Exception as e:
         # Se houver erro ao acessar o banco, logar mas não buscar de pastas antigas
         print(f"Erro ao acessar banco de dados: {e}")
-        # Não buscar mais de pastas antigas - apenas do banco de dados
+        arquivos = []
     
-    # Cachear resultado por 2 minutos
-    result = arquivos
-    cache.set(cache_key, result, 120)
-    
-    return JsonResponse(result, safe=False)
+    return JsonResponse(arquivos, safe=False)
 
 
 @login_required
 @require_http_methods(["GET"])
 def api_coordenadas(request, company_slug=None):
     """Retorna coordenadas de um arquivo específico apenas do banco de dados"""
+    cache_key = None
     try:
         arquivo_nome = request.GET.get('arquivo')
         map_id = request.GET.get('id')  # ID do mapa no banco de dados
@@ -133,12 +116,6 @@ def api_coordenadas(request, company_slug=None):
         if not arquivo_nome and not map_id:
             return JsonResponse({'erro': 'Arquivo não especificado'}, status=400)
         
-        # Cache de coordenadas (arquivos não mudam frequentemente)
-        cache_key = f'api_coordenadas_{map_id or arquivo_nome}_{company_slug or "none"}'
-        cached_coords = cache.get(cache_key)
-        if cached_coords is not None:
-            return JsonResponse(cached_coords, safe=False)
-        
         user = request.user
         caminho = None
         ext = None
@@ -146,9 +123,8 @@ def api_coordenadas(request, company_slug=None):
         # Determinar empresa - SEMPRE exigir empresa
         target_company = None
         if company_slug:
-            try:
-                target_company = Company.objects.get(slug=company_slug, is_active=True)
-            except Company.DoesNotExist:
+            target_company = get_company_by_slug(company_slug, exact=True)
+            if target_company is None or not target_company.is_active:
                 return JsonResponse({'erro': 'Empresa não encontrada'}, status=404)
         elif user.is_authenticated:
             # Para usuários normais, SEMPRE usar a empresa deles
@@ -172,7 +148,7 @@ def api_coordenadas(request, company_slug=None):
             if map_id:
                 # Buscar por ID (preferencial) - SEMPRE verificar se pertence à empresa
                 try:
-                    mapa = CTOMapFile.objects.get(id=map_id, company=target_company)
+                    mapa = CTOMapFile.objects.get(id=map_id, company=target_company, processing_status='completed')
                 except CTOMapFile.DoesNotExist:
                     return JsonResponse({'erro': 'Arquivo não encontrado ou não pertence à empresa'}, status=404)
                 
@@ -186,6 +162,7 @@ def api_coordenadas(request, company_slug=None):
                 # Tentar busca exata primeiro
                 mapa = CTOMapFile.objects.filter(
                     company=target_company,
+                    processing_status='completed',
                     file__icontains=arquivo_nome
                 ).first()
                 
@@ -195,6 +172,7 @@ def api_coordenadas(request, company_slug=None):
                     arquivo_sem_ext = os.path.splitext(arquivo_nome)[0].strip()
                     mapa = CTOMapFile.objects.filter(
                         company=target_company,
+                        processing_status='completed',
                         file__isnull=False
                     ).filter(
                         Q(file__icontains=arquivo_sem_ext) | 
@@ -205,6 +183,7 @@ def api_coordenadas(request, company_slug=None):
                     # Verificar se há outros arquivos disponíveis para a empresa
                     outros_arquivos = CTOMapFile.objects.filter(
                         company=target_company,
+                        processing_status='completed',
                         file__isnull=False
                     ).values_list('file', flat=True)[:5]
                     
@@ -232,6 +211,19 @@ def api_coordenadas(request, company_slug=None):
             logger.error(f"Erro ao buscar arquivo no banco: {e}", exc_info=True)
             return JsonResponse({'erro': f'Erro ao buscar arquivo: {str(e)}'}, status=500)
         
+        # Cache de coordenadas por versão e geração do mapa: edições avançam a versão, então
+        # entradas antigas simplesmente deixam de ser lidas (e expiram).
+        # L1 do worker antes de buscar no Redis;
+        # vencido ou ausente, só quem obtém o lock de reconstrução relê o arquivo
+        geracao = None
+        if caminho:
+            geracao = get_generation(map_namespace(mapa.id))
+            cache_key = chave_coordenadas(mapa.id, mapa.version, geracao)
+            cached_coords, reconstruir = cache_camadas.consultar(cache_key, geracao)
+            if not reconstruir:
+                return JsonResponse(cached_coords, safe=False)
+            inicio_reconstrucao = time.perf_counter()
+        
         # Não buscar mais de pastas antigas - apenas do banco de dados
         if not caminho:
             logger.warning(f"Arquivo não encontrado no banco: map_id={map_id}, arquivo={arquivo_nome}, company={target_company.slug if target_company else None}")
@@ -327,12 +319,17 @@ def api_coordenadas(request, company_slug=None):
             logger.warning(f"Tipo de arquivo não suportado: {ext}")
             return JsonResponse({'erro': f'Tipo de arquivo não suportado: {ext}'}, status=400)
         
+        # Aplicar edições de CTO ainda não compactadas no arquivo
+        coords = aplicar_edicoes(coords, edicoes_pendentes([mapa.id]).get(mapa.id))
+        
         if not coords:
             logger.warning(f"Nenhuma coordenada encontrada no arquivo: {caminho}")
             return JsonResponse({'erro': 'Nenhuma coordenada encontrada no arquivo'}, status=404)
         
-        # Cachear coordenadas por 1 hora (arquivos não mudam frequentemente)
-        cache.set(cache_key, coords, 3600)
+        # Cachear coordenadas por 1 hora, só se nenhuma edição mudou a versão durante a leitura
+        if CTOMapFile.objects.filter(id=mapa.id, version=mapa.version).exists():
+            duracao = time.perf_counter() - inicio_reconstrucao
+            cache_camadas.guardar(cache_key, coords, 3600, geracao, duracao)
         
         logger.info(f"Coordenadas carregadas com sucesso: {len(coords)} pontos do arquivo {caminho}")
         return JsonResponse(coords, safe=False)
@@ -345,6 +342,10 @@ def api_coordenadas(request, company_slug=None):
             'erro': f'Erro ao processar requisição: {str(e)}',
             'tipo': type(e).__name__
         }, status=500)
+    finally:
+        # Respostas de erro e versões alteradas durante a leitura não gravam o cache
+        if cache_key:
+            cache_camadas.liberar(cache_key)
 
 
 @login_required
@@ -416,7 +417,8 @@ def api_geocode(request, company_slug=None):
             }
             headers = {'User-Agent': 'FTTH-Viewer-Django/1.0'}
             
-            response = requests.get(url, params=params, headers=headers, timeout=10)
+            with metrics.timer('upstream_request_duration_seconds', service='nominatim'):
+                response = requests.get(url, params=params, headers=headers, timeout=10)
             response.raise_for_status()
             
             data = response.json()
@@ -466,7 +468,8 @@ def api_geocode(request, company_slug=None):
                 'Accept-Language': 'pt-BR,pt;q=0.9'
             }
             
-            response = requests.get(url, params=params, headers=headers, timeout=10)
+            with metrics.timer('upstream_request_duration_seconds', service='nominatim'):
+                response = requests.get(url, params=params, headers=headers, timeout=10)
             response.raise_for_status()
             
             data = response.json()
@@ -539,7 +542,8 @@ def api_geocode_suggestions(request, company_slug=None):
             'Accept-Language': 'pt-BR,pt;q=0.9'
         }
         
-        response = requests.get(url, params=params, headers=headers, timeout=5)
+        with metrics.timer('upstream_request_duration_seconds', service='nominatim'):
+            response = requests.get(url, params=params, headers=headers, timeout=5)
         response.raise_for_status()
         
         data = response.json()
@@ -589,9 +593,8 @@ def api_verificar_viabilidade(request, company_slug=None):
         
         # Se company_slug foi fornecido, usar ele (prioridade)
         if company_slug:
-            try:
-                company = Company.objects.get(slug=company_slug, is_active=True)
-            except Company.DoesNotExist:
+            company = get_company_by_slug(company_slug, exact=True)
+            if company is None or not company.is_active:
                 return JsonResponse({"erro": "Empresa não encontrada"}, status=404)
         elif user.is_authenticated:
             # Para usuários normais, SEMPRE usar a empresa deles
@@ -621,19 +624,29 @@ def api_verificar_viabilidade(request, company_slug=None):
             map_ids_list = [mid.strip() for mid in map_ids_param.split(',') if mid.strip()]
             # Ordenar para garantir consistência (hash sempre igual para mesmos mapas)
             map_ids_list.sort()
-            mapas_hash = ','.join(map_ids_list)
+            mapas_hash = ViabilidadeCache.hash_mapas(map_ids_list)
         
-        # Verificar cache de viabilidade - incluir empresa E mapas ativos no cache
-        try:
-            cache_obj = ViabilidadeCache.objects.get(
-                lat=lat, 
-                lon=lon, 
-                company=company,
-                mapas_hash=mapas_hash
-            )
-            return JsonResponse(cache_obj.resultado)
-        except ViabilidadeCache.DoesNotExist:
-            pass
+        # Verificar cache de viabilidade - célula quantizada + empresa + mapas ativos (chave única)
+        lat_q, lon_q = ViabilidadeCache.quantizar(lat, lon)
+        # Resultados calculados por este worker ainda podem estar na fila de escrita;
+        # a geração lida aqui (antes do cálculo) marca a entrada enfileirada abaixo
+        geracao_viabilidade = viabilidade_buffer.geracao(company.id)
+        resultado_cache = viabilidade_buffer.buscar_local(
+            company.id, lat_q, lon_q, mapas_hash, geracao_viabilidade
+        )
+        if resultado_cache is not None:
+            return JsonResponse(resultado_cache)
+        # Entradas antigas podem vir sem a geometria da rota (descartada pela retenção):
+        # a distância continua válida e o frontend busca só a rota para o desenho
+        resultado_cache = ViabilidadeCache.objects.filter(
+            company=company,
+            lat_q=lat_q,
+            lon_q=lon_q,
+            mapas_hash=mapas_hash,
+            created_at__gte=inicio_validade(company)
+        ).values_list('resultado', flat=True).first()
+        if resultado_cache is not None:
+            return JsonResponse(resultado_cache)
         
         # Company já foi determinado acima (antes de verificar cache)
         
@@ -642,7 +655,7 @@ def api_verificar_viabilidade(request, company_slug=None):
         
         # Se map_ids foram fornecidos, filtrar CTOs apenas dos mapas ativos
         if map_ids_list:
-            ctos = [cto for cto in ctos if cto.get('map_id') in map_ids_list]
+            ctos = [cto for cto in ctos if cto_pertence_aos_mapas(cto, map_ids_list)]
         
         if not ctos:
             return JsonResponse({"erro": "Nenhum CTO encontrado" + (" nos mapas selecionados" if map_ids_list else "")}, status=404)
@@ -747,13 +760,31 @@ def api_verificar_viabilidade(request, company_slug=None):
             }
         }
         
-        # Salvar no cache - incluir empresa E mapas ativos para separar caches
-        ViabilidadeCache.objects.update_or_create(
-            lat=lat,
-            lon=lon,
-            company=company,  # Incluir empresa no cache
-            mapas_hash=mapas_hash,  # Incluir hash dos mapas ativos no cache
-            defaults={'resultado': resultado}
+        # Salvar no cache - incluir empresa E mapas ativos para separar caches;
+        # CTO vencedor e mapas considerados permitem invalidar só os pontos afetados por edições
+        try:
+            cto_map_id = int(cto_mais_proximo.get("map_id"))
+        except (TypeError, ValueError):
+            cto_map_id = None
+        # Write-behind: gravado em lote pelo flusher (INSERT ... ON CONFLICT), fora da requisição
+        viabilidade_buffer.enfileirar(
+            ViabilidadeCache(
+                lat=lat,
+                lon=lon,
+                lat_q=lat_q,
+                lon_q=lon_q,
+                company=company,  # Incluir empresa no cache
+                mapas_hash=mapas_hash,  # Incluir hash dos mapas ativos no cache
+                resultado=resultado,
+                cto_nome=str(resultado["cto"]["nome"] or '')[:255],
+                cto_lat=resultado["cto"]["lat"],
+                cto_lon=resultado["cto"]["lon"],
+                cto_map_id=cto_map_id,
+                map_ids=[int(mid) for mid in map_ids_list if mid.isdigit()],
+                status=resultado["viabilidade"]["status"],
+                tem_geometria=True,
+            ),
+            geracao_viabilidade,
         )
         
         return JsonResponse(resultado)
@@ -765,6 +796,28 @@ def api_verificar_viabilidade(request, company_slug=None):
         return JsonResponse({"erro": f"Erro interno do servidor: {str(e)}"}, status=500)
 
 
+@login_required
+@require_http_methods(["GET"])
+@api_rate_limit
+def api_rota_viabilidade(request, company_slug=None):
+    """
+    Geometria da rota por ruas entre o ponto consultado e o CTO, para resultados do cache
+    de viabilidade cuja geometria já foi descartada. Passa pelo mesmo cliente OSRM (e cache
+    de rotas) da verificação: o navegador não consulta o OSRM diretamente.
+    """
+    try:
+        lat, lon, cto_lat, cto_lon = (
+            float(request.GET[campo]) for campo in ('lat', 'lon', 'cto_lat', 'cto_lon')
+        )
+    except (KeyError, ValueError, TypeError):
+        return JsonResponse({"erro": "Coordenadas inválidas"}, status=400)
+    if not all(-90 <= v <= 90 for v in (lat, cto_lat)) or not all(-180 <= v <= 180 for v in (lon, cto_lon)):
+        return JsonResponse({"erro": "Coordenadas inválidas"}, status=400)
+
+    _distancia, geometria = calcular_rota_ruas(lat, lon, cto_lat, cto_lon)
+    return JsonResponse({"rota": {"geometria": geometria}})
+
+
 @login_required
 @require_http_methods(["GET"])
 def api_cache_geocoding_stats(request, company_slug=None):
@@ -789,6 +842,19 @@ def api_cache_geocoding_stats(request, company_slug=None):
     })
 
 
+@login_required
+@require_http_methods(["GET"])
+def api_cache_stats(request, company_slug=None):
+    """Estatísticas do cache em duas camadas (L1 deste worker e L2/Redis) e das gravações de sessão"""
+    # Dados de operação da plataforma inteira: apenas RM Admin
+    if not request.user.is_rm_admin and not request.user.is_superuser:
+        return JsonResponse({'erro': 'Acesso negado'}, status=403)
+    
+    stats = cache_camadas.estatisticas()
+    stats['sessoes'] = session_backends.estatisticas()
+    return JsonResponse(stats)
+
+
 @login_required
 @require_http_methods(["POST"])
 def api_cache_geocoding_clear(request, company_slug=None):
@@ -801,10 +867,9 @@ def api_cache_geocoding_clear(request, company_slug=None):
 
 @ensure_csrf_cookie
 @require_http_methods(["POST"])
+@api_rate_limit
 def api_adicionar_cto(request, company_slug=None):
     """Adiciona um novo CTO a um mapa existente - apenas para COMPANY_ADMIN e RM"""
-    from .utils import adicionar_cto_ao_mapa
-    from django.core.cache import cache
     
     # Verificar autenticação manualmente para retornar JSON em vez de redirecionar
     if not request.user.is_authenticated:
@@ -845,7 +910,7 @@ def api_adicionar_cto(request, company_slug=None):
     
     # Buscar mapa
     try:
-        mapa = CTOMapFile.objects.get(id=map_id)
+        mapa = CTOMapFile.objects.get(id=map_id, processing_status='completed')
     except CTOMapFile.DoesNotExist:
         return JsonResponse({'erro': 'Mapa não encontrado'}, status=404)
     
@@ -862,29 +927,9 @@ def api_adicionar_cto(request, company_slug=None):
     if not os.path.exists(caminho_arquivo):
         return JsonResponse({'erro': 'Arquivo do mapa não existe no sistema de arquivos'}, status=404)
     
-    # Adicionar CTO ao arquivo
+    # Registrar no journal do mapa (o arquivo é atualizado na compactação)
     try:
-        sucesso = adicionar_cto_ao_mapa(
-            caminho_arquivo,
-            nome_cto,
-            lat,
-            lon,
-            file_type=mapa.file_type
-        )
-        
-        if not sucesso:
-            return JsonResponse({'erro': 'Erro ao adicionar CTO ao arquivo'}, status=500)
-        
-        # Invalidar caches relacionados
-        cache_keys_to_delete = [
-            f'api_arquivos_{user.id}_{company_slug or (user.company.slug if user.company else "none")}',
-            f'api_coordenadas_{map_id}_{company_slug or "none"}',
-        ]
-        cache.delete_many(cache_keys_to_delete)
-        
-        # Atualizar contador de coordenadas do mapa (opcional)
-        # Isso pode ser feito em background ou na próxima leitura
-        
+        registrar_edicao(mapa, 'add', lat, lon, nome=nome_cto, user=user)
         return JsonResponse({
             'sucesso': True,
             'mensagem': f'CTO "{nome_cto}" adicionado com sucesso ao mapa',
@@ -904,9 +949,9 @@ def api_adicionar_cto(request, company_slug=None):
 
 @ensure_csrf_cookie
 @require_http_methods(["POST"])
+@api_rate_limit
 def api_remover_cto(request, company_slug=None):
     """Remove um CTO existente de um arquivo de mapa - apenas para COMPANY_ADMIN e RM"""
-    from django.core.cache import cache
 
     if not request.user.is_authenticated:
         return JsonResponse({'erro': 'Usuário não autenticado'}, status=401)
@@ -940,7 +985,7 @@ def api_remover_cto(request, company_slug=None):
         return JsonResponse({'erro': 'Coordenadas inválidas'}, status=400)
 
     try:
-        mapa = CTOMapFile.objects.get(id=map_id)
+        mapa = CTOMapFile.objects.get(id=map_id, processing_status='completed')
     except CTOMapFile.DoesNotExist:
         return JsonResponse({'erro': 'Mapa não encontrado'}, status=404)
 
@@ -956,28 +1001,15 @@ def api_remover_cto(request, company_slug=None):
         return JsonResponse({'erro': 'Arquivo do mapa não existe no sistema de arquivos'}, status=404)
 
     try:
-        removido = remover_cto_do_mapa(
-            caminho_arquivo,
-            lat,
-            lon,
-            nome_cto=nome_cto,
-            file_type=mapa.file_type
+        # Conteúdo atual do mapa = arquivo + journal pendente (já aplicado em get_all_ctos)
+        existe = any(
+            cto_pertence_aos_mapas(cto, [mapa.id]) and edicao_corresponde(cto, lat, lon, nome_cto)
+            for cto in get_all_ctos(mapa.company)
         )
-
-        if not removido:
+        if not existe:
             return JsonResponse({'erro': 'CTO não encontrado no arquivo'}, status=404)
 
-        cache_keys_to_delete = [
-            f'api_arquivos_{user.id}_{company_slug or (user.company.slug if user.company else "none")}',
-            f'api_coordenadas_{map_id}_{company_slug or "none"}',
-        ]
-        cache.delete_many(cache_keys_to_delete)
-
-        ViabilidadeCache.objects.filter(
-            lat=lat,
-            lon=lon,
-            company=mapa.company
-        ).delete()
+        registrar_edicao(mapa, 'remove', lat, lon, nome=nome_cto, user=user)
 
         return JsonResponse({
             'sucesso': True,
@@ -990,3 +1022,135 @@ def api_remover_cto(request, company_slug=None):
         print(f"Traceback: {traceback.format_exc()}")
         return JsonResponse({'erro': f'Erro interno: {str(e)}'}, status=500)
 
+
+
+MAX_OPERACOES_LOTE = 500
+
+
+@ensure_csrf_cookie
+@require_http_methods(["POST"])
+@api_rate_limit
+def api_editar_ctos_lote(request, company_slug=None):
+    """
+    Aplica um lote de operações de CTO (add/remove/move) em um mapa - apenas para COMPANY_ADMIN e RM.
+
+    Corpo: {"map_id": 1, "operacoes": [{"operacao": "add", "nome_cto": "...", "lat": .., "lon": ..},
+    {"operacao": "remove", "nome_cto": "...", "lat": .., "lon": ..},
+    {"operacao": "move", "nome_cto": "...", "lat": .., "lon": .., "nova_lat": .., "nova_lon": ..}]}
+
+    As operações válidas viram um único lote no journal do mapa (o arquivo é reescrito
+    uma vez só, na compactação); as inválidas são reportadas sem interromper as demais.
+    """
+    import json
+
+    if not request.user.is_authenticated:
+        return JsonResponse({'erro': 'Usuário não autenticado'}, status=401)
+
+    user = request.user
+
+    if not (user.is_company_admin or user.is_rm_admin or user.is_superuser):
+        return JsonResponse({'erro': 'Apenas administradores podem editar CTOs'}, status=403)
+
+    try:
+        data = json.loads(request.body) if request.body else {}
+    except json.JSONDecodeError:
+        return JsonResponse({'erro': 'Dados inválidos'}, status=400)
+
+    map_id = data.get('map_id')
+    operacoes = data.get('operacoes')
+
+    if not map_id:
+        return JsonResponse({'erro': 'ID do mapa é obrigatório'}, status=400)
+
+    if not isinstance(operacoes, list) or not operacoes:
+        return JsonResponse({'erro': 'Lista de operações é obrigatória'}, status=400)
+
+    if len(operacoes) > MAX_OPERACOES_LOTE:
+        return JsonResponse({'erro': f'Máximo de {MAX_OPERACOES_LOTE} operações por lote'}, status=400)
+
+    try:
+        mapa = CTOMapFile.objects.select_related('company').get(id=map_id, processing_status='completed')
+    except CTOMapFile.DoesNotExist:
+        return JsonResponse({'erro': 'Mapa não encontrado'}, status=404)
+
+    if not user.is_rm_admin and not user.is_superuser:
+        if not user.company or user.company != mapa.company:
+            return JsonResponse({'erro': 'Acesso negado ao mapa'}, status=403)
+
+    if not mapa.file or not hasattr(mapa.file, 'path') or not os.path.exists(mapa.file.path):
+        return JsonResponse({'erro': 'Arquivo do mapa não existe no sistema de arquivos'}, status=404)
+
+    def _coordenada(op, campo_lat, campo_lon):
+        try:
+            return float(op.get(campo_lat)), float(op.get(campo_lon))
+        except (ValueError, TypeError):
+            return None
+
+    # Estado atual do mapa (arquivo + journal), atualizado a cada operação do lote
+    estado = [
+        cto for cto in get_all_ctos(mapa.company)
+        if cto.get('tipo', 'point') == 'point' and cto_pertence_aos_mapas(cto, [mapa.id])
+    ]
+    edicoes = []
+    resultados = []
+
+    for indice, op in enumerate(operacoes):
+        if not isinstance(op, dict):
+            resultados.append({'indice': indice, 'sucesso': False, 'erro': 'Operação inválida'})
+            continue
+
+        tipo = (op.get('operacao') or op.get('op') or '').strip().lower()
+        nome_cto = (op.get('nome_cto') or op.get('nome') or '').strip()
+        resultado = {'indice': indice, 'operacao': tipo, 'sucesso': False}
+        resultados.append(resultado)
+
+        if tipo not in ('add', 'remove', 'move'):
+            resultado['erro'] = 'Operação deve ser add, remove ou move'
+            continue
+
+        coordenada = _coordenada(op, 'lat', 'lon')
+        if coordenada is None:
+            resultado['erro'] = 'Coordenadas inválidas'
+            continue
+        lat, lon = coordenada
+
+        if tipo == 'add':
+            if not nome_cto:
+                resultado['erro'] = 'Nome do CTO é obrigatório'
+                continue
+            novas = [{'operacao': 'add', 'nome': nome_cto, 'lat': lat, 'lng': lon}]
+        else:
+            alvo = next((cto for cto in estado if edicao_corresponde(cto, lat, lon, nome_cto)), None)
+            if alvo is None:
+                resultado['erro'] = 'CTO não encontrado no mapa'
+                continue
+            novas = [{'operacao': 'remove', 'nome': nome_cto, 'lat': lat, 'lng': lon}]
+            if tipo == 'move':
+                destino = _coordenada(op, 'nova_lat', 'nova_lon')
+                if destino is None:
+                    resultado['erro'] = 'Novas coordenadas inválidas'
+                    continue
+                novas.append({'operacao': 'add', 'nome': nome_cto or alvo.get('nome') or '', 'lat': destino[0], 'lng': destino[1]})
+
+        for edicao in novas:
+            if edicao['operacao'] == 'add':
+                estado.append({'nome': edicao['nome'], 'lat': edicao['lat'], 'lng': edicao['lng'], 'tipo': 'point'})
+            else:
+                estado = [cto for cto in estado if not edicao_corresponde(cto, edicao['lat'], edicao['lng'], edicao['nome'])]
+        edicoes.extend(novas)
+        resultado['sucesso'] = True
+
+    aplicadas = sum(1 for r in resultados if r['sucesso'])
+    if edicoes:
+        try:
+            registrar_edicoes(mapa, edicoes, user=user)
+        except Exception as e:
+            logger.error(f"Erro ao registrar lote de edições do mapa {map_id}: {e}", exc_info=True)
+            return JsonResponse({'erro': f'Erro interno: {str(e)}'}, status=500)
+
+    return JsonResponse({
+        'sucesso': aplicadas == len(operacoes),
+        'aplicadas': aplicadas,
+        'falhas': len(operacoes) - aplicadas,
+        'resultados': resultados,
+    })
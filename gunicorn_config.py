@@ -9,6 +9,9 @@ chdir = "/var/www/saas-viabilidade"
 wsgi_app = "saas_viabilidade.wsgi:application"
 
 # Configuração de workers
+# Cada worker tem seus próprios pools: com FTTH_PARSE_WORKERS > 1 são até
+# workers × FTTH_PARSE_WORKERS processos extras de leitura de mapas por host
+# (padrão 1 = leitura no próprio worker; paralelismo só no warm_caches --parse-workers)
 workers = multiprocessing.cpu_count() * 2 + 1
 worker_class = "sync"
 worker_connections = 1000
@@ -59,6 +62,14 @@ def when_ready(server):
     """Callback quando o servidor está pronto para aceitar conexões"""
     server.log.info("✅ Servidor Gunicorn pronto para aceitar conexões")
 
+    # Pré-aquecimento opcional dos caches de mapas, em processo separado para não
+    # atrasar o master nem compartilhar conexões de banco com os workers
+    if os.getenv('WARM_CACHES_ON_START', 'False').lower() == 'true':
+        import subprocess
+        import sys
+        subprocess.Popen([sys.executable, 'manage.py', 'warm_caches'], cwd=chdir)
+        server.log.info("🔥 Pré-aquecimento de caches iniciado em segundo plano")
+
 def on_exit(server):
     """Callback quando o servidor encerra"""
     server.log.info("👋 Servidor Gunicorn encerrando...")
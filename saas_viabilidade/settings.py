@@ -79,6 +79,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "core.middleware_metrics.MetricsMiddleware",  # Primeiro: mede também os demais middlewares
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",  # Deve vir logo após SecurityMiddleware
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -90,6 +91,7 @@ MIDDLEWARE = [
     "core.security_headers.SecurityHeadersMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "core.middleware_profiling.ProfilingMiddleware",  # Último: envolve só resolução de URL, view e renderização
 ]
 
 ROOT_URLCONF = "saas_viabilidade.urls"
@@ -297,6 +299,10 @@ SESSION_COOKIE_HTTPONLY = True
 SESSION_COOKIE_SAMESITE = 'Lax' if DEBUG else 'Lax'  # Lax é mais compatível que Strict
 SESSION_EXPIRE_AT_BROWSER_CLOSE = True
 SESSION_SAVE_EVERY_REQUEST = True
+# Sessão não alterada só é regravada (renovando a expiração) após esta fração de
+# SESSION_COOKIE_AGE. Banco apenas: o cache local em memória não é compartilhado entre workers
+SESSION_ENGINE = 'core.session_backends.db'
+SESSION_REFRESH_FRACTION = float(os.getenv('SESSION_REFRESH_FRACTION', '0.1'))
 
 # Configurações CSRF - Segurança aprimorada
 CSRF_COOKIE_SECURE = not DEBUG
@@ -311,6 +317,39 @@ X_FRAME_OPTIONS = "DENY"
 # URLs tolerantes à ausência de barra final
 APPEND_SLASH = True
 
+# Resolução slug -> empresa em cache (core.company_cache), invalidada ao salvar a empresa
+COMPANY_CACHE_TIMEOUT = int(os.getenv('COMPANY_CACHE_TIMEOUT', '3600'))
+
+# Fração das requisições de empresa autorizadas registradas no log 'security' (INFO)
+SECURITY_ACCESS_LOG_SAMPLE_RATE = float(os.getenv('SECURITY_ACCESS_LOG_SAMPLE_RATE', '0.01'))
+
+# Auditoria (core.audit_logger): emissão via fila com sinks numa thread por processo.
+# Arquivo com rotação por tamanho e por tempo; banco (AuditEvent) gravado em lote
+AUDIT_LOG_ASYNC = os.getenv('AUDIT_LOG_ASYNC', 'True').lower() == 'true'
+AUDIT_LOG_FILE = os.getenv('AUDIT_LOG_FILE', str(BASE_DIR / 'logs' / 'audit.log'))
+AUDIT_LOG_MAX_BYTES = int(os.getenv('AUDIT_LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+AUDIT_LOG_BACKUP_COUNT = int(os.getenv('AUDIT_LOG_BACKUP_COUNT', '10'))
+AUDIT_LOG_ROTATE_INTERVAL = int(os.getenv('AUDIT_LOG_ROTATE_INTERVAL', '86400'))
+AUDIT_DB_ENABLED = os.getenv('AUDIT_DB_ENABLED', 'False').lower() == 'true'
+AUDIT_DB_BATCH = int(os.getenv('AUDIT_DB_BATCH', '100'))
+AUDIT_DB_FLUSH_INTERVAL = float(os.getenv('AUDIT_DB_FLUSH_INTERVAL', '2'))
+
+# Instrumentação (core.metrics): histogramas por view, consultas ao banco, caches e
+# serviços externos. Deltas de cada worker somados no Redis a cada METRICS_FLUSH_INTERVAL
+# segundos; /rm/metricas/ (RM ou "Authorization: Bearer METRICS_TOKEN") expõe o texto do Prometheus
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True').lower() == 'true'
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '10'))
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# Perfil de requisições (core.profiling): sob demanda por RM ("X-Profile: 1" ou
+# "?_profile=1" para cProfile, "sample" para amostragem de pilhas) ou sorteado com
+# PROFILING_SAMPLE_RATE; guarda as PROFILING_TOP_N principais pilhas em /rm/perfis/
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'True').lower() == 'true'
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', '0'))
+PROFILING_INTERVAL_MS = float(os.getenv('PROFILING_INTERVAL_MS', '5'))
+PROFILING_TOP_N = int(os.getenv('PROFILING_TOP_N', '30'))
+PROFILING_MAX_PROFILES = int(os.getenv('PROFILING_MAX_PROFILES', '200'))
+
 # Configurações de tratamento de erros
 handler404 = 'core.error_views.custom_404'
 handler500 = 'core.error_views.custom_500'
@@ -339,6 +378,59 @@ ROUTING_TIMEOUT = int(os.getenv('ROUTING_TIMEOUT', '15'))  # Timeout em segundos
 ENABLE_ROUTE_CACHE = True
 MAX_CACHE_SIZE = 1000
 
+# Processos para leitura paralela dos mapas ao reconstruir o cache de CTOs (1 = sequencial).
+# O pool é de cada processo: com N workers do gunicorn (gunicorn_config.py) são até
+# N × FTTH_PARSE_WORKERS processos extras com o Django carregado por host. Por isso o
+# padrão é 1 no servidor web; warm_caches aceita --parse-workers para o aquecimento.
+FTTH_PARSE_WORKERS = int(os.getenv('FTTH_PARSE_WORKERS', '1'))
+
+# CTOs com o mesmo nome a até esta distância (metros) em mapas diferentes são tratados como um só
+FTTH_CTO_DEDUP_TOLERANCE_M = float(os.getenv('FTTH_CTO_DEDUP_TOLERANCE_M', '5'))
+
+# Edições de CTO pendentes no journal de um mapa que disparam a compactação no arquivo
+FTTH_JOURNAL_COMPACT_THRESHOLD = int(os.getenv('FTTH_JOURNAL_COMPACT_THRESHOLD', '20'))
+
+# Fila de ingestão de mapas (validação/leitura em segundo plano após o upload)
+MAP_INGESTION_WORKERS = int(os.getenv('MAP_INGESTION_WORKERS', '2'))
+MAP_INGESTION_ASYNC = os.getenv('MAP_INGESTION_ASYNC', 'True').lower() == 'true'
+# Segundos em 'processing' após os quais process_pending_maps considera o job perdido
+MAP_INGESTION_STALE_S = int(os.getenv('MAP_INGESTION_STALE_S', '1800'))
+
+# Resolução (metros) da grade que quantiza as coordenadas do cache de viabilidade
+FTTH_VIABILIDADE_CACHE_RESOLUCAO_M = float(os.getenv('FTTH_VIABILIDADE_CACHE_RESOLUCAO_M', '5'))
+
+# Retenção do cache de viabilidade (purge_viability_cache): validade padrão em dias
+# (Company.viability_cache_ttl_days sobrepõe), máximo de linhas por empresa e idade
+# a partir da qual a geometria da rota é descartada
+FTTH_VIABILIDADE_CACHE_TTL_DIAS = int(os.getenv('FTTH_VIABILIDADE_CACHE_TTL_DIAS', '30'))
+FTTH_VIABILIDADE_CACHE_MAX_LINHAS = int(os.getenv('FTTH_VIABILIDADE_CACHE_MAX_LINHAS', '50000'))
+FTTH_VIABILIDADE_GEOMETRIA_DIAS = int(os.getenv('FTTH_VIABILIDADE_GEOMETRIA_DIAS', '7'))
+
+# Escrita write-behind do cache de viabilidade: fila em memória gravada em lote a cada
+# FTTH_VIABILIDADE_FLUSH_INTERVALO segundos (ou ao atingir FTTH_VIABILIDADE_FLUSH_LOTE
+# entradas) e LRU local para read-your-writes no mesmo worker
+FTTH_VIABILIDADE_WRITE_BEHIND = os.getenv('FTTH_VIABILIDADE_WRITE_BEHIND', 'True').lower() == 'true'
+FTTH_VIABILIDADE_FLUSH_INTERVALO = float(os.getenv('FTTH_VIABILIDADE_FLUSH_INTERVALO', '2'))
+FTTH_VIABILIDADE_FLUSH_LOTE = int(os.getenv('FTTH_VIABILIDADE_FLUSH_LOTE', '200'))
+FTTH_VIABILIDADE_LRU_TAMANHO = int(os.getenv('FTTH_VIABILIDADE_LRU_TAMANHO', '1024'))
+FTTH_VIABILIDADE_LRU_TTL = int(os.getenv('FTTH_VIABILIDADE_LRU_TTL', '60'))
+
+# Orçamento em bytes do LRU local (L1) na frente do Redis para get_all_ctos e api_coordenadas
+FTTH_CACHE_LOCAL_MAX_BYTES = int(os.getenv('FTTH_CACHE_LOCAL_MAX_BYTES', str(64 * 1024 * 1024)))
+
+# Proteção contra stampede nesses caches: tempo extra em que o valor vencido ainda é servido
+# durante a reconstrução, duração do lock de reconstrução, espera máxima de quem não tem
+# valor antigo e agressividade da renovação antecipada (XFetch; 0 desativa)
+FTTH_CACHE_STALE_S = int(os.getenv('FTTH_CACHE_STALE_S', '600'))
+FTTH_CACHE_REBUILD_LOCK_S = int(os.getenv('FTTH_CACHE_REBUILD_LOCK_S', '60'))
+FTTH_CACHE_REBUILD_ESPERA_S = float(os.getenv('FTTH_CACHE_REBUILD_ESPERA_S', '10'))
+FTTH_CACHE_XFETCH_BETA = float(os.getenv('FTTH_CACHE_XFETCH_BETA', '1.0'))
+
+# Pré-aquecimento dos caches de mapas (warm_caches): empresas aquecidas ao mesmo tempo
+# e reconstrução dos caches da empresa logo após a ingestão de um mapa
+FTTH_AQUECIMENTO_CONCORRENCIA = int(os.getenv('FTTH_AQUECIMENTO_CONCORRENCIA', '2'))
+FTTH_AQUECER_APOS_UPLOAD = os.getenv('FTTH_AQUECER_APOS_UPLOAD', 'True').lower() == 'true'
+
 # Configurações de viabilidade (distâncias em metros)
 FTTH_VIABILIDADE_CONFIG = {
     'viavel': int(os.getenv('VIABILIDADE_VIABLE', '300')),      # Até 300m = Viável
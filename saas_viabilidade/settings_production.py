@@ -62,6 +62,10 @@ SESSION_COOKIE_SAMESITE = 'Strict'
 SESSION_EXPIRE_AT_BROWSER_CLOSE = True
 SESSION_COOKIE_AGE = 3600  # 1 hora
 SESSION_SAVE_EVERY_REQUEST = True
+# Sessões no Redis com fallback no banco; sessão não alterada só é regravada
+# (renovando a expiração) após esta fração de SESSION_COOKIE_AGE
+SESSION_ENGINE = 'core.session_backends.cached_db'
+SESSION_REFRESH_FRACTION = float(os.getenv('SESSION_REFRESH_FRACTION', '0.1'))
 SESSION_COOKIE_NAME = 'rmsys_sessionid'
 
 # Configurações de CSRF - Segurança máxima
@@ -156,6 +160,31 @@ LOGGING = {
     },
 }
 
+# Auditoria (core.audit_logger): fila assíncrona, arquivo com rotação por tamanho e
+# por tempo e eventos consultáveis no banco (AuditEvent) gravados em lote
+AUDIT_LOG_ASYNC = True
+AUDIT_LOG_FILE = str(BASE_DIR / 'logs' / 'audit.log')
+AUDIT_LOG_MAX_BYTES = int(os.getenv('AUDIT_LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+AUDIT_LOG_BACKUP_COUNT = int(os.getenv('AUDIT_LOG_BACKUP_COUNT', '10'))
+AUDIT_LOG_ROTATE_INTERVAL = int(os.getenv('AUDIT_LOG_ROTATE_INTERVAL', '86400'))
+AUDIT_DB_ENABLED = os.getenv('AUDIT_DB_ENABLED', 'True').lower() == 'true'
+AUDIT_DB_BATCH = int(os.getenv('AUDIT_DB_BATCH', '100'))
+AUDIT_DB_FLUSH_INTERVAL = float(os.getenv('AUDIT_DB_FLUSH_INTERVAL', '2'))
+
+# Instrumentação (core.metrics): deltas de cada worker somados no Redis; /rm/metricas/
+# acessível a RM ou ao scraper do Prometheus com "Authorization: Bearer METRICS_TOKEN"
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True').lower() == 'true'
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '10'))
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# Perfil de requisições (core.profiling): sob demanda por RM ou amostrado por
+# PROFILING_SAMPLE_RATE (amostragem de pilhas, custo baixo); listagem em /rm/perfis/
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'True').lower() == 'true'
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', '0'))
+PROFILING_INTERVAL_MS = float(os.getenv('PROFILING_INTERVAL_MS', '5'))
+PROFILING_TOP_N = int(os.getenv('PROFILING_TOP_N', '30'))
+PROFILING_MAX_PROFILES = int(os.getenv('PROFILING_MAX_PROFILES', '200'))
+
 # Configurações de segurança
 SECURE_BROWSER_XSS_FILTER = True
 SECURE_CONTENT_TYPE_NOSNIFF = True
@@ -204,6 +233,7 @@ if SENTRY_DSN:
 
 # Middleware de produção
 MIDDLEWARE = [
+    'core.middleware_metrics.MetricsMiddleware',  # Primeiro: mede também os demais middlewares
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # Para servir arquivos estáticos
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -214,6 +244,7 @@ MIDDLEWARE = [
     'core.security_headers.SecurityHeadersMiddleware',  # Headers de segurança
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.middleware_profiling.ProfilingMiddleware',  # Último: envolve só resolução de URL, view e renderização
 ]
 
 # Apps instalados
@@ -1848,6 +1848,28 @@ function hideViabilityLoading() {
     }
 }
 
+// Geometria da rota por ruas pelo servidor (resultados antigos do cache vêm sem ela)
+async function buscarGeometriaRota(lat1, lon1, lat2, lon2) {
+    const params = new URLSearchParams({
+        lat: lat1.toString(),
+        lon: lon1.toString(),
+        cto_lat: lat2.toString(),
+        cto_lon: lon2.toString()
+    });
+    try {
+        const response = await fetch(`${API_BASE}/rota-viabilidade?${params.toString()}`);
+        if (!response.ok) {
+            return null;
+        }
+        const data = await response.json();
+        const coords = data.rota?.geometria;
+        return Array.isArray(coords) && coords.length > 0 ? coords.map(coord => [coord[1], coord[0]]) : null;
+    } catch (error) {
+        console.warn('Rota por ruas indisponível:', error);
+        return null;
+    }
+}
+
 // Função para verificar viabilidade
 async function verificarViabilidade(lat, lon, endereco = '') {
     try {
@@ -2035,6 +2057,7 @@ async function verificarViabilidade(lat, lon, endereco = '') {
 
         // Desenhar linha seguindo a rota das ruas - Estilo Google Maps
         let routeCoordinates = [];
+        let buscarRota = false;
         
         if (data.rota?.geometria && Array.isArray(data.rota.geometria) && data.rota.geometria.length > 0) {
             // Converter coordenadas da rota de [lon, lat] para [lat, lon] para o Leaflet
@@ -2046,6 +2069,8 @@ async function verificarViabilidade(lat, lon, endereco = '') {
                 [data.cto?.lat || 0, data.cto?.lon || 0]
             ];
             console.log('⚠️ Usando linha reta - rota por ruas não disponível');
+            // Resultado do cache com a geometria já descartada: buscar só a rota para o desenho
+            buscarRota = Boolean(data.rota) && data.cto?.lat != null && data.cto?.lon != null;
         }
         
         // Remover linha anterior se existir
@@ -2080,6 +2105,18 @@ async function verificarViabilidade(lat, lon, endereco = '') {
             lineJoin: 'round'
         }).addTo(map);
         
+        if (buscarRota) {
+            const linha = window.viabilityLine;
+            const borda = window.routeBorder;
+            buscarGeometriaRota(lat, lon, data.cto.lat, data.cto.lon).then(coords => {
+                // Ignorar se outra verificação já substituiu a linha
+                if (coords && window.viabilityLine === linha) {
+                    linha.setLatLngs(coords);
+                    borda.setLatLngs(coords);
+                }
+            });
+        }
+        
         // Adicionar efeito de animação pulsante
         let pulseOpacity = 1.0;
         let increasing = false;